@@ -0,0 +1,137 @@
+"""Module for listing the members of tar and zip archives.
+
+Archives are streamed rather than extracted: each archive is read once,
+sequentially, and its members are hashed in chunks, so that memory use is
+bounded by the chunk size rather than by the size of the members. Tar
+archives may be compressed with any of the compressions supported by
+:mod:`tarfile`.
+
+Files are only read as archives if their first bytes, or for zip archives
+their last bytes, are those of an archive, so that other files are not read
+again.
+"""
+
+import zlib
+import tarfile
+import zipfile
+
+from dtool.hashing import BUF_SIZE, get_hash_function
+
+#: Name of the overlay listing the members of archives.
+ARCHIVE_OVERLAY = "archive_members"
+
+# Errors raised when reading a file that is not a valid archive, or an
+# archive whose members cannot be read: zipfile raises RuntimeError for
+# encrypted members, NotImplementedError for unsupported compression methods
+# and zlib.error for corrupt deflate streams. Other errors, such as failing
+# to read the file, are not caught.
+_ARCHIVE_ERRORS = (tarfile.TarError, zipfile.BadZipfile, EOFError,
+                   RuntimeError, NotImplementedError, zlib.error)
+
+# Starts of zip archives and of gzip, bzip2 and xz compressed files.
+_MAGIC_PREFIXES = (b"PK\x03\x04", b"PK\x05\x06", b"\x1f\x8b", b"BZh",
+                   b"\xfd7zXZ\x00")
+
+# Offset and value of the magic of POSIX and GNU tar headers.
+_TAR_MAGIC_OFFSET = 257
+_TAR_MAGIC = b"ustar"
+
+# Signature of the end of central directory record of zip archives.
+_ZIP_END_MAGIC = b"PK\x05\x06"
+
+_HEAD_SIZE = _TAR_MAGIC_OFFSET + len(_TAR_MAGIC)
+
+
+def looks_like_archive(head, tail=b""):
+    """Return True if the start or end of a file are those of an archive.
+
+    Zip archives with data prepended, such as self-extracting archives, are
+    recognised by the end of their central directory in the tail.
+
+    :param head: first bytes of the file; at least 262 bytes unless the file
+                 is shorter
+    :param tail: last bytes of the file
+    :returns: bool
+    """
+    if head.startswith(_MAGIC_PREFIXES):
+        return True
+    if head[_TAR_MAGIC_OFFSET:_HEAD_SIZE] == _TAR_MAGIC:
+        return True
+    return _ZIP_END_MAGIC in tail
+
+
+def _hash_stream(fh, hasher):
+    """Return number of bytes read from fh, after feeding them to hasher."""
+    size = 0
+    buf = fh.read(BUF_SIZE)
+    while len(buf) > 0:
+        hasher.update(buf)
+        size += len(buf)
+        buf = fh.read(BUF_SIZE)
+    return size
+
+
+def _tar_members(fh, hash_function):
+    members = []
+    with tarfile.open(fileobj=fh, mode="r|*") as tar:
+        for tarinfo in tar:
+            if not tarinfo.isfile():
+                continue
+            hasher = get_hash_function(hash_function)()
+            size = _hash_stream(tar.extractfile(tarinfo), hasher)
+            members.append(dict(path=tarinfo.name,
+                                size=size,
+                                hash=hasher.hexdigest()))
+    return members
+
+
+def _zip_members(fh, hash_function):
+    members = []
+    with zipfile.ZipFile(fh) as zf:
+        # Reading the members in the order they are stored keeps the reads
+        # sequential.
+        infos = sorted(zf.infolist(), key=lambda info: info.header_offset)
+        for info in infos:
+            if info.filename.endswith("/"):
+                continue
+            hasher = get_hash_function(hash_function)()
+            with zf.open(info) as member_fh:
+                size = _hash_stream(member_fh, hasher)
+            members.append(dict(path=info.filename,
+                                size=size,
+                                hash=hasher.hexdigest()))
+    return members
+
+
+def archive_members(fileobj, hash_function):
+    """Return the members of a tar or zip archive.
+
+    Only regular files are listed; directories and links are left out.
+
+    :param fileobj: seekable binary file-like object of the archive
+    :param hash_function: name of a hash function from :mod:`dtool.hashing`
+    :returns: list of dictionaries with the path, size and hash of each
+              member, in the order they are stored, or None if the file is
+              not a tar or zip archive or if any of its members cannot be
+              read, for instance because it is encrypted
+    """
+    try:
+        if zipfile.is_zipfile(fileobj):
+            fileobj.seek(0)
+            return _zip_members(fileobj, hash_function)
+        fileobj.seek(0)
+        if not looks_like_archive(fileobj.read(_HEAD_SIZE)):
+            return None
+        fileobj.seek(0)
+        return _tar_members(fileobj, hash_function)
+    except _ARCHIVE_ERRORS:
+        return None
+
+
+def archive_members_from_path(fpath, hash_function):
+    """Return the members of the tar or zip archive at fpath.
+
+    See :func:`dtool.archive.archive_members`.
+    """
+    with open(fpath, "rb") as fh:
+        return archive_members(fh, hash_function)
@@ -0,0 +1,133 @@
+"""Module for marking up many directories as datasets in one process.
+
+The descriptive metadata of each directory is built, without prompting,
+from the schema defaults, the automatically determined metadata, the
+metadata of the parent directory, the defaults in a metadata file and the
+values given for the directory in the metadata file, with later sources
+taking precedence. The dataset name is the directory name unless a name is
+given for the directory in the metadata file; names in the metadata of the
+parent directory or in the defaults are ignored.
+
+A metadata file is a YAML file of the form::
+
+    defaults:
+      project_name: sequencing
+      owner_name: Your Name
+    directories:
+      runs/run_0001:
+        dataset_name: run_0001_reads
+      runs/run_0002: {}
+
+Relative directory paths are relative to the current working directory.
+"""
+
+import os
+
+import yaml
+
+from dtoolcore import DataSet
+
+from dtool.manifest import persist_dataset
+from dtool.metadata import DescriptiveMetadata, METADATA_RESOLVER
+from dtool.utils import auto_metadata
+
+
+def read_metadata_file(fpath):
+    """Return defaults and per-directory values from a metadata file.
+
+    :param fpath: path to YAML metadata file
+    :returns: tuple of dictionary of default values and dictionary of
+              absolute directory paths and dictionaries of their values
+    :raises: ValueError if the file is not a mapping
+    """
+    with open(fpath) as fh:
+        content = yaml.safe_load(fh)
+    if content is None:
+        content = {}
+    if not isinstance(content, dict):
+        raise ValueError("Metadata file is not a mapping: {}".format(fpath))
+    defaults = content.get("defaults") or {}
+    directories = {}
+    for path, values in (content.get("directories") or {}).items():
+        directories[os.path.abspath(path)] = values or {}
+    return defaults, directories
+
+
+def markup_directory(path, schema, values, resolver=METADATA_RESOLVER,
+                     email_domain="nbi.ac.uk"):
+    """Mark up a directory as a dataset without prompting.
+
+    :param path: path to the directory
+    :param schema: list of (key, default) pairs of the README
+    :param values: dictionary of descriptive metadata values; the dataset
+                   name is the directory name unless given here
+    :param resolver: :class:`dtool.metadata.MetadataResolver` used to look
+                     up the metadata of the parent directory
+    :param email_domain: domain of the automatically determined email
+    :returns: :class:`dtoolcore.DataSet`
+    :raises: OSError if the directory is already a dtool object
+    """
+    path = os.path.abspath(path)
+
+    descriptive_metadata = DescriptiveMetadata(schema)
+    descriptive_metadata.update(auto_metadata(email_domain))
+    descriptive_metadata.update(resolver.resolve(os.path.dirname(path)))
+    descriptive_metadata.update({"dataset_name": os.path.basename(path)})
+    descriptive_metadata.update(values)
+
+    if os.path.isdir(os.path.join(path, ".dtool")):
+        raise OSError("Already a dtool object: {}".format(path))
+    descriptive_metadata.persist_to_path(
+        path, template='dtool_dataset_README.yml')
+
+    dataset = DataSet(descriptive_metadata["dataset_name"])
+    persist_dataset(dataset, path)
+    return dataset
+
+
+def batch_markup(paths, schema, defaults=None, directories=None, workers=8):
+    """Mark up directories as datasets concurrently.
+
+    A failure to mark up one directory does not stop the others. The
+    parsed parent metadata is shared between directories through
+    :data:`dtool.metadata.METADATA_RESOLVER` and the templates are read from
+    :data:`dtool.utils.TEMPLATE_CACHE`.
+
+    :param paths: paths to the directories
+    :param schema: list of (key, default) pairs of the README
+    :param defaults: dictionary of values for all directories; a dataset
+                     name in it is ignored
+    :param directories: dictionary of absolute directory paths and
+                        dictionaries of their values
+    :param workers: number of threads used to mark up directories
+    :returns: list of dictionaries with path, status (``ok`` or
+              ``error``), uuid and error message, in the order of paths
+    """
+    from multiprocessing.pool import ThreadPool
+
+    if defaults is None:
+        defaults = {}
+    if directories is None:
+        directories = {}
+
+    def markup(path):
+        path = os.path.abspath(path)
+        values = dict(defaults)
+        values.pop("dataset_name", None)
+        values.update(directories.get(path, {}))
+        result = dict(path=path, status="ok", uuid=None, error=None)
+        try:
+            dataset = markup_directory(path, schema, values)
+        except Exception as e:
+            result["status"] = "error"
+            result["error"] = str(e)
+        else:
+            result["uuid"] = dataset.uuid
+        return result
+
+    pool = ThreadPool(workers)
+    try:
+        return pool.map(markup, paths)
+    finally:
+        pool.terminate()
+        pool.join()
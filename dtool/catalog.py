@@ -0,0 +1,289 @@
+"""Module for cataloguing the datasets of a project in SQLite.
+
+The catalog holds the admin and descriptive metadata, the manifest entries
+and the overlays of every dataset below the project root, so that questions
+about the whole project can be answered with indexed queries rather than by
+opening every manifest. Refreshing the catalog only re-ingests datasets
+whose manifest or README, or the README of a dtool object above them that
+they inherit metadata from, has changed, as told by their mtime and size.
+
+Dataset paths are stored relative to the project root, so the catalog stays
+valid if the project is moved.
+"""
+
+import os
+import json
+import sqlite3
+import datetime
+
+import yaml
+from dtoolcore import DataSet
+
+from dtool.metadata import METADATA_RESOLVER
+from dtool.tree import classify_tree
+
+#: Name of the catalog file in the project root.
+CATALOG_NAME = ".dtool_catalog.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    uuid TEXT,
+    name TEXT,
+    key TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metadata (
+    dataset_id INTEGER NOT NULL REFERENCES datasets (id) ON DELETE CASCADE,
+    key TEXT NOT NULL,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS items (
+    dataset_id INTEGER NOT NULL REFERENCES datasets (id) ON DELETE CASCADE,
+    path TEXT NOT NULL,
+    suffix TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL
+);
+CREATE TABLE IF NOT EXISTS overlays (
+    dataset_id INTEGER NOT NULL REFERENCES datasets (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS metadata_key ON metadata (key, value);
+CREATE INDEX IF NOT EXISTS metadata_dataset ON metadata (dataset_id);
+CREATE INDEX IF NOT EXISTS items_suffix ON items (suffix, size);
+CREATE INDEX IF NOT EXISTS items_size ON items (size);
+CREATE INDEX IF NOT EXISTS items_hash ON items (hash);
+CREATE INDEX IF NOT EXISTS items_dataset ON items (dataset_id);
+CREATE INDEX IF NOT EXISTS overlays_hash ON overlays (dataset_id, name, hash);
+CREATE INDEX IF NOT EXISTS overlays_value ON overlays (name, value);
+"""
+
+
+def catalog_path(root):
+    """Return path to the catalog of the project in root."""
+    return os.path.join(os.path.abspath(root), CATALOG_NAME)
+
+
+def _stat_key(path):
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return None
+    return [stat_result.st_mtime, stat_result.st_size]
+
+
+def _dataset_key(path):
+    """Return string that changes when the metadata of a dataset changes.
+
+    The READMEs of the dtool objects above the dataset are included, as the
+    dataset inherits their metadata.
+    """
+    with open(os.path.join(path, ".dtool", "dtool")) as fh:
+        admin_metadata = json.load(fh)
+    manifest_path = admin_metadata.get(
+        "manifest_path", os.path.join(".dtool", "manifest.json"))
+    return json.dumps([
+        _stat_key(os.path.join(path, manifest_path)),
+        METADATA_RESOLVER.readme_keys(path),
+    ])
+
+
+def _suffix(rel_path):
+    return os.path.splitext(rel_path)[1].lower()
+
+
+def _to_text(value):
+    """Return the text stored in the catalog for a metadata value.
+
+    Strings are stored as they are, dates as in the README, and other
+    values as JSON, so that ``confidential: False`` is stored as ``false``.
+    """
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def _query_text(value):
+    """Return the text to look up for a queried metadata value.
+
+    String values are parsed as YAML, as the README values are, so that
+    ``2017-06-13`` matches a date and ``False`` a boolean.
+    """
+    if isinstance(value, str):
+        try:
+            value = yaml.safe_load(value)
+        except yaml.YAMLError:
+            return value
+    return _to_text(value)
+
+
+class Catalog(object):
+    """SQLite catalog of the datasets below a project root.
+
+    :param root: path to the project root
+    :param db_path: path to the catalog; defaults to
+                    :data:`dtool.catalog.CATALOG_NAME` in the root
+    """
+
+    def __init__(self, root, db_path=None):
+        self.root = os.path.abspath(root)
+        if db_path is None:
+            db_path = catalog_path(root)
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path)
+        self._conn.execute("PRAGMA foreign_keys = ON")
+        self._conn.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._conn.close()
+
+    def _ingest(self, rel_path, key):
+        path = os.path.join(self.root, rel_path)
+        dataset = DataSet.from_path(path)
+        conn = self._conn
+        conn.execute("DELETE FROM datasets WHERE path = ?", (rel_path,))
+        cursor = conn.execute(
+            "INSERT INTO datasets (path, uuid, name, key) VALUES (?, ?, ?, ?)",
+            (rel_path, dataset.uuid, dataset.name, key))
+        dataset_id = cursor.lastrowid
+
+        descriptive_metadata = METADATA_RESOLVER.resolve(path)
+        conn.executemany(
+            "INSERT INTO metadata VALUES (?, ?, ?)",
+            ((dataset_id, k, _to_text(v))
+             for k, v in descriptive_metadata.items()))
+
+        conn.executemany(
+            "INSERT INTO items VALUES (?, ?, ?, ?, ?, ?)",
+            ((dataset_id, entry["path"], _suffix(entry["path"]),
+              entry["hash"], entry["size"], entry.get("mtime"))
+             for entry in dataset.manifest["file_list"]))
+
+        overlays_path = dataset._abs_overlays_path
+        if os.path.isdir(overlays_path):
+            for fn in sorted(os.listdir(overlays_path)):
+                name, ext = os.path.splitext(fn)
+                if ext != ".json":
+                    continue
+                with open(os.path.join(overlays_path, fn)) as fh:
+                    overlay = json.load(fh)
+                conn.executemany(
+                    "INSERT INTO overlays VALUES (?, ?, ?, ?)",
+                    ((dataset_id, name, item_hash, _to_text(value))
+                     for item_hash, value in overlay.items()))
+
+    def refresh(self, workers=16):
+        """Bring the catalog up to date with the datasets below the root.
+
+        Datasets whose manifest and READMEs, including those they inherit
+        metadata from, are unchanged are skipped, changed and new datasets
+        are re-ingested, and datasets no longer found are removed. Each
+        dataset is ingested in its own transaction.
+
+        :param workers: number of threads used to find the datasets
+        :returns: dictionary with the relative paths of the added, updated,
+                  removed and unchanged datasets
+        """
+        known = dict(self._conn.execute("SELECT path, key FROM datasets"))
+        result = dict(added=[], updated=[], removed=[], unchanged=[])
+        found = set()
+        for info in classify_tree(self.root, workers=workers):
+            if info["type"] != "dataset":
+                continue
+            rel_path = os.path.relpath(info["path"], self.root)
+            found.add(rel_path)
+            key = _dataset_key(info["path"])
+            if known.get(rel_path) == key:
+                result["unchanged"].append(rel_path)
+                continue
+            with self._conn:
+                self._ingest(rel_path, key)
+            if rel_path in known:
+                result["updated"].append(rel_path)
+            else:
+                result["added"].append(rel_path)
+
+        with self._conn:
+            for rel_path in sorted(set(known) - found):
+                self._conn.execute(
+                    "DELETE FROM datasets WHERE path = ?", (rel_path,))
+                result["removed"].append(rel_path)
+        return result
+
+    def query(
+            self,
+            suffix=None,
+            min_size=None,
+            max_size=None,
+            mimetype=None,
+            metadata=None,
+            limit=None):
+        """Yield the items matching all of the given criteria.
+
+        :param suffix: file name extension, such as ``.bam``; not case
+                       sensitive
+        :param min_size: minimum size in bytes
+        :param max_size: maximum size in bytes
+        :param mimetype: value of the mimetype overlay
+        :param metadata: dictionary of descriptive metadata keys and values
+                         of the datasets; string values are parsed as YAML
+        :param limit: maximum number of items
+        :returns: generator of dictionaries with the dataset path, name and
+                  uuid and the item path, size and hash, ordered by dataset
+                  and item path
+        """
+        sql = ["SELECT d.path, d.name, d.uuid, i.path, i.size, i.hash "
+               "FROM items i JOIN datasets d ON d.id = i.dataset_id"]
+        where = []
+        params = []
+        if mimetype is not None:
+            sql.append("JOIN overlays o ON o.dataset_id = i.dataset_id "
+                       "AND o.name = 'mimetype' AND o.hash = i.hash")
+            where.append("o.value = ?")
+            params.append(mimetype)
+        if suffix is not None:
+            if not suffix.startswith("."):
+                suffix = "." + suffix
+            where.append("i.suffix = ?")
+            params.append(suffix.lower())
+        if min_size is not None:
+            where.append("i.size >= ?")
+            params.append(min_size)
+        if max_size is not None:
+            where.append("i.size <= ?")
+            params.append(max_size)
+        for key, value in sorted((metadata or {}).items()):
+            where.append("i.dataset_id IN (SELECT dataset_id FROM metadata "
+                         "WHERE key = ? AND value = ?)")
+            params.extend([key, _query_text(value)])
+        if where:
+            sql.append("WHERE " + " AND ".join(where))
+        sql.append("ORDER BY d.path, i.path")
+        if limit is not None:
+            sql.append("LIMIT ?")
+            params.append(limit)
+
+        for row in self._conn.execute(" ".join(sql), params):
+            dataset_path, name, uuid, rel_path, size, item_hash = row
+            yield dict(dataset=os.path.join(self.root, dataset_path),
+                       name=name,
+                       uuid=uuid,
+                       path=rel_path,
+                       size=size,
+                       hash=item_hash)
+
+    def execute(self, sql, params=()):
+        """Return cursor of an SQL query run against the catalog."""
+        return self._conn.execute(sql, params)
@@ -1,20 +1,16 @@
-"""Manage datasets."""
+"""Manage datasets.
+
+Commands import the modules they need when they are run, rather than when
+this module is imported, so that starting ``dtool`` is fast. Only modules
+needed for defining the commands' options are imported here.
+"""
 
 import os
+import sys
+import json
 
 import click
 
-from dtoolcore import (
-    __version__,
-    DataSet,
-)
-from dtoolutils.overlays import add_mimetype
-from dtool.clickutils import (
-    create_project,
-    generate_descriptive_metadata,
-    info_from_path,
-)
-
 
 #####################################################################
 # Helper variables.
@@ -41,6 +37,47 @@ dataset_path_option = click.argument(
     default=".",
     type=click.Path(exists=True))
 
+project_path_option = click.argument(
+    'path',
+    default='.',
+    type=click.Path(exists=True, file_okay=False))
+
+# Same as dtool.stats.DEFAULT_WARN_FILES, which is not imported to keep
+# starting dtool fast.
+warn_files_option = click.option(
+    '--warn-files',
+    help='Warn if the dataset has more files than this',
+    default=100000,
+    type=click.IntRange(0, None))
+
+
+def _validate_hash_functions(ctx, param, value):
+    from dtool.hashing import hash_function_names
+    names = hash_function_names()
+    for name in value:
+        if name not in names:
+            raise click.BadParameter(
+                'invalid choice: {}. (choose from {})'.format(
+                    name, ', '.join(names)))
+    return value
+
+
+def _print_version(ctx, param, value):
+    if not value or ctx.resilient_parsing:
+        return
+    from dtoolcore import __version__
+    click.echo('{}, version {}'.format(ctx.find_root().info_name, __version__))
+    ctx.exit()
+
+
+version_option = click.option(
+    '--version',
+    help='Show the version and exit.',
+    is_flag=True,
+    callback=_print_version,
+    expose_value=False,
+    is_eager=True)
+
 
 #####################################################################
 # Command line interface.
@@ -48,21 +85,51 @@ dataset_path_option = click.argument(
 
 
 @click.group()
-@click.version_option(version=__version__)
+@version_option
 def cli():
     pass
 
 
 @cli.command()
 @dataset_path_option
-def info(path):
-    message = info_from_path(path)
-    print(message)
+@click.option(
+    '--recursive',
+    help='Classify all directories below path',
+    is_flag=True)
+@click.option(
+    '--workers',
+    help='Number of threads used to scan directories when recursive',
+    default=16,
+    type=click.IntRange(1, None))
+@click.option(
+    '--format',
+    'output_format',
+    help='Output format when recursive',
+    default='table',
+    type=click.Choice(['table', 'jsonl']))
+def info(path, recursive, workers, output_format):
+    if not recursive:
+        from dtool.clickutils import info_from_path
+        message = info_from_path(path)
+        print(message)
+        return
+
+    from dtool.tree import classify_tree, summary_table
+    infos = classify_tree(path, workers=workers)
+    if output_format == 'jsonl':
+        for item in infos:
+            click.echo(json.dumps(item, sort_keys=True))
+    else:
+        click.echo(summary_table(infos))
 
 
 @cli.command()
 @dataset_path_option
 def markup(path):
+    from dtoolcore import DataSet
+    from dtool.clickutils import generate_descriptive_metadata
+    from dtool.manifest import persist_dataset
+
     path = os.path.abspath(path)
     parent_dir = os.path.join(path, "..")
     descriptive_metadata = generate_descriptive_metadata(
@@ -74,8 +141,170 @@ def markup(path):
         path, template='dtool_dataset_README.yml')
 
     ds = DataSet(dataset_name)
-    ds.persist_to_path(path)
-    add_mimetype(ds)
+    persist_dataset(ds, path)
+
+
+@cli.command('batch-markup')
+@click.argument(
+    'metadata_file',
+    type=click.Path(exists=True, dir_okay=False))
+@click.argument(
+    'paths',
+    nargs=-1,
+    type=click.Path(file_okay=False))
+@click.option(
+    '--workers',
+    help='Number of directories marked up concurrently',
+    default=8,
+    type=click.IntRange(1, None))
+@click.option(
+    '--format',
+    'output_format',
+    help='Output format',
+    default='table',
+    type=click.Choice(['table', 'jsonl']))
+def batch_markup(metadata_file, paths, workers, output_format):
+    from dtool.batch import batch_markup, read_metadata_file
+
+    defaults, directories = read_metadata_file(metadata_file)
+    paths = [os.path.abspath(p) for p in paths]
+    paths.extend(sorted(set(directories) - set(paths)))
+
+    results = batch_markup(
+        paths, README_SCHEMA, defaults, directories, workers=workers)
+
+    for result in results:
+        if output_format == 'jsonl':
+            click.echo(json.dumps(result, sort_keys=True))
+        elif result['status'] == 'ok':
+            click.echo('ok\t{}'.format(result['path']))
+        else:
+            click.echo('error\t{}\t{}'.format(
+                result['path'], result['error']))
+
+    if any(result['status'] != 'ok' for result in results):
+        sys.exit(1)
+
+
+@cli.command()
+@dataset_path_option
+@click.option(
+    '--threshold',
+    help='KiB below which files are packed',
+    default=1024,
+    type=click.IntRange(1, None))
+@click.option(
+    '--shard-size',
+    help='MiB above which a new shard is started',
+    default=1024,
+    type=click.IntRange(1, None))
+def pack(path, threshold, shard_size):
+    from dtoolcore import DataSet
+    from dtool.manifest import update_manifest
+    from dtool.packed import pack_files, remove_originals
+    from dtool.walk import IGNORE_FILE_NAME, IgnorePatterns
+
+    dataset = DataSet.from_path(path)
+    manifest = dataset._structural_metadata
+    ignore = IgnorePatterns.from_path(
+        os.path.join(dataset._abs_path, IGNORE_FILE_NAME))
+
+    num_files, shards = pack_files(
+        manifest.abs_manifest_root,
+        manifest["hash_function"],
+        ignore=ignore,
+        ignore_prefixes=manifest.ignore_prefixes,
+        threshold=threshold * 2**10,
+        shard_size=shard_size * 2**20)
+    update_manifest(dataset, incremental=True)
+    remove_originals(manifest.abs_manifest_root)
+
+    click.secho('Packed {} files into {} shards'.format(
+        num_files, len(shards)))
+
+
+@cli.command()
+@click.argument(
+    'src',
+    type=click.Path(exists=True, file_okay=False))
+@click.argument(
+    'dest',
+    type=click.Path(exists=False))
+@click.option(
+    '--workers',
+    help='Number of files copied concurrently',
+    default=8,
+    type=click.IntRange(1, None))
+@click.option(
+    '--no-verify',
+    help='Do not hash the copied files',
+    is_flag=True)
+def copy(src, dest, workers, no_verify):
+    from dtoolcore import DataSet
+    from dtool.transfer import copy_dataset
+
+    dataset = DataSet.from_path(src)
+    if os.path.exists(dest):
+        raise click.ClickException('Already exists: {}'.format(dest))
+    result = copy_dataset(
+        dataset, dest, workers=workers, verify=not no_verify)
+
+    for key, rel_paths in sorted(result.as_dict().items()):
+        for rel_path in rel_paths:
+            click.echo('{}\t{}'.format(key, rel_path))
+    if not result.ok:
+        click.secho('Copy does not match manifest', fg='red')
+        sys.exit(1)
+    click.secho('Copied {}{} files'.format(
+        '' if no_verify else 'and verified ',
+        len(dataset._structural_metadata['file_list'])), fg='green')
+
+
+@cli.command()
+@click.argument(
+    'src',
+    type=click.Path(exists=True, file_okay=False))
+@click.argument(
+    'dest',
+    type=click.Path(exists=False))
+@click.option(
+    '--method',
+    help='How to share the data of the files',
+    default='auto',
+    type=click.Choice(['auto', 'reflink', 'hardlink']))
+@click.option(
+    '--writable',
+    help='Do not make the snapshot read-only',
+    is_flag=True)
+@click.option(
+    '--workers',
+    help='Number of files linked concurrently',
+    default=8,
+    type=click.IntRange(1, None))
+def snapshot(src, dest, method, writable, workers):
+    import warnings
+    from dtoolcore import DataSet
+    from dtool.snapshot import snapshot_dataset
+
+    dataset = DataSet.from_path(src)
+    if os.path.exists(dest):
+        raise click.ClickException('Already exists: {}'.format(dest))
+    try:
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            snapshot, counts = snapshot_dataset(
+                dataset, dest, method=method, readonly=not writable,
+                workers=workers)
+    except OSError as e:
+        raise click.ClickException(str(e))
+    for warning in caught:
+        click.secho(str(warning.message), fg='red', err=True)
+
+    click.echo(snapshot.uuid)
+    click.secho('Snapshot with {} reflinked, {} hard linked and {} '
+                'copied files'.format(
+                    counts['reflink'], counts['hardlink'], counts['copy']),
+                fg='green')
 
 
 @cli.group()
@@ -85,6 +314,9 @@ def new():
 
 @new.command()
 def dataset():
+    from dtoolcore import DataSet
+    from dtool.clickutils import generate_descriptive_metadata
+    from dtool.manifest import persist_dataset
 
     descriptive_metadata = generate_descriptive_metadata(
         README_SCHEMA, '.')
@@ -98,8 +330,7 @@ def dataset():
         dataset_name, template='dtool_dataset_README.yml')
 
     ds = DataSet(dataset_name, 'data')
-    ds.persist_to_path(dataset_name)
-    add_mimetype(ds)
+    persist_dataset(ds, dataset_name)
 
 
 @new.command()
@@ -109,9 +340,201 @@ def dataset():
     default='.',
     type=click.Path(exists=True))
 def project(base_path):
+    from dtool.clickutils import create_project
     create_project(base_path)
 
 
+@cli.group('project')
+def project_group():
+    pass
+
+
+@project_group.command()
+@project_path_option
+@click.option(
+    '--min-size',
+    help='KiB below which files are left out',
+    default=0,
+    type=click.IntRange(0, None))
+@click.option(
+    '--limit',
+    help='Maximum number of duplicate groups reported',
+    type=click.IntRange(1, None))
+@click.option(
+    '--hardlink',
+    help='Replace duplicates on the same file system with hard links',
+    is_flag=True)
+@click.option(
+    '--workers',
+    help='Number of threads used to find the datasets',
+    default=16,
+    type=click.IntRange(1, None))
+@click.option(
+    '--format',
+    'output_format',
+    help='Output format',
+    default='table',
+    type=click.Choice(['table', 'jsonl']))
+def dedup(path, min_size, limit, hardlink, workers, output_format):
+    import shutil
+    import tempfile
+    from dtool.dedup import build_duplicate_index, hardlink_group
+    from dtool.utils import human_readable_size
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        index = build_duplicate_index(
+            path, os.path.join(tmp_dir, 'dedup.sqlite'), workers=workers)
+        with index:
+            total = 0
+            num_linked = 0
+            num_errors = 0
+            reclaimed = 0
+            for i, group in enumerate(index.groups(min_size * 2**10)):
+                if limit is not None and i >= limit:
+                    break
+                total += group['reclaimable']
+                if output_format == 'jsonl':
+                    click.echo(json.dumps(group, sort_keys=True))
+                else:
+                    click.echo('{}\t{} copies\t{}'.format(
+                        human_readable_size(group['reclaimable']),
+                        len(group['paths']),
+                        group['hash']))
+                    for fpath in group['paths']:
+                        click.echo('    {}'.format(fpath))
+                if hardlink:
+                    linked, linked_size, errors = hardlink_group(
+                        group, index)
+                    num_linked += linked
+                    reclaimed += linked_size
+                    for fpath, message in errors:
+                        num_errors += 1
+                        click.secho('Could not link {}: {}'.format(
+                            fpath, message), fg='red', err=True)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    if output_format == 'table':
+        click.echo('Reclaimable: {}'.format(human_readable_size(total)))
+    if hardlink:
+        click.secho('Replaced {} files with hard links, reclaiming {}'.format(
+            num_linked, human_readable_size(reclaimed)), err=True)
+        if num_errors:
+            sys.exit(1)
+
+
+@cli.group()
+def catalog():
+    pass
+
+
+def _refresh_catalog(path, workers, rebuild):
+    from dtool.catalog import Catalog, catalog_path
+
+    if rebuild and os.path.isfile(catalog_path(path)):
+        os.unlink(catalog_path(path))
+    with Catalog(path) as project_catalog:
+        result = project_catalog.refresh(workers=workers)
+    num_datasets = (len(result['added']) + len(result['updated']) +
+                    len(result['unchanged']))
+    click.secho('Catalogued {} datasets: {} added, {} updated, {} '
+                'removed'.format(
+                    num_datasets,
+                    len(result['added']),
+                    len(result['updated']),
+                    len(result['removed'])))
+
+
+@catalog.command()
+@project_path_option
+@click.option(
+    '--workers',
+    help='Number of threads used to find the datasets',
+    default=16,
+    type=click.IntRange(1, None))
+def build(path, workers):
+    _refresh_catalog(path, workers, rebuild=True)
+
+
+@catalog.command()
+@project_path_option
+@click.option(
+    '--workers',
+    help='Number of threads used to find the datasets',
+    default=16,
+    type=click.IntRange(1, None))
+def refresh(path, workers):
+    _refresh_catalog(path, workers, rebuild=False)
+
+
+@catalog.command()
+@project_path_option
+@click.option(
+    '--suffix',
+    help='File name extension of the items, e.g. .bam')
+@click.option(
+    '--min-size',
+    help='Minimum size of the items in MiB',
+    type=float)
+@click.option(
+    '--max-size',
+    help='Maximum size of the items in MiB',
+    type=float)
+@click.option(
+    '--mimetype',
+    help='Mimetype of the items')
+@click.option(
+    '--metadata',
+    help='Descriptive metadata of the datasets as key=value; can be given '
+         'more than once',
+    multiple=True)
+@click.option(
+    '--limit',
+    help='Maximum number of items',
+    type=click.IntRange(1, None))
+@click.option(
+    '--format',
+    'output_format',
+    help='Output format',
+    default='table',
+    type=click.Choice(['table', 'jsonl']))
+def query(path, suffix, min_size, max_size, mimetype, metadata, limit,
+          output_format):
+    from dtool.catalog import Catalog, catalog_path
+    from dtool.utils import human_readable_size
+
+    if not os.path.isfile(catalog_path(path)):
+        raise click.ClickException(
+            'No catalog in {}; run dtool catalog build'.format(path))
+    criteria = {}
+    for key_value in metadata:
+        if '=' not in key_value:
+            raise click.BadParameter(
+                'Expected key=value: {}'.format(key_value))
+        key, value = key_value.split('=', 1)
+        criteria[key] = value
+    if min_size is not None:
+        min_size = int(min_size * 2**20)
+    if max_size is not None:
+        max_size = int(max_size * 2**20)
+
+    with Catalog(path) as project_catalog:
+        for item in project_catalog.query(
+                suffix=suffix,
+                min_size=min_size,
+                max_size=max_size,
+                mimetype=mimetype,
+                metadata=criteria,
+                limit=limit):
+            if output_format == 'jsonl':
+                click.echo(json.dumps(item, sort_keys=True))
+            else:
+                click.echo('{:<12}{}'.format(
+                    human_readable_size(item['size']),
+                    os.path.join(item['dataset'], item['path'])))
+
+
 @cli.group()
 def manifest():
     pass
@@ -119,9 +542,307 @@ def manifest():
 
 @manifest.command()
 @dataset_path_option
-def update(path):
+@click.option(
+    '--workers',
+    help='Number of processes used to hash files',
+    default=1,
+    type=click.IntRange(1, None))
+@click.option(
+    '--full',
+    help='Rehash all files rather than only new and changed files',
+    is_flag=True)
+@click.option(
+    '--resume',
+    help='Reuse the files hashed by an interrupted update',
+    is_flag=True)
+@warn_files_option
+@click.option(
+    '--max-files',
+    help='Refuse to update the manifest if the dataset has more files',
+    type=click.IntRange(0, None))
+@click.option(
+    '--skip-preflight',
+    help='Do not scan the dataset before hashing the files',
+    is_flag=True)
+@click.option(
+    '--index',
+    help='Write an index for looking up items by path',
+    is_flag=True)
+@click.option(
+    '--extra-hash',
+    help='Additional hash function to compute and store as an overlay, '
+         'such as md5sum, sha256sum or blake2b; can be given more than once',
+    multiple=True,
+    callback=_validate_hash_functions)
+@click.option(
+    '--archives',
+    help='List the members of tar and zip archives in an overlay',
+    is_flag=True)
+@click.option(
+    '--overlay',
+    help='Overlay to compute, such as size_in_bytes or image_dimensions; '
+         'can be given more than once',
+    multiple=True)
+@click.option(
+    '--readers',
+    help='Number of threads reading files ahead of hashing, for high latency '
+         'storage; workers are then hasher threads',
+    default=0,
+    type=click.IntRange(0, None))
+@click.option(
+    '--read-size',
+    help='MiB read at a time by reader threads',
+    default=4,
+    type=click.IntRange(1, None))
+@click.option(
+    '--queue-depth',
+    help='Number of chunks queued for each hasher thread',
+    default=8,
+    type=click.IntRange(1, None))
+def update(
+        path,
+        workers,
+        full,
+        resume,
+        warn_files,
+        max_files,
+        skip_preflight,
+        index,
+        extra_hash,
+        archives,
+        overlay,
+        readers,
+        read_size,
+        queue_depth):
+    from dtoolcore import DataSet
+    from dtool.clickutils import warn_about_many_files
+    from dtool.manifest import update_manifest
+    from dtool.stats import scan_dataset
+    from dtool.utils import human_readable_size
+
     dataset = DataSet.from_path(path)
-    dataset.update_manifest()
-    add_mimetype(dataset)
+
+    if not skip_preflight:
+        dataset_stats = scan_dataset(dataset)
+        click.secho('Found {} files ({}); hashing all of them is estimated '
+                    'to take {}'.format(
+                        dataset_stats.num_files,
+                        human_readable_size(dataset_stats.total_size),
+                        dataset_stats.estimated_hashing_time(workers)))
+        if max_files is not None and dataset_stats.num_files > max_files:
+            raise click.ClickException(
+                'The dataset has more than {} files; consider packing small '
+                'files into tar archives'.format(max_files))
+        warn_about_many_files(dataset_stats, warn_files)
+
+    try:
+        update_manifest(
+            dataset,
+            workers=workers,
+            incremental=not full,
+            resume=resume,
+            index=index,
+            extra_hashes=extra_hash,
+            readers=readers,
+            read_size=read_size * 2**20,
+            queue_depth=queue_depth,
+            archives=archives,
+            overlays=overlay)
+    except ValueError as e:
+        raise click.ClickException(str(e))
 
     click.secho('Updated manifest')
+
+
+@manifest.command()
+@dataset_path_option
+@click.option(
+    '--debounce',
+    help='Seconds a file must be left alone after writing before it is '
+         'hashed',
+    default=2.0)
+@click.option(
+    '--flush-interval',
+    help='Seconds between writes of the manifest',
+    default=60.0)
+@click.option(
+    '--workers',
+    help='Number of threads used to hash files',
+    default=1,
+    type=click.IntRange(1, None))
+@click.option(
+    '--duration',
+    help='Seconds to watch for; until interrupted by default',
+    type=float)
+def watch(path, debounce, flush_interval, workers, duration):
+    from dtoolcore import DataSet
+    from dtool.watch import ManifestWatcher, inotify_available
+
+    if not inotify_available():
+        raise click.ClickException('inotify is not available on this system')
+
+    dataset = DataSet.from_path(path)
+    watcher = ManifestWatcher(
+        dataset,
+        debounce=debounce,
+        flush_interval=flush_interval,
+        workers=workers)
+    click.secho('Watching {}; press Ctrl-C to stop'.format(
+        dataset._abs_path), err=True)
+    try:
+        watcher.run(duration=duration)
+    except KeyboardInterrupt:
+        pass
+    click.secho('Updated manifest')
+
+
+@manifest.command()
+@dataset_path_option
+@click.option(
+    '--index',
+    help='Index of the shard, from 0; defaults to $SLURM_ARRAY_TASK_ID',
+    envvar='SLURM_ARRAY_TASK_ID',
+    required=True,
+    type=click.IntRange(0, None))
+@click.option(
+    '--of',
+    'num_shards',
+    help='Number of shards; defaults to $SLURM_ARRAY_TASK_COUNT',
+    envvar='SLURM_ARRAY_TASK_COUNT',
+    required=True,
+    type=click.IntRange(1, None))
+@click.option(
+    '--workers',
+    help='Number of processes used to hash files',
+    default=1,
+    type=click.IntRange(1, None))
+@click.option(
+    '--full',
+    help='Rehash all files rather than only new and changed files',
+    is_flag=True)
+def shard(path, index, num_shards, workers, full):
+    from dtoolcore import DataSet
+    from dtool.manifest_shards import write_shard
+
+    dataset = DataSet.from_path(path)
+    try:
+        num_items = write_shard(
+            dataset, index, num_shards, workers=workers, incremental=not full)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.secho('Hashed {} files of shard {} of {}'.format(
+        num_items, index, num_shards))
+
+
+@manifest.command()
+@dataset_path_option
+@click.option(
+    '--of',
+    'num_shards',
+    help='Number of shards',
+    required=True,
+    type=click.IntRange(1, None))
+def merge(path, num_shards):
+    from dtoolcore import DataSet
+    from dtool.manifest_shards import merge_shards
+
+    dataset = DataSet.from_path(path)
+    try:
+        num_items = merge_shards(dataset, num_shards)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.secho('Merged {} shards into a manifest of {} files'.format(
+        num_shards, num_items))
+
+
+@manifest.command()
+@dataset_path_option
+@click.option(
+    '--workers',
+    help='Number of threads used to scan directories',
+    default=8,
+    type=click.IntRange(1, None))
+@warn_files_option
+def stats(path, workers, warn_files):
+    from dtoolcore import DataSet
+    from dtool.clickutils import warn_about_many_files
+    from dtool.stats import scan_dataset
+
+    dataset = DataSet.from_path(path)
+    dataset_stats = scan_dataset(dataset, workers=workers)
+    click.secho(dataset_stats.report())
+    warn_about_many_files(dataset_stats, warn_files)
+
+
+@manifest.command('hash-benchmark')
+@click.option(
+    '--size',
+    help='Number of MiB hashed by each hash function',
+    default=256,
+    type=click.IntRange(1, None))
+def hash_benchmark(size):
+    from dtool.hashing import benchmark
+    from dtool.utils import human_readable_size
+
+    throughputs = benchmark(size=size * 2**20)
+    for name in sorted(throughputs, key=throughputs.get, reverse=True):
+        click.secho('{:<12}{}/s'.format(
+            name, human_readable_size(throughputs[name])))
+
+
+@manifest.command()
+@dataset_path_option
+@click.option(
+    '--mode',
+    help='full: rehash all files, quick: compare size and mtime, '
+         'sampled: rehash a random sample of files',
+    default='full',
+    type=click.Choice(['full', 'quick', 'sampled']))
+@click.option(
+    '--workers',
+    help='Number of processes used to hash files',
+    default=1,
+    type=click.IntRange(1, None))
+@click.option(
+    '--percent',
+    help='Percentage of files rehashed in sampled mode',
+    default=10,
+    type=click.IntRange(1, 100))
+@click.option(
+    '--seed',
+    help='Seed of the random sample in sampled mode',
+    default=0)
+@click.option(
+    '--fail-fast',
+    help='Stop at the first file that does not match the manifest',
+    is_flag=True)
+@click.option(
+    '--format',
+    'output_format',
+    help='Output format',
+    default='text',
+    type=click.Choice(['text', 'json']))
+def verify(path, mode, workers, percent, seed, fail_fast, output_format):
+    from dtoolcore import DataSet
+    from dtool.verify import verify_dataset
+
+    dataset = DataSet.from_path(path)
+    result = verify_dataset(
+        dataset,
+        mode=mode,
+        workers=workers,
+        percent=percent,
+        seed=seed,
+        fail_fast=fail_fast)
+
+    if output_format == 'json':
+        click.echo(json.dumps(result.as_dict(), indent=2, sort_keys=True))
+    else:
+        for key, rel_paths in sorted(result.as_dict().items()):
+            for rel_path in rel_paths:
+                click.echo('{}\t{}'.format(key, rel_path))
+        if result.ok:
+            click.secho('Dataset matches manifest', fg='green')
+
+    if not result.ok:
+        sys.exit(1)
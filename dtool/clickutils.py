@@ -61,3 +61,17 @@ def info_from_path(path):
         return "Directory is not a dtool object"
     return "Directory is a dtool {}".format(
         dtool_object._admin_metadata["type"])
+
+
+def warn_about_many_files(dataset_stats, warn_files):
+    """Warn the user if a dataset has lots of files.
+
+    :param dataset_stats: :class:`dtool.stats.DatasetStats`
+    :param warn_files: number of files above which to warn
+    """
+    if dataset_stats.num_files > warn_files:
+        click.secho(
+            'Warning: the dataset has more than {} files; consider packing '
+            'small files into tar archives before creating the '
+            'manifest'.format(warn_files),
+            fg='yellow')
@@ -0,0 +1,202 @@
+"""Module for finding files duplicated across the datasets of a project.
+
+Duplicates are found from the hashes in the datasets' manifests; no file is
+read or rehashed. The manifest entries are loaded, one dataset at a time,
+into an SQLite database on disk, so that memory use does not depend on the
+number of entries in the project.
+"""
+
+import os
+import sqlite3
+
+from dtoolcore import DataSet
+
+from dtool.tree import classify_tree
+
+#: Number of manifest entries inserted into the database at a time.
+INSERT_BATCH_SIZE = 10000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    hash TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL,
+    path TEXT NOT NULL,
+    packed INTEGER NOT NULL
+)
+"""
+
+
+class DuplicateIndex(object):
+    """Index of the locations of the files of many datasets by hash.
+
+    :param db_path: path to the SQLite database holding the index
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path)
+        self._conn.execute(_SCHEMA)
+        self._indexed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._conn.close()
+
+    def add_dataset(self, dataset):
+        """Add the entries of a dataset's manifest to the index.
+
+        :param dataset: :class:`dtoolcore.DataSet`
+        :returns: number of entries added
+        """
+        manifest = dataset._structural_metadata
+        root = manifest.abs_manifest_root
+        rows = []
+        num_entries = 0
+        for entry in manifest["file_list"]:
+            rows.append((entry["hash"],
+                         entry["size"],
+                         entry.get("mtime"),
+                         os.path.join(root, entry["path"]),
+                         "shard" in entry))
+            if len(rows) >= INSERT_BATCH_SIZE:
+                num_entries += self._insert(rows)
+                rows = []
+        num_entries += self._insert(rows)
+        self._conn.commit()
+        return num_entries
+
+    def _insert(self, rows):
+        self._conn.executemany(
+            "INSERT INTO files VALUES (?, ?, ?, ?, ?)", rows)
+        self._indexed = False
+        return len(rows)
+
+    def _ensure_indexed(self):
+        if not self._indexed:
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS files_hash ON files (hash, size)")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS files_path ON files (path)")
+            self._conn.commit()
+            self._indexed = True
+
+    def groups(self, min_size=0):
+        """Yield groups of duplicated files, most reclaimable bytes first.
+
+        Files are duplicates if they have the same hash and size. The bytes
+        reclaimable by a group are those of all but one of its files.
+
+        :param min_size: size in bytes below which files are left out
+        :returns: generator of dictionaries with the hash, size, reclaimable
+                  bytes and sorted list of absolute paths of each group
+        """
+        self._ensure_indexed()
+        group_cursor = self._conn.execute(
+            "SELECT hash, size, COUNT(*) FROM files WHERE size >= ? "
+            "GROUP BY hash, size HAVING COUNT(*) > 1 "
+            "ORDER BY size * (COUNT(*) - 1) DESC, hash",
+            (min_size,))
+        for item_hash, size, count in group_cursor:
+            paths = [path for (path,) in self._conn.execute(
+                "SELECT path FROM files WHERE hash = ? AND size = ? "
+                "ORDER BY path", (item_hash, size))]
+            yield dict(hash=item_hash,
+                       size=size,
+                       reclaimable=size * (count - 1),
+                       paths=paths)
+
+    def entry(self, path):
+        """Return the manifest size, mtime and whether a file is packed."""
+        self._ensure_indexed()
+        return self._conn.execute(
+            "SELECT size, mtime, packed FROM files WHERE path = ?",
+            (path,)).fetchone()
+
+
+def build_duplicate_index(root, db_path, workers=16):
+    """Return index of the files of all datasets below root.
+
+    :param root: path to a project, or any directory containing datasets
+    :param db_path: path to the SQLite database to hold the index
+    :param workers: number of threads used to find the datasets
+    :returns: :class:`dtool.dedup.DuplicateIndex`
+    """
+    index = DuplicateIndex(db_path)
+    for info in classify_tree(root, workers=workers):
+        if info["type"] == "dataset":
+            index.add_dataset(DataSet.from_path(info["path"]))
+    return index
+
+
+def _matches_manifest(stat_result, size, mtime):
+    return stat_result.st_size == size and stat_result.st_mtime == mtime
+
+
+def hardlink_group(group, index):
+    """Replace the files of a group of duplicates with hard links.
+
+    The first file of the group is kept and the others, on the same file
+    system, are replaced by hard links to it. As the files are not
+    rehashed, only files whose size and mtime still match their manifest
+    are replaced. A hard linked file takes the mtime and mode of the file
+    it is linked to, so only files with the same mtime and mode as the
+    first file are replaced, keeping the manifests of all datasets valid.
+    Packed files are left alone. Each file is replaced atomically.
+
+    Once linked, the files are the same file: changing one of them in
+    place changes it in all the datasets.
+
+    :param group: dictionary as yielded by
+                  :meth:`dtool.dedup.DuplicateIndex.groups`
+    :param index: :class:`dtool.dedup.DuplicateIndex` the group came from
+    :returns: tuple of number of files replaced, bytes reclaimed and list
+              of tuples of path and error message of the files that could
+              not be replaced
+    """
+    candidates = []
+    for path in group["paths"]:
+        size, mtime, packed = index.entry(path)
+        if packed:
+            continue
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            continue
+        if _matches_manifest(stat_result, size, mtime):
+            candidates.append((path, stat_result))
+    if len(candidates) < 2:
+        return 0, 0, []
+
+    source, source_stat = candidates[0]
+    num_linked = 0
+    reclaimed = 0
+    errors = []
+    for path, stat_result in candidates[1:]:
+        if stat_result.st_dev != source_stat.st_dev:
+            continue
+        if stat_result.st_ino == source_stat.st_ino:
+            continue
+        if (stat_result.st_mtime != source_stat.st_mtime or
+                stat_result.st_mode != source_stat.st_mode):
+            continue
+        tmp_path = path + ".dtool-dedup.tmp"
+        try:
+            os.link(source, tmp_path)
+            try:
+                os.rename(tmp_path, path)
+            except OSError:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            errors.append((path, e.strerror or str(e)))
+            continue
+        num_linked += 1
+        if stat_result.st_nlink == 1:
+            reclaimed += stat_result.st_size
+    return num_linked, reclaimed, errors
@@ -0,0 +1,95 @@
+"""Registry of hash functions.
+
+The manifest of a dataset is keyed by the hash function named in it, the
+``shasum`` used by dtoolcore. Additional hash functions from the registry
+can be computed in the same read of each file and stored as overlays, for
+example to record a faster checksum alongside the legacy one.
+"""
+
+import os
+import time
+import hashlib
+
+#: Buffer size used when reading files.
+BUF_SIZE = 65536
+
+_HASH_FUNCTIONS = {
+    "shasum": hashlib.sha1,
+    "md5sum": hashlib.md5,
+    "sha256sum": hashlib.sha256,
+}
+if hasattr(hashlib, "blake2b"):
+    _HASH_FUNCTIONS["blake2b"] = hashlib.blake2b
+
+
+def register_hash_function(name, constructor):
+    """Register a hash function.
+
+    :param name: name used to refer to the hash function
+    :param constructor: callable returning an object with the
+                        :mod:`hashlib` ``update`` and ``hexdigest``
+                        methods; must be picklable to be used by worker
+                        processes
+    """
+    _HASH_FUNCTIONS[name] = constructor
+
+
+def hash_function_names():
+    """Return sorted list of the names of the registered hash functions."""
+    return sorted(_HASH_FUNCTIONS)
+
+
+def get_hash_function(name):
+    """Return constructor of a registered hash function.
+
+    :raises: ValueError if no hash function is registered under name
+    """
+    try:
+        return _HASH_FUNCTIONS[name]
+    except KeyError:
+        raise ValueError("Unknown hash function: {}".format(name))
+
+
+class MultiHasher(object):
+    """Compute several hashes from a single stream of bytes.
+
+    :param names: names of registered hash functions
+    """
+
+    def __init__(self, names):
+        self._hashers = [(name, get_hash_function(name)()) for name in names]
+
+    def update(self, buf):
+        for _, hasher in self._hashers:
+            hasher.update(buf)
+
+    def hexdigests(self):
+        """Return dictionary of hash function names and hex digests."""
+        return dict((name, hasher.hexdigest())
+                    for name, hasher in self._hashers)
+
+
+def benchmark(names=None, size=64 * 2**20):
+    """Return the throughput of hash functions on this machine.
+
+    Each hash function hashes the same random bytes, in buffers of the size
+    used when reading files.
+
+    :param names: names of registered hash functions; all if None
+    :param size: number of bytes to hash
+    :returns: dictionary of hash function names and bytes per second
+    """
+    if names is None:
+        names = hash_function_names()
+    buf = os.urandom(BUF_SIZE)
+    num_bufs = max(1, size // BUF_SIZE)
+    throughputs = {}
+    for name in names:
+        hasher = get_hash_function(name)()
+        start = time.time()
+        for _ in range(num_bufs):
+            hasher.update(buf)
+        hasher.hexdigest()
+        elapsed = max(time.time() - start, 1e-9)
+        throughputs[name] = num_bufs * BUF_SIZE / elapsed
+    return throughputs
@@ -0,0 +1,1106 @@
+"""Manifest module."""
+
+import os
+import json
+import heapq
+import shutil
+import tempfile
+import functools
+import multiprocessing
+
+from dtoolcore import Manifest
+
+from dtool.archive import (
+    ARCHIVE_OVERLAY,
+    archive_members,
+    archive_members_from_path,
+    looks_like_archive,
+)
+from dtool.hashing import BUF_SIZE, MultiHasher, hash_function_names
+from dtool.manifest_index import INDEX_NAME, IndexWriter, _encode
+from dtool.overlays import (
+    FileSample,
+    OverlayCache,
+    get_overlay_function,
+    overlay_function_names,
+)
+from dtool.packed import PACKED_DIR, PackedFiles, member_metadata
+from dtool.pipeline import (
+    DEFAULT_QUEUE_DEPTH,
+    DEFAULT_READ_SIZE,
+    read_pipelined,
+)
+from dtool.walk import IGNORE_FILE_NAME, IgnorePatterns, walk_files
+
+
+#: Names of the overlay functions always run alongside the manifest.
+OVERLAY_NAMES = ["mimetype"]
+
+#: Name of the journal of hashed items in the .dtool directory.
+JOURNAL_NAME = "manifest_journal.jsonl"
+
+#: Name of the file in the .dtool directory recording the inode and ctime
+#: of each file when it was hashed.
+STAT_NAME = "manifest_stat.json"
+
+# Keys of the entries generated for files on disk that are recorded in the
+# stat file rather than in the manifest.
+_STAT_KEYS = ("inode", "ctime")
+
+#: Number of files whose hashing is scheduled together.
+BATCH_SIZE = 10000
+
+#: Number of items kept in memory when writing a manifest.
+BUFFER_SIZE = 100000
+
+
+class _FileMetadata(object):
+    """File metadata and overlay values worked out from a file's buffers.
+
+    Feed the buffers read from the file, in order, to :meth:`update`.
+
+    :param task: tuple of hash function name, manifest root, relative
+                 path, names of additional hash functions whose hashes
+                 are returned as overlay values, whether to list the
+                 members of archives and names of overlay functions
+    :param overlay_cache: :class:`dtool.overlays.OverlayCache` with the
+                          overlay values of known hashes
+    """
+
+    def __init__(self, task, overlay_cache=None):
+        (hash_function, abs_manifest_root, rel_path, extra_hashes,
+         archives, overlays) = task
+        self.hash_function = hash_function
+        self.rel_path = rel_path
+        self.extra_hashes = extra_hashes
+        self.archives = archives
+        self.overlays = overlays
+        self.fpath = os.path.join(abs_manifest_root, rel_path)
+        if overlay_cache is None:
+            overlay_cache = OverlayCache()
+        self.overlay_cache = overlay_cache
+        self._hasher = MultiHasher([hash_function] + list(extra_hashes))
+        self._sample = FileSample(functools.partial(open, self.fpath, "rb"))
+
+    def update(self, buf):
+        self._hasher.update(buf)
+        self._sample.update(buf)
+
+    def result(self):
+        """Return tuple of dictionary with file metadata and dictionary with
+        overlay values."""
+        stat_result = os.stat(self.fpath)
+        hexdigests = self._hasher.hexdigests()
+        entry = dict(hash=hexdigests[self.hash_function],
+                     size=stat_result.st_size,
+                     mtime=stat_result.st_mtime)
+        entry["path"] = self.rel_path
+        _add_stat(entry, stat_result)
+        item_overlays = self.overlay_cache.compute(
+            self.overlays, entry["hash"], self.fpath, self._sample)
+        for name in self.extra_hashes:
+            item_overlays[name] = hexdigests[name]
+        if self.archives:
+            try:
+                members = self.overlay_cache.lookup(
+                    ARCHIVE_OVERLAY, entry["hash"])
+            except KeyError:
+                members = None
+                if looks_like_archive(self._sample.head, self._sample.tail):
+                    members = archive_members_from_path(
+                        self.fpath, self.hash_function)
+            item_overlays[ARCHIVE_OVERLAY] = members
+        return entry, item_overlays
+
+
+def _file_metadata(task, overlay_cache=None):
+    """Return dictionary with file metadata and the file's overlay values.
+
+    The file is read once; each buffer is used both for hashing and for
+    working out the overlay values. Overlay values are only computed if
+    they are not in the overlay cache.
+
+    This is a module level function so that it can be sent to worker
+    processes.
+
+    :param task: see :class:`dtool.manifest._FileMetadata`
+    :param overlay_cache: :class:`dtool.overlays.OverlayCache`; overlay
+                          values are computed if None
+    :returns: tuple of dictionary with file metadata and dictionary with
+              overlay values
+    """
+    file_metadata = _FileMetadata(task, overlay_cache)
+    with open(file_metadata.fpath, "rb") as fh:
+        buf = fh.read(BUF_SIZE)
+        while len(buf) > 0:
+            file_metadata.update(buf)
+            buf = fh.read(BUF_SIZE)
+    return file_metadata.result()
+
+
+def _imap_largest_first(pool, func, tasks, sizes):
+    """Yield results of func applied to tasks.
+
+    With a pool the results are yielded as they complete and the tasks are
+    submitted largest first, so that no worker is left holding one big file
+    at the end of a batch. Without a pool the tasks are run in order.
+
+    :param pool: :class:`multiprocessing.Pool` or None
+    :param func: module level function to apply to each task
+    :param tasks: list of tasks
+    :param sizes: list of task sizes in bytes
+    :returns: generator of results
+    """
+    if pool is None:
+        for task in tasks:
+            yield func(task)
+        return
+
+    order = sorted(range(len(tasks)), key=lambda i: sizes[i], reverse=True)
+    for result in pool.imap_unordered(func, [tasks[i] for i in order]):
+        yield result
+
+
+def _add_stat(entry, stat_result):
+    entry["inode"] = stat_result.st_ino
+    entry["ctime"] = stat_result.st_ctime
+
+
+def _is_unchanged(entry, stat_result, racy_mtime):
+    """Return True if the manifest entry is up to date with the file.
+
+    A file modified at, or after, racy_mtime may have been changed
+    without its mtime changing and is therefore never considered to be
+    unchanged. If the entry records the inode and ctime of the file, a file
+    replaced by one with the same size and mtime, as by ``rsync -t`` or
+    ``cp -p``, is not considered to be unchanged either.
+
+    :param entry: dictionary with file metadata from a manifest
+    :param stat_result: result of calling :func:`os.stat` on the file
+    :param racy_mtime: modification time of the manifest
+    :returns: bool
+    """
+    if entry["size"] != stat_result.st_size:
+        return False
+    if entry["mtime"] != stat_result.st_mtime:
+        return False
+    if "inode" in entry and (entry["inode"] != stat_result.st_ino or
+                             entry["ctime"] != stat_result.st_ctime):
+        return False
+    return stat_result.st_mtime < racy_mtime
+
+
+class ManifestJournal(object):
+    """Append only record of the items hashed while updating a manifest.
+
+    Each hashed item is written to the journal as soon as it is available,
+    so that the work is not lost if the update is interrupted.
+
+    :param path: path to the journal file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = None
+        self._items = {}
+        self._fh = None
+
+    def __len__(self):
+        return len(self._items)
+
+    def load(self):
+        """Read the items recorded in the journal, if it exists.
+
+        A partially written last line, left by an interrupted update, is
+        ignored.
+        """
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path) as fh:
+            for line in fh:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                entry = record["entry"]
+                self._items[entry["path"]] = (entry, record["overlays"])
+        self.mtime = os.stat(self.path).st_mtime
+
+    def lookup(self, rel_path, stat_result, overlay_names=OVERLAY_NAMES):
+        """Return recorded item if the file is unchanged since it was hashed.
+
+        :param rel_path: path relative to the manifest root
+        :param stat_result: result of calling :func:`os.stat` on the file
+        :param overlay_names: names of the overlay values the item must have
+        :returns: tuple of dictionary with file metadata and dictionary with
+                  overlay values, or None
+        """
+        item = self._items.get(rel_path)
+        if item is None:
+            return None
+        if not _is_unchanged(item[0], stat_result, self.mtime):
+            return None
+        if any(name not in item[1] for name in overlay_names):
+            return None
+        return item
+
+    def open(self, append=False):
+        """Open the journal for writing.
+
+        :param append: keep the items already in the journal
+        """
+        mode = "a" if append else "w"
+        self._fh = open(self.path, mode)
+
+    def append(self, entry, item_overlays):
+        """Record a hashed item."""
+        record = {"entry": entry, "overlays": item_overlays}
+        self._fh.write(json.dumps(record) + "\n")
+        self._fh.flush()
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def remove(self):
+        """Remove the journal file."""
+        self.close()
+        if os.path.isfile(self.path):
+            os.unlink(self.path)
+
+
+def _reuse_previous(
+        entry,
+        stat_result,
+        racy_mtime,
+        previous_overlays,
+        fpath,
+        extra_hashes,
+        hash_function,
+        archives=False,
+        overlays=OVERLAY_NAMES,
+        overlay_cache=None):
+    """Return item from the previous manifest if the file is unchanged.
+
+    Overlay values missing from the overlay cache are worked out by the
+    overlay functions, or for the archive members overlay by reading the
+    archive. Files missing a value of an additional hash function have to
+    be rehashed.
+
+    :returns: tuple of dictionary with file metadata and dictionary with
+              overlay values, or None
+    """
+    if entry is None or not _is_unchanged(entry, stat_result, racy_mtime):
+        return None
+    entry = dict(entry)
+    _add_stat(entry, stat_result)
+    item_overlays = {}
+    for name in extra_hashes:
+        value = previous_overlays.get(name, {}).get(entry["hash"])
+        if value is None:
+            return None
+        item_overlays[name] = value
+    if overlay_cache is None:
+        overlay_cache = OverlayCache(previous_overlays)
+    item_overlays.update(
+        overlay_cache.compute(overlays, entry["hash"], fpath))
+    if archives:
+        members = previous_overlays.get(ARCHIVE_OVERLAY, {})
+        if entry["hash"] in members:
+            item_overlays[ARCHIVE_OVERLAY] = members[entry["hash"]]
+        else:
+            item_overlays[ARCHIVE_OVERLAY] = archive_members_from_path(
+                fpath, hash_function)
+    return entry, item_overlays
+
+
+def _packed_items(
+        packed,
+        walked,
+        hash_function,
+        extra_hashes,
+        root,
+        archives=False,
+        select=None,
+        overlays=OVERLAY_NAMES,
+        overlay_cache=None):
+    """Yield items of the files packed into shards.
+
+    Files that are also on disk, in walked, and files not selected are left
+    out. Values missing from a shard's index, and from the overlay cache,
+    are worked out from the member's content.
+    """
+    if overlay_cache is None:
+        overlay_cache = OverlayCache()
+    for shard in packed.shards:
+        shard_rel_path = os.path.relpath(shard.path, root)
+        for record in shard.members:
+            if record["path"] in walked:
+                continue
+            if select is not None and not select(record["path"]):
+                continue
+            missing = [name for name in extra_hashes
+                       if name not in record["overlays"]]
+            if missing or shard.hash_function != hash_function:
+                record = dict(record)
+                record.update(member_metadata(
+                    record["path"],
+                    shard.read(record["path"]),
+                    hash_function,
+                    extra_hashes))
+            entry = dict(hash=record["hash"],
+                         size=record["size"],
+                         mtime=record["mtime"])
+            entry["path"] = record["path"]
+            entry["shard"] = shard_rel_path
+            entry["offset"] = record["offset"]
+            item_overlays = dict(
+                (name, record["overlays"][name])
+                for name in list(extra_hashes) + list(overlays)
+                if name in record["overlays"])
+            missing = [name for name in overlays if name not in item_overlays]
+            if missing:
+                item_overlays.update(overlay_cache.compute(
+                    missing,
+                    record["hash"],
+                    os.path.join(root, record["path"]),
+                    lambda: FileSample.from_bytes(
+                        shard.read(record["path"]))))
+            if archives:
+                item_overlays[ARCHIVE_OVERLAY] = archive_members(
+                    shard.open(record["path"]), hash_function)
+            yield entry, item_overlays
+
+
+class _Hasher(object):
+    """Hash batches of files using a process pool or a read pipeline.
+
+    The overlay cache is used when hashing files in this process, by hasher
+    threads of a pipeline or in turn. Worker processes compute the overlay
+    values of the files they hash.
+    """
+
+    def __init__(
+            self,
+            workers,
+            readers,
+            read_size,
+            queue_depth,
+            overlay_cache=None):
+        self.workers = workers
+        self.readers = readers
+        self.read_size = read_size
+        self.queue_depth = queue_depth
+        if overlay_cache is None:
+            overlay_cache = OverlayCache()
+        self.overlay_cache = overlay_cache
+        self._pool = None
+        if readers == 0 and workers > 1:
+            self._pool = multiprocessing.Pool(workers)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+
+    def hash_files(self, tasks, sizes, journal):
+        if self.readers == 0:
+            func = _file_metadata
+            if self._pool is None:
+                func = functools.partial(
+                    _file_metadata, overlay_cache=self.overlay_cache)
+            items = _imap_largest_first(self._pool, func, tasks, sizes)
+        else:
+            order = sorted(
+                range(len(tasks)), key=lambda i: sizes[i], reverse=True)
+            items = read_pipelined(
+                [_FileMetadata(tasks[i], self.overlay_cache) for i in order],
+                readers=self.readers,
+                hashers=self.workers,
+                read_size=self.read_size,
+                queue_depth=self.queue_depth)
+        for item in items:
+            if journal is not None:
+                journal.append(*item)
+            yield item
+
+
+def generate_items(
+        manifest,
+        workers=1,
+        previous=None,
+        racy_mtime=None,
+        previous_overlays=None,
+        ignore=None,
+        journal=None,
+        batch_size=BATCH_SIZE,
+        extra_hashes=(),
+        readers=0,
+        read_size=DEFAULT_READ_SIZE,
+        queue_depth=DEFAULT_QUEUE_DEPTH,
+        archives=False,
+        select=None,
+        overlays=None):
+    """Yield the file metadata and overlay values of a manifest's files.
+
+    Files are hashed in parallel and each file is only read once. The files
+    are walked lazily and hashed in batches, so that the number of items
+    held in memory does not depend on the number of files. Items are
+    yielded in no particular order.
+
+    Files packed into shards by :mod:`dtool.packed` get entries recording
+    their shard and offset, using the hashes in the shard indexes.
+
+    With readers, files are hashed using a :mod:`dtool.pipeline` of reader
+    and hasher threads instead of worker processes, which suits high latency
+    storage.
+
+    :param manifest: :class:`dtoolcore.Manifest`
+    :param workers: number of worker processes used to hash files, or of
+                    hasher threads if using readers
+    :param previous: previous file list; entries whose size and mtime match
+                     the file on disk are reused rather than rehashed
+    :param racy_mtime: modification time of the previous manifest
+    :param previous_overlays: dictionary of previous overlays; used for the
+                              items reused from the previous file list,
+                              and as a cache of the values of the overlay
+                              functions keyed by hash
+    :param ignore: :class:`dtool.walk.IgnorePatterns` of files to leave out
+    :param journal: :class:`dtool.manifest.ManifestJournal` open for
+                    writing; items recorded in it are reused and newly
+                    hashed items are appended to it
+    :param batch_size: number of files whose hashing is scheduled together
+    :param extra_hashes: names of additional hash functions, from
+                         :mod:`dtool.hashing`, whose hashes are computed in
+                         the same read and returned as overlay values
+    :param readers: number of reader threads; 0 to not use a pipeline
+    :param read_size: number of bytes read at a time by reader threads
+    :param queue_depth: number of chunks queued for each hasher thread
+    :param archives: list the members of tar and zip archives in the
+                     :data:`dtool.archive.ARCHIVE_OVERLAY` overlay
+    :param select: function called with the relative path of each file;
+                   only files for which it returns True are included
+    :param overlays: names of the overlay functions, from
+                     :mod:`dtool.overlays`, whose values are returned;
+                     defaults to :data:`dtool.manifest.OVERLAY_NAMES`
+    :returns: generator of tuples of dictionary with file metadata and
+              dictionary with overlay values
+    """
+    if previous is None:
+        previous = []
+    if racy_mtime is None:
+        racy_mtime = float("inf")
+    if previous_overlays is None:
+        previous_overlays = {}
+    previous_entries = dict((entry["path"], entry) for entry in previous)
+
+    hash_function = manifest["hash_function"]
+    abs_manifest_root = manifest.abs_manifest_root
+    extra_hashes = list(extra_hashes)
+    if overlays is None:
+        overlays = OVERLAY_NAMES
+    overlays = list(overlays)
+    overlay_names = overlays + extra_hashes
+    if archives:
+        overlay_names.append(ARCHIVE_OVERLAY)
+    overlay_cache = OverlayCache(previous_overlays)
+
+    ignore_prefixes = list(manifest.ignore_prefixes) + [PACKED_DIR]
+    packed = PackedFiles(abs_manifest_root)
+    walked = set()
+
+    hasher = _Hasher(
+        workers, readers, read_size, queue_depth, overlay_cache)
+
+    try:
+        tasks = []
+        sizes = []
+        for rel_path in walk_files(
+                abs_manifest_root, ignore, ignore_prefixes):
+            fpath = os.path.join(abs_manifest_root, rel_path)
+            stat_result = None
+            if len(packed):
+                stat_result = os.stat(fpath)
+                # Packed files are removed after the manifest is written.
+                if packed.is_original(rel_path, stat_result):
+                    continue
+                walked.add(rel_path)
+            if select is not None and not select(rel_path):
+                continue
+            if stat_result is None:
+                stat_result = os.stat(fpath)
+            item = None
+            if journal is not None:
+                item = journal.lookup(rel_path, stat_result, overlay_names)
+            if item is None:
+                item = _reuse_previous(
+                    previous_entries.get(rel_path),
+                    stat_result,
+                    racy_mtime,
+                    previous_overlays,
+                    fpath,
+                    extra_hashes,
+                    hash_function,
+                    archives,
+                    overlays,
+                    overlay_cache)
+            if item is not None:
+                yield item
+                continue
+            tasks.append((hash_function, abs_manifest_root, rel_path,
+                          extra_hashes, archives, overlays))
+            sizes.append(stat_result.st_size)
+            if len(tasks) >= batch_size:
+                for item in hasher.hash_files(tasks, sizes, journal):
+                    yield item
+                tasks = []
+                sizes = []
+        for item in hasher.hash_files(tasks, sizes, journal):
+            yield item
+        for item in _packed_items(
+                packed,
+                walked,
+                hash_function,
+                extra_hashes,
+                abs_manifest_root,
+                archives,
+                select,
+                overlays,
+                overlay_cache):
+            yield item
+    finally:
+        hasher.close()
+
+
+def generate_file_list_and_overlays(manifest, workers=1, **kwargs):
+    """Return the manifest file list and the overlays of its items.
+
+    The file list is sorted by path. See
+    :func:`dtool.manifest.generate_items` for the keyword arguments.
+
+    :param manifest: :class:`dtoolcore.Manifest`
+    :param workers: number of worker processes used to hash files
+    :returns: tuple of file list and dictionary of overlays
+    """
+    overlay_names = list(kwargs.get("overlays") or OVERLAY_NAMES)
+    overlay_names += list(kwargs.get("extra_hashes", []))
+    if kwargs.get("archives"):
+        overlay_names.append(ARCHIVE_OVERLAY)
+    file_list = []
+    overlays = dict((name, {}) for name in overlay_names)
+    for entry, item_overlays in generate_items(manifest, workers, **kwargs):
+        for key in _STAT_KEYS:
+            entry.pop(key, None)
+        file_list.append(entry)
+        for name in overlay_names:
+            overlays[name][entry["hash"]] = item_overlays[name]
+    file_list.sort(key=lambda entry: entry["path"])
+    return file_list, overlays
+
+
+class _ExternalSorter(object):
+    """Sort records that may not fit in memory.
+
+    Records are lists whose first element is the sort key. Whenever
+    buffer_size records have been added they are sorted and written to a
+    temporary run file. The runs are merged when iterating.
+    """
+
+    def __init__(self, tmp_dir, buffer_size):
+        self.tmp_dir = tmp_dir
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._run_paths = []
+
+    def add(self, record):
+        self._buffer.append(record)
+        if len(self._buffer) >= self.buffer_size:
+            self._write_run()
+
+    def _write_run(self):
+        self._buffer.sort(key=lambda record: record[0])
+        fd, path = tempfile.mkstemp(dir=self.tmp_dir, suffix=".run")
+        with os.fdopen(fd, "w") as fh:
+            for record in self._buffer:
+                fh.write(json.dumps(record) + "\n")
+        self._run_paths.append(path)
+        self._buffer = []
+
+    @staticmethod
+    def _read_run(path):
+        with open(path) as fh:
+            for line in fh:
+                yield json.loads(line)
+
+    @staticmethod
+    def _decorate(records, run_index):
+        # The run index and position make the heap keys unique, so that the
+        # records themselves are never compared.
+        for position, record in enumerate(records):
+            yield record[0], run_index, position, record
+
+    def __iter__(self):
+        self._buffer.sort(key=lambda record: record[0])
+        runs = [self._decorate(self._read_run(path), i)
+                for i, path in enumerate(self._run_paths)]
+        runs.append(self._decorate(self._buffer, len(runs)))
+        for decorated in heapq.merge(*runs):
+            yield decorated[-1]
+
+
+class ManifestWriter(object):
+    """Write a manifest and its overlays without holding them in memory.
+
+    Items can be added in any order. An external merge sort is used so that
+    the output is deterministic: the file list is sorted by encoded path, as
+    in the index, and the overlays by hash. Memory use is bounded by the
+    buffer size rather than by the number of files. The manifest has one
+    file list entry per line.
+
+    Use as a context manager, which removes the temporary files.
+
+    :param manifest_path: path to write the manifest to
+    :param overlay_paths: dictionary of overlay names and paths to write
+                          the overlays to
+    :param header: dictionary with the manifest's keys other than the file
+                   list
+    :param tmp_dir: directory in which to create temporary files
+    :param buffer_size: number of items kept in memory
+    :param index_path: path to write a :mod:`dtool.manifest_index` index
+                       of the manifest to; no index is written if None
+    :param stat_path: path to write the inodes and ctimes of the entries
+                      to; they are left out if None
+    """
+
+    def __init__(
+            self,
+            manifest_path,
+            overlay_paths,
+            header,
+            tmp_dir,
+            buffer_size=BUFFER_SIZE,
+            index_path=None,
+            stat_path=None):
+        self.manifest_path = manifest_path
+        self.overlay_paths = overlay_paths
+        self.header = header
+        self.index_path = index_path
+        self.stat_path = stat_path
+        self._tmp_dir = tempfile.mkdtemp(dir=tmp_dir)
+        self._entries = _ExternalSorter(self._tmp_dir, buffer_size)
+        self._overlays = _ExternalSorter(self._tmp_dir, buffer_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+    def add(self, entry, item_overlays):
+        """Add the file metadata and overlay values of an item."""
+        # Sort by the encoded path, as the index does. Decoding the bytes as
+        # latin-1 keeps their order and makes the key JSON serialisable.
+        self._entries.add([_encode(entry["path"]).decode("latin-1"), entry])
+        self._overlays.add([entry["hash"], item_overlays])
+
+    def _write_manifest(self, fh, index_writer, stat_fh):
+        fh.write("{\n")
+        for key, value in self.header.items():
+            fh.write("  {}: {},\n".format(json.dumps(key), json.dumps(value)))
+        fh.write('  "file_list": [')
+        stat_fh.write("{")
+        separator = "\n    "
+        stat_separator = "\n  "
+        for _, entry in self._entries:
+            if "inode" in entry:
+                stat_fh.write("{}{}: {}".format(
+                    stat_separator,
+                    json.dumps(entry["path"]),
+                    json.dumps([entry[key] for key in _STAT_KEYS])))
+                stat_separator = ",\n  "
+                entry = dict((key, value) for key, value in entry.items()
+                             if key not in _STAT_KEYS)
+            fh.write(separator + json.dumps(entry))
+            if index_writer is not None:
+                index_writer.add(entry)
+            separator = ",\n    "
+        if separator != "\n    ":
+            fh.write("\n  ")
+        fh.write("]\n}\n")
+        if stat_separator != "\n  ":
+            stat_fh.write("\n")
+        stat_fh.write("}\n")
+
+    def _write_overlays(self, fhs):
+        separator = "\n  "
+        previous_hash = None
+        for item_hash, item_overlays in self._overlays:
+            # Files with identical content share an identifier.
+            if item_hash == previous_hash:
+                continue
+            previous_hash = item_hash
+            for name, fh in fhs.items():
+                fh.write("{}{}: {}".format(
+                    separator,
+                    json.dumps(item_hash),
+                    json.dumps(item_overlays[name])))
+            separator = ",\n  "
+        for fh in fhs.values():
+            if separator != "\n  ":
+                fh.write("\n")
+            fh.write("}\n")
+
+    def write(self):
+        """Write the manifest, its index and the overlays.
+
+        The files are written to temporary files which are then moved into
+        place, so that existing files are replaced atomically.
+        """
+        tmp_paths = {}
+
+        index_writer = None
+        if self.index_path is not None:
+            index_writer = IndexWriter(self._tmp_dir)
+
+        tmp_manifest_path = self.manifest_path + ".tmp"
+        tmp_paths[self.manifest_path] = tmp_manifest_path
+        try:
+            try:
+                stat_path = self.stat_path
+                if stat_path is None:
+                    stat_path = os.devnull
+                else:
+                    tmp_paths[stat_path] = stat_path + ".tmp"
+                    stat_path = tmp_paths[stat_path]
+                with open(tmp_manifest_path, "w") as fh:
+                    with open(stat_path, "w") as stat_fh:
+                        self._write_manifest(fh, index_writer, stat_fh)
+                if index_writer is not None:
+                    tmp_paths[self.index_path] = self.index_path + ".tmp"
+                    index_writer.write(
+                        tmp_paths[self.index_path], tmp_manifest_path)
+            finally:
+                if index_writer is not None:
+                    index_writer.close()
+
+            fhs = {}
+            try:
+                for name, path in self.overlay_paths.items():
+                    tmp_paths[path] = path + ".tmp"
+                    fhs[name] = open(tmp_paths[path], "w")
+                    fhs[name].write("{")
+                self._write_overlays(fhs)
+            finally:
+                for fh in fhs.values():
+                    fh.close()
+        except BaseException:
+            for tmp_path in tmp_paths.values():
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+            raise
+
+        for path, tmp_path in tmp_paths.items():
+            os.rename(tmp_path, path)
+
+
+def _read_overlays(dataset, names):
+    """Return dictionary with the named overlays that exist on disk."""
+    overlays = {}
+    for name in names:
+        fpath = os.path.join(dataset._abs_overlays_path, name + ".json")
+        if os.path.isfile(fpath):
+            with open(fpath) as fh:
+                overlays[name] = json.load(fh)
+    return overlays
+
+
+def _read_stat(dataset):
+    """Return dictionary of the inode and ctime of each file, by path."""
+    path = os.path.join(dataset._abs_path, ".dtool", STAT_NAME)
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def _entries_with_stat(dataset):
+    """Return the file list of a dataset with the recorded inodes and
+    ctimes of its files."""
+    stat = _read_stat(dataset)
+    entries = []
+    for entry in dataset._structural_metadata["file_list"]:
+        if entry["path"] in stat:
+            entry = dict(entry)
+            for key, value in zip(_STAT_KEYS, stat[entry["path"]]):
+                entry[key] = value
+        entries.append(entry)
+    return entries
+
+
+def _previous_manifest(dataset, overlay_names):
+    """Return previous file list, its racy mtime and the previous overlays.
+
+    Returns a tuple of None values if the dataset has no manifest yet.
+    """
+    if not os.path.isfile(dataset._abs_manifest_path):
+        return None, None, None
+    return (_entries_with_stat(dataset),
+            os.stat(dataset._abs_manifest_path).st_mtime,
+            _read_overlays(dataset, overlay_names))
+
+
+def resolve_overlays(dataset, extra_hashes=(), archives=False):
+    """Return the additional overlays to create alongside a manifest.
+
+    These are the requested ones and those that the dataset already has.
+
+    :param dataset: :class:`dtoolcore.DataSet`
+    :param extra_hashes: names of requested additional hash functions
+    :param archives: whether the archive members overlay is requested
+    :returns: tuple of sorted list of additional hash function names and
+              whether to create the archive members overlay
+    :raises: ValueError if an additional hash function is not registered
+    """
+    for name in extra_hashes:
+        if name not in hash_function_names():
+            raise ValueError("Unknown hash function: {}".format(name))
+    extra_hashes = set(extra_hashes)
+    for name in hash_function_names():
+        fpath = os.path.join(dataset._abs_overlays_path, name + ".json")
+        if os.path.isfile(fpath):
+            extra_hashes.add(name)
+    extra_hashes.discard(dataset._structural_metadata["hash_function"])
+    archives_path = os.path.join(
+        dataset._abs_overlays_path, ARCHIVE_OVERLAY + ".json")
+    archives = archives or os.path.isfile(archives_path)
+    return sorted(extra_hashes), archives
+
+
+def resolve_overlay_functions(dataset, overlays=()):
+    """Return the overlay functions to run alongside a manifest update.
+
+    These are the ones in :data:`dtool.manifest.OVERLAY_NAMES`, the
+    requested ones and those whose overlays the dataset already has.
+
+    :param dataset: :class:`dtoolcore.DataSet`
+    :param overlays: names of requested overlay functions
+    :returns: sorted list of overlay function names
+    :raises: ValueError if an overlay function is not registered
+    """
+    for name in overlays:
+        get_overlay_function(name)
+    names = set(OVERLAY_NAMES) | set(overlays)
+    for name in overlay_function_names():
+        fpath = os.path.join(dataset._abs_overlays_path, name + ".json")
+        if os.path.isfile(fpath):
+            names.add(name)
+    return sorted(names)
+
+
+def dataset_manifest_writer(
+        dataset,
+        overlay_names,
+        buffer_size=BUFFER_SIZE,
+        index=False):
+    """Return :class:`dtool.manifest.ManifestWriter` for a dataset.
+
+    The writer replaces the dataset's manifest and the named overlays. The
+    index is written if requested or if the dataset already has one.
+
+    :param dataset: :class:`dtoolcore.DataSet`
+    :param overlay_names: names of the overlays to write
+    :param buffer_size: number of items kept in memory
+    :param index: write an index of the manifest
+    :returns: :class:`dtool.manifest.ManifestWriter`
+    """
+    manifest = dataset._structural_metadata
+    dtool_dir_path = os.path.join(dataset._abs_path, ".dtool")
+    if not os.path.isdir(dataset._abs_overlays_path):
+        os.mkdir(dataset._abs_overlays_path)
+    overlay_paths = dict(
+        (name, os.path.join(dataset._abs_overlays_path, name + ".json"))
+        for name in overlay_names)
+    header = dict(
+        (key, value) for key, value in manifest.items() if key != "file_list")
+    index_path = os.path.join(dtool_dir_path, INDEX_NAME)
+    if not index and not os.path.isfile(index_path):
+        index_path = None
+    return ManifestWriter(
+        dataset._abs_manifest_path,
+        overlay_paths,
+        header,
+        dtool_dir_path,
+        buffer_size,
+        index_path,
+        os.path.join(dtool_dir_path, STAT_NAME))
+
+
+def update_manifest(
+        dataset,
+        workers=1,
+        incremental=False,
+        resume=False,
+        buffer_size=BUFFER_SIZE,
+        index=False,
+        extra_hashes=(),
+        readers=0,
+        read_size=DEFAULT_READ_SIZE,
+        queue_depth=DEFAULT_QUEUE_DEPTH,
+        archives=False,
+        overlays=()):
+    """Update the manifest of a dataset and its mimetype overlay.
+
+    By default the manifest is fully regenerated, as by
+    :meth:`dtoolcore.DataSet.update_manifest`. In incremental mode only
+    files that are new, or whose size or mtime have changed, are hashed.
+    Entries of deleted files are removed in both modes. Files matching the
+    patterns in the dataset's ``.dtoolignore`` file are left out.
+
+    The mimetype overlay is the same as the one created by
+    :func:`dtoolutils.overlays.add_mimetype`, but is worked out from the
+    bytes read when hashing the files.
+
+    In incremental mode a file is unchanged if its size, mtime, inode and
+    ctime are those it had when it was hashed. The inodes and ctimes are
+    recorded in :data:`dtool.manifest.STAT_NAME` in the ``.dtool``
+    directory rather than in the manifest.
+
+    Hashed items are recorded in a journal in the ``.dtool`` directory as
+    they complete. If the update is interrupted, resuming it reuses the
+    journalled items of files that have not changed. The
+    manifest and overlays are only replaced once all files have been hashed.
+
+    The manifest and overlays are written using a
+    :class:`dtool.manifest.ManifestWriter`, so that the memory used for
+    building them is bounded regardless of the number of files. The file
+    list is sorted by path.
+
+    If requested, or if the dataset already has one, a
+    :mod:`dtool.manifest_index` index is written next to the manifest.
+
+    Hashes of additional hash functions from :mod:`dtool.hashing` are
+    computed in the same read of each file and stored as overlays named
+    after the hash functions. Overlays of additional hash functions that the
+    dataset already has are kept up to date.
+
+    If requested, or if the dataset already has one, the members of tar and
+    zip archives are listed in the :data:`dtool.archive.ARCHIVE_OVERLAY`
+    overlay, without extracting them. The value of files that are not
+    archives is null.
+
+    The values of the requested overlay functions from
+    :mod:`dtool.overlays`, and of those whose overlays the dataset already
+    has, are computed alongside the mimetype. In incremental mode, as the
+    values depend only on the content of a file, the values of files whose
+    hash is in the current overlays are reused rather than recomputed. All
+    overlay values are recomputed when not in incremental mode.
+
+    Does nothing if dataset is not persisted.
+
+    :param dataset: :class:`dtoolcore.DataSet`
+    :param workers: number of worker processes used to hash files, or of
+                    hasher threads if using readers
+    :param incremental: only rehash new and changed files
+    :param resume: reuse the items in the journal of an interrupted update
+    :param buffer_size: number of items kept in memory when writing the
+                        manifest
+    :param index: write an index of the manifest
+    :param extra_hashes: names of additional hash functions
+    :param readers: number of reader threads of a :mod:`dtool.pipeline`
+                    used to read files; 0 to hash files in worker processes
+    :param read_size: number of bytes read at a time by reader threads
+    :param queue_depth: number of chunks queued for each hasher thread
+    :param archives: list the members of archives in an overlay
+    :param overlays: names of additional overlay functions
+    :raises: ValueError if an additional hash function or overlay function
+             is not registered
+    """
+    if not dataset._abs_path:
+        return
+
+    manifest = dataset._structural_metadata
+    extra_hashes, archives = resolve_overlays(dataset, extra_hashes, archives)
+    overlays = resolve_overlay_functions(dataset, overlays)
+    overlay_names = overlays + extra_hashes
+    if archives:
+        overlay_names.append(ARCHIVE_OVERLAY)
+
+    previous, racy_mtime, previous_overlays = None, None, None
+    if incremental:
+        previous, racy_mtime, previous_overlays = _previous_manifest(
+            dataset, overlay_names)
+
+    ignore = IgnorePatterns.from_path(
+        os.path.join(dataset._abs_path, IGNORE_FILE_NAME))
+
+    dtool_dir_path = os.path.join(dataset._abs_path, ".dtool")
+    journal = ManifestJournal(os.path.join(dtool_dir_path, JOURNAL_NAME))
+    if resume:
+        journal.load()
+
+    with dataset_manifest_writer(
+            dataset, overlay_names, buffer_size, index) as writer:
+        journal.open(append=resume)
+        try:
+            for entry, item_overlays in generate_items(
+                    manifest,
+                    workers,
+                    previous,
+                    racy_mtime,
+                    previous_overlays,
+                    ignore,
+                    journal,
+                    extra_hashes=extra_hashes,
+                    readers=readers,
+                    read_size=read_size,
+                    queue_depth=queue_depth,
+                    archives=archives,
+                    overlays=overlays):
+                writer.add(entry, item_overlays)
+        finally:
+            journal.close()
+        writer.write()
+
+    journal.remove()
+
+
+def persist_dataset(dataset, path, workers=1):
+    """Mark up a directory as a dataset.
+
+    Equivalent to :meth:`dtoolcore.DataSet.persist_to_path` followed by
+    :func:`dtoolutils.overlays.add_mimetype`, but reads each file only once.
+
+    :param dataset: :class:`dtoolcore.DataSet`
+    :param path: path to where the dataset should be persisted
+    :param workers: number of worker processes used to hash files
+    :raises: OSError if .dtool directory already exists
+    """
+    path = os.path.abspath(path)
+
+    if not os.path.isdir(path):
+        error_message = 'No such directory: {}'.format(path)
+        raise OSError(error_message)
+
+    dataset._abs_path = path
+    data_directory = os.path.join(path, dataset.data_directory)
+
+    if not os.path.isdir(data_directory):
+        os.mkdir(data_directory)
+
+    dtool_dir_path = os.path.join(path, '.dtool')
+    os.mkdir(dtool_dir_path)
+
+    os.mkdir(dataset._abs_overlays_path)
+
+    dataset._safe_create_readme()
+
+    dataset._structural_metadata = Manifest(
+        data_directory,
+        ignore_prefixes=dataset._ignore_prefixes,
+        generate_file_list=False)
+    update_manifest(dataset, workers=workers)
+
+    dtool_file_path = os.path.join(dtool_dir_path, 'dtool')
+    with open(dtool_file_path, 'w') as fh:
+        json.dump(dataset._admin_metadata, fh)
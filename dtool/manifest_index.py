@@ -0,0 +1,278 @@
+"""Compact index of a manifest for looking up items by path.
+
+The index is a binary file written next to the manifest. It allows the
+hash, size and mtime of an item to be looked up by relative path using a
+binary search over a memory map, without parsing the manifest.
+
+The file consists of a header, one fixed-width record per item sorted by
+the bytes of its UTF-8 encoded path and the encoded paths::
+
+    header:  magic, version, hash size, number of items,
+             manifest mtime, manifest size
+    records: raw hash, size, mtime, path offset, path length
+    paths:   concatenated paths
+
+The manifest's mtime and size are stored so that a stale index can be
+detected and rebuilt.
+"""
+
+import os
+import json
+import errno
+import mmap
+import struct
+import shutil
+import binascii
+import tempfile
+
+#: Name of the index file in the .dtool directory.
+INDEX_NAME = "manifest.idx"
+
+MAGIC = b"DTOOLIDX"
+VERSION = 1
+
+_HEADER = struct.Struct("<8sIIQdQ")
+_RECORD = struct.Struct("<dQQI")
+
+
+def _encode(rel_path):
+    # Paths that are not valid UTF-8 are decoded by os.walk using
+    # surrogate escapes; encode them back to the original bytes.
+    if isinstance(rel_path, bytes):
+        return rel_path
+    return rel_path.encode("utf-8", "surrogateescape")
+
+
+class IndexWriter(object):
+    """Write an index from manifest entries added in path order.
+
+    The records and paths are written to temporary files in tmp_dir, so
+    that writing an index does not require holding the entries in memory.
+
+    :param tmp_dir: directory in which to create temporary files
+    """
+
+    def __init__(self, tmp_dir):
+        self.hash_size = 0
+        self._count = 0
+        self._last_path = b""
+        self._path_offset = 0
+        self._records = tempfile.TemporaryFile(dir=tmp_dir)
+        self._paths = tempfile.TemporaryFile(dir=tmp_dir)
+
+    def add(self, entry):
+        """Add a manifest entry; entries must be added sorted by path.
+
+        Paths are compared as encoded by the file system, which is the order
+        used for looking them up.
+
+        :raises: ValueError if the entry's path sorts before the previous one
+        """
+        raw_hash = binascii.unhexlify(entry["hash"])
+        if self._count == 0:
+            self.hash_size = len(raw_hash)
+        path = _encode(entry["path"])
+        if path < self._last_path:
+            raise ValueError(
+                "Path not in ascending order: {}".format(entry["path"]))
+        self._last_path = path
+        self._records.write(raw_hash)
+        self._records.write(_RECORD.pack(
+            entry["mtime"], entry["size"], self._path_offset, len(path)))
+        self._paths.write(path)
+        self._path_offset += len(path)
+        self._count += 1
+
+    def write(self, index_path, manifest_path):
+        """Write the index to index_path.
+
+        :param index_path: path to write the index to
+        :param manifest_path: path to the manifest the index was built from
+        """
+        stat_result = os.stat(manifest_path)
+        with open(index_path, "wb") as fh:
+            fh.write(_HEADER.pack(
+                MAGIC,
+                VERSION,
+                self.hash_size,
+                self._count,
+                stat_result.st_mtime,
+                stat_result.st_size))
+            for tmp_fh in (self._records, self._paths):
+                tmp_fh.seek(0)
+                shutil.copyfileobj(tmp_fh, fh)
+
+    def close(self):
+        self._records.close()
+        self._paths.close()
+
+
+def build_index(manifest_path, index_path):
+    """Build the index of a manifest.
+
+    The manifest is parsed in full, so this is used for rebuilding an index
+    of a manifest that was not written by :mod:`dtool.manifest`. The index
+    is replaced atomically.
+
+    :param manifest_path: path to the manifest
+    :param index_path: path to write the index to
+    """
+    with open(manifest_path) as fh:
+        file_list = json.load(fh)["file_list"]
+    file_list.sort(key=lambda entry: _encode(entry["path"]))
+
+    tmp_path = index_path + ".tmp"
+    writer = IndexWriter(os.path.dirname(os.path.abspath(index_path)))
+    try:
+        for entry in file_list:
+            writer.add(entry)
+        writer.write(tmp_path, manifest_path)
+        os.rename(tmp_path, index_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    finally:
+        writer.close()
+
+
+class ManifestIndex(object):
+    """Read only access to an index using a memory map.
+
+    :param index_path: path to the index
+    :raises: ValueError if the file is not a manifest index
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        with open(index_path, "rb") as fh:
+            self._map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._map) < _HEADER.size:
+            self.close()
+            raise ValueError("Not a manifest index: {}".format(index_path))
+        header = _HEADER.unpack_from(self._map, 0)
+        magic, version, self.hash_size, self._count = header[:4]
+        self.manifest_mtime, self.manifest_size = header[4:]
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("Not a manifest index: {}".format(index_path))
+
+        self._record_size = self.hash_size + _RECORD.size
+        self._paths_start = _HEADER.size + self._count * self._record_size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self._entry(i)
+
+    def close(self):
+        self._map.close()
+
+    def _record_start(self, i):
+        return _HEADER.size + i * self._record_size
+
+    def _path(self, i):
+        start = self._record_start(i) + self.hash_size
+        _, _, offset, length = _RECORD.unpack_from(self._map, start)
+        start = self._paths_start + offset
+        return self._map[start:start + length]
+
+    def _entry(self, i):
+        start = self._record_start(i)
+        raw_hash = self._map[start:start + self.hash_size]
+        mtime, size, _, _ = _RECORD.unpack_from(
+            self._map, start + self.hash_size)
+        entry = dict(hash=binascii.hexlify(raw_hash).decode("ascii"),
+                     size=size,
+                     mtime=mtime)
+        entry["path"] = self._path(i).decode("utf-8", "surrogateescape")
+        return entry
+
+    def lookup(self, rel_path):
+        """Return the manifest entry of a relative path.
+
+        :param rel_path: path relative to the manifest root
+        :returns: dictionary with hash, size, mtime and path or None if the
+                  path is not in the manifest
+        """
+        path = _encode(rel_path)
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._path(mid) < path:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._count and self._path(lo) == path:
+            return self._entry(lo)
+        return None
+
+    def is_stale(self, manifest_path):
+        """Return True if the manifest has changed since the index was built.
+        """
+        stat_result = os.stat(manifest_path)
+        return (stat_result.st_mtime != self.manifest_mtime or
+                stat_result.st_size != self.manifest_size)
+
+
+def _manifest_path(dataset_path):
+    """Return absolute path to the manifest of a dataset."""
+    with open(os.path.join(dataset_path, ".dtool", "dtool")) as fh:
+        admin_metadata = json.load(fh)
+    manifest_path = admin_metadata.get(
+        "manifest_path", os.path.join(".dtool", "manifest.json"))
+    return os.path.join(dataset_path, manifest_path)
+
+
+def _open_private_index(manifest_path):
+    """Return index of a manifest built in a temporary file.
+
+    The file is removed once it has been memory mapped, so that it goes
+    away when the index is closed.
+    """
+    fd, index_path = tempfile.mkstemp(suffix=".idx")
+    os.close(fd)
+    try:
+        build_index(manifest_path, index_path)
+        return ManifestIndex(index_path)
+    finally:
+        os.unlink(index_path)
+
+
+def open_index(dataset_path):
+    """Return :class:`dtool.manifest_index.ManifestIndex` of a dataset.
+
+    The index is built if it is missing and rebuilt if the manifest has
+    changed since it was built. If the dataset is read-only, such as a
+    snapshot, the index is built from the manifest in a temporary file
+    instead.
+
+    :param dataset_path: path to the dataset
+    :returns: :class:`dtool.manifest_index.ManifestIndex`
+    """
+    dataset_path = os.path.abspath(dataset_path)
+    manifest_path = _manifest_path(dataset_path)
+    index_path = os.path.join(dataset_path, ".dtool", INDEX_NAME)
+
+    if os.path.isfile(index_path):
+        index = ManifestIndex(index_path)
+        if not index.is_stale(manifest_path):
+            return index
+        index.close()
+
+    try:
+        build_index(manifest_path, index_path)
+    except (IOError, OSError) as e:
+        if e.errno not in (errno.EACCES, errno.EPERM, errno.EROFS):
+            raise
+        return _open_private_index(manifest_path)
+    return ManifestIndex(index_path)
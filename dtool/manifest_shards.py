@@ -0,0 +1,229 @@
+"""Module for generating a manifest in shards, for example on a cluster.
+
+The files of a dataset are split into a number of shards by a hash of their
+relative path, so that every process assigns every file to the same shard
+without any coordination and regardless of the order of the walk. Each
+shard is hashed separately, for example by the tasks of a SLURM array job,
+and written as a partial manifest in the ``.dtool/manifest_shards``
+directory. Merging the partial manifests checks that every file was hashed
+by exactly one shard before replacing the manifest and its overlays.
+
+A partial manifest is a JSON lines file; the first line is a header and each
+further line holds the file metadata and overlay values of an item. It is
+only put in place once the shard has been completely hashed.
+"""
+
+import os
+import json
+import hashlib
+
+from dtool.archive import ARCHIVE_OVERLAY
+from dtool.manifest import (
+    _previous_manifest,
+    dataset_manifest_writer,
+    generate_items,
+    resolve_overlay_functions,
+    resolve_overlays,
+)
+from dtool.manifest_index import _encode
+from dtool.packed import PACKED_DIR, PackedFiles
+from dtool.walk import IGNORE_FILE_NAME, IgnorePatterns, walk_files
+
+#: Name of the directory in the .dtool directory holding partial manifests.
+SHARDS_DIR = "manifest_shards"
+
+
+def shard_of(rel_path, num_shards):
+    """Return the shard that a file belongs to.
+
+    :param rel_path: path relative to the manifest root
+    :param num_shards: number of shards
+    :returns: shard index, from 0 to num_shards - 1
+    """
+    digest = hashlib.sha1(_encode(rel_path)).hexdigest()
+    return int(digest[:16], 16) % num_shards
+
+
+def _shards_dir(dataset):
+    return os.path.join(dataset._abs_path, ".dtool", SHARDS_DIR)
+
+
+def shard_path(dataset, index, num_shards):
+    """Return path to the partial manifest of a shard."""
+    return os.path.join(
+        _shards_dir(dataset),
+        "shard-{:05d}-of-{:05d}.jsonl".format(index, num_shards))
+
+
+def _check_shard(index, num_shards):
+    if num_shards < 1:
+        raise ValueError("Number of shards must be positive")
+    if not 0 <= index < num_shards:
+        raise ValueError("Shard index {} is not in the range 0 to {}".format(
+            index, num_shards - 1))
+
+
+def write_shard(
+        dataset,
+        index,
+        num_shards,
+        workers=1,
+        incremental=True,
+        extra_hashes=(),
+        archives=False,
+        overlays=()):
+    """Hash the files of a shard and write its partial manifest.
+
+    :param dataset: :class:`dtoolcore.DataSet`
+    :param index: index of the shard, from 0 to num_shards - 1
+    :param num_shards: number of shards
+    :param workers: number of worker processes used to hash files
+    :param incremental: reuse the entries of unchanged files from the
+                        current manifest
+    :param extra_hashes: names of additional hash functions
+    :param archives: list the members of archives in an overlay
+    :param overlays: names of additional overlay functions
+    :returns: number of items in the shard
+    :raises: ValueError if the shard index is out of range
+    """
+    _check_shard(index, num_shards)
+    manifest = dataset._structural_metadata
+    extra_hashes, archives = resolve_overlays(dataset, extra_hashes, archives)
+    overlays = resolve_overlay_functions(dataset, overlays)
+    overlay_names = overlays + extra_hashes
+    if archives:
+        overlay_names.append(ARCHIVE_OVERLAY)
+
+    previous, racy_mtime, previous_overlays = None, None, None
+    if incremental:
+        previous, racy_mtime, previous_overlays = _previous_manifest(
+            dataset, overlay_names)
+    ignore = IgnorePatterns.from_path(
+        os.path.join(dataset._abs_path, IGNORE_FILE_NAME))
+
+    path = shard_path(dataset, index, num_shards)
+    if not os.path.isdir(os.path.dirname(path)):
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            # Created by another shard in the meantime.
+            if not os.path.isdir(os.path.dirname(path)):
+                raise
+
+    header = dict(index=index,
+                  num_shards=num_shards,
+                  hash_function=manifest["hash_function"],
+                  overlay_names=overlay_names)
+    num_items = 0
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as fh:
+        fh.write(json.dumps(header) + "\n")
+        for entry, item_overlays in generate_items(
+                manifest,
+                workers,
+                previous,
+                racy_mtime,
+                previous_overlays,
+                ignore,
+                extra_hashes=extra_hashes,
+                archives=archives,
+                select=lambda p: shard_of(p, num_shards) == index,
+                overlays=overlays):
+            record = {"entry": entry, "overlays": item_overlays}
+            fh.write(json.dumps(record) + "\n")
+            num_items += 1
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.rename(tmp_path, path)
+    return num_items
+
+
+def _read_shard(path):
+    with open(path) as fh:
+        header = json.loads(fh.readline())
+        for line in fh:
+            yield header, json.loads(line)
+
+
+def _dataset_paths(dataset):
+    """Yield relative paths of the files of a dataset, including packed
+    files."""
+    manifest = dataset._structural_metadata
+    abs_root = manifest.abs_manifest_root
+    ignore = IgnorePatterns.from_path(
+        os.path.join(dataset._abs_path, IGNORE_FILE_NAME))
+    ignore_prefixes = list(manifest.ignore_prefixes) + [PACKED_DIR]
+    for rel_path in walk_files(abs_root, ignore, ignore_prefixes):
+        yield rel_path
+    for shard in PackedFiles(abs_root).shards:
+        for record in shard.members:
+            yield record["path"]
+
+
+def merge_shards(dataset, num_shards):
+    """Replace the manifest of a dataset with the merged partial manifests.
+
+    The merge is refused if a shard is missing, if the shards disagree on
+    the hash function or overlays, or if a file on disk was hashed by no
+    shard, by more than one shard or by the wrong shard. The partial
+    manifests are removed once the manifest has been written.
+
+    :param dataset: :class:`dtoolcore.DataSet`
+    :param num_shards: number of shards
+    :returns: number of items in the merged manifest
+    :raises: ValueError if the partial manifests cannot be merged
+    """
+    _check_shard(0, num_shards)
+    paths = [shard_path(dataset, i, num_shards) for i in range(num_shards)]
+    missing_shards = [i for i, p in enumerate(paths) if not os.path.isfile(p)]
+    if missing_shards:
+        raise ValueError("Missing shards: {}".format(
+            ", ".join(str(i) for i in missing_shards)))
+
+    headers = []
+    for path in paths:
+        with open(path) as fh:
+            headers.append(json.loads(fh.readline()))
+    hash_function = dataset._structural_metadata["hash_function"]
+    overlay_names = headers[0]["overlay_names"]
+    for i, header in enumerate(headers):
+        if header["hash_function"] != hash_function:
+            raise ValueError("Shard {} used hash function {}".format(
+                i, header["hash_function"]))
+        if header["overlay_names"] != overlay_names:
+            raise ValueError("Shards 0 and {} have different overlays".format(
+                i))
+
+    hashed = set()
+    duplicated = []
+    misplaced = []
+    with dataset_manifest_writer(dataset, overlay_names) as writer:
+        for i, path in enumerate(paths):
+            for _, record in _read_shard(path):
+                rel_path = record["entry"]["path"]
+                if rel_path in hashed:
+                    duplicated.append(rel_path)
+                hashed.add(rel_path)
+                if shard_of(rel_path, num_shards) != i:
+                    misplaced.append(rel_path)
+                writer.add(record["entry"], record["overlays"])
+
+        on_disk = set(_dataset_paths(dataset))
+        problems = []
+        for label, rel_paths in [
+                ("not hashed", on_disk - hashed),
+                ("no longer on disk", hashed - on_disk),
+                ("hashed more than once", duplicated),
+                ("hashed by the wrong shard", misplaced)]:
+            if rel_paths:
+                problems.append("{} files {}, e.g. {}".format(
+                    len(rel_paths), label, sorted(rel_paths)[0]))
+        if problems:
+            raise ValueError("Cannot merge shards: " + "; ".join(problems))
+        writer.write()
+
+    for path in paths:
+        os.unlink(path)
+    if not os.listdir(_shards_dir(dataset)):
+        os.rmdir(_shards_dir(dataset))
+    return len(hashed)
@@ -1,12 +1,13 @@
 """Metadata module."""
 
 import os
+import json
+import threading
 
-import jinja2.meta
 import click
+import yaml
 
-from dtoolcore import _DtoolObject, NotDtoolObject
-from dtool.utils import write_templated_file, JINJA2_ENV
+from dtool.utils import write_templated_file, TEMPLATE_CACHE
 
 
 class DescriptiveMetadata(object):
@@ -51,10 +52,8 @@ class DescriptiveMetadata(object):
 
         output_path = os.path.join(path, filename)
 
-        # Find variables in the template from the abstract syntax tree (ast).
-        template_source = JINJA2_ENV.loader.get_source(JINJA2_ENV, template)
-        ast = JINJA2_ENV.parse(template_source)
-        template_variables = jinja2.meta.find_undeclared_variables(ast)
+        # Find the variables used in the template.
+        template_variables = TEMPLATE_CACHE.get_variables(template)
 
         # Create yaml for any variables that are not present in the template.
         extra_variables = set(self.keys()) - template_variables
@@ -69,14 +68,133 @@ class DescriptiveMetadata(object):
         write_templated_file(output_path, template, variables)
 
 
-def metadata_from_path(path):
-    """Return dictionary containing metadata derived from dtool
-    objects a level of the directory structure."""
-
+def _stat_key(path):
+    """Return (mtime, size) of a file or None if it does not exist."""
     try:
-        dtool_object = _DtoolObject.from_path(path)
-        descriptive_metadata = dtool_object.descriptive_metadata
-    except NotDtoolObject:
+        stat_result = os.stat(path)
+    except OSError:
+        return None
+    return stat_result.st_mtime, stat_result.st_size
+
+
+class MetadataResolver(object):
+    """Resolve the descriptive metadata of dtool objects.
+
+    As with :attr:`dtoolcore._DtoolObject.descriptive_metadata` the
+    metadata of a dtool object inherits from the dtool objects in the
+    directories above it, up to the first directory that is not a dtool
+    object. The parsed admin metadata and README of each dtool object are
+    cached, keyed by path and by the mtime and size of the files, so that
+    sibling datasets share one parse of their parents' READMEs. A resolver
+    can be shared between threads.
+
+    :param levels: number of ancestor levels to inherit metadata from; all
+                   levels if None
+    """
+
+    def __init__(self, levels=None):
+        self.levels = levels
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _local_metadata(self, path):
+        """Return README content of the dtool object in path.
+
+        Returns None if path is not a dtool object.
+        """
+        admin_path = os.path.join(path, ".dtool", "dtool")
+        admin_key = _stat_key(admin_path)
+        if admin_key is None:
+            return None
+
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == admin_key:
+            readme_path = entry[1]
+        else:
+            with open(admin_path) as fh:
+                admin_metadata = json.load(fh)
+            readme_path = os.path.join(
+                path, admin_metadata.get("readme_path", "README.yml"))
+            entry = None
+        readme_key = _stat_key(readme_path)
+
+        if entry is not None and entry[2] == readme_key:
+            self.hits += 1
+            return entry[3]
+
+        self.misses += 1
+        content = {}
+        if readme_key is not None:
+            with open(readme_path) as fh:
+                content = yaml.safe_load(fh) or {}
+        self._entries[path] = (admin_key, readme_path, readme_key, content)
+        return content
+
+    def _chain(self, path):
+        """Return list of the paths and README content of the dtool objects
+        whose metadata path inherits, starting with path itself."""
+        path = os.path.abspath(path)
+        chain = []
+        level = 0
+        while True:
+            with self._lock:
+                content = self._local_metadata(path)
+            if content is None:
+                break
+            chain.append((path, content))
+            if self.levels is not None and level >= self.levels:
+                break
+            parent_path = os.path.dirname(path)
+            if parent_path == path:
+                break
+            path = parent_path
+            level += 1
+        return chain
+
+    def resolve(self, path):
+        """Return dictionary of the descriptive metadata of a path.
+
+        Returns an empty dictionary if path is not a dtool object.
+        """
         descriptive_metadata = {}
+        for _, content in reversed(self._chain(path)):
+            descriptive_metadata.update(content)
+        return descriptive_metadata
+
+    def readme_keys(self, path):
+        """Return list of the mtime and size of each README the metadata of
+        a path is resolved from, starting with its own.
+
+        The list changes whenever the resolved metadata may have changed.
+        Missing READMEs are None.
+        """
+        keys = []
+        for object_path, _ in self._chain(path):
+            with self._lock:
+                keys.append(self._entries[object_path][2])
+        return keys
+
+    def stats(self):
+        """Return dictionary with number of hits, misses and entries."""
+        return dict(hits=self.hits,
+                    misses=self.misses,
+                    size=len(self._entries))
 
-    return descriptive_metadata
+    def clear(self):
+        """Remove all entries and reset the statistics."""
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+
+
+#: Metadata resolver shared by calls to
+#: :func:`dtool.metadata.metadata_from_path`.
+METADATA_RESOLVER = MetadataResolver()
+
+
+def metadata_from_path(path):
+    """Return dictionary containing metadata derived from dtool
+    objects a level of the directory structure."""
+    return METADATA_RESOLVER.resolve(path)
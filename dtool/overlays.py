@@ -0,0 +1,413 @@
+"""Overlays module.
+
+Computes overlays from the bytes read while files are being hashed, so that
+creating a manifest and its overlays requires only a single read of each
+file.
+
+Overlays are computed by overlay functions held in a registry. An overlay
+function is called with the path to a file and a
+:class:`dtool.overlays.FileSample` of it, and returns the JSON serialisable
+value of the file. Other packages can register overlay functions by calling
+:func:`dtool.overlays.register_overlay_function`, or by declaring them in
+the ``dtool.overlays`` entry point group. As the values depend only on the
+content of the files, they are cached by file hash in an
+:class:`dtool.overlays.OverlayCache`.
+"""
+
+import io
+import os
+import struct
+import functools
+import threading
+import collections
+
+import puremagic
+from binaryornot.helpers import is_binary_string
+
+#: Number of bytes from the start of a file used to tell text from binary.
+TEXT_CHUNK_SIZE = 1024
+
+# Numbers of bytes from the start and the end of a file that puremagic 1.4
+# looks at when identifying a file.
+_DEFAULT_MAGIC_SIZES = (36870, 36)
+
+
+def _magic_sizes():
+    """Return numbers of bytes from the start and the end of a file that
+    puremagic looks at, worked out from its tables of magic strings and
+    their offsets."""
+    try:
+        head_size = max(len(magic[0]) + magic[1]
+                        for magic in puremagic.magic_header_array)
+        tail_size = max(len(magic[0]) + abs(magic[1])
+                        for magic in puremagic.magic_footer_array)
+    except (AttributeError, IndexError, TypeError, ValueError):
+        return _DEFAULT_MAGIC_SIZES
+    return head_size, tail_size
+
+
+_MAGIC_HEAD_SIZE, _MAGIC_TAIL_SIZE = _magic_sizes()
+
+#: Number of bytes kept from the start of a file.
+HEAD_SIZE = max(TEXT_CHUNK_SIZE, _MAGIC_HEAD_SIZE)
+
+#: Number of bytes kept from the end of a file.
+TAIL_SIZE = _MAGIC_TAIL_SIZE
+
+
+class FileSample(object):
+    """Start and end of a file, collected while the file is streamed.
+
+    Feed the buffers read from a file, in order, to :meth:`update`.
+
+    :param opener: callable returning a binary file-like object of the
+                   whole file, for overlay functions that need more than
+                   its start and end
+    """
+
+    def __init__(self, opener=None):
+        self.head = b""
+        self.tail = b""
+        self.size = 0
+        self._opener = opener
+
+    def update(self, buf):
+        """Add the next buffer read from the file."""
+        self.size += len(buf)
+        if len(self.head) < HEAD_SIZE:
+            missing = HEAD_SIZE - len(self.head)
+            self.head += buf[:missing]
+            buf = buf[missing:]
+        if not buf:
+            return
+        if len(buf) >= TAIL_SIZE:
+            self.tail = buf[len(buf) - TAIL_SIZE:]
+        else:
+            self.tail = (self.tail + buf)[-TAIL_SIZE:]
+
+    @property
+    def data(self):
+        """Return the head followed by the tail of the file.
+
+        The start and end of the returned bytes are the same as the start and
+        end of the file.
+        """
+        return self.head + self.tail
+
+    def open(self):
+        """Return binary file-like object of the whole file.
+
+        :raises: IOError if the sample cannot open the file
+        """
+        if self._opener is None:
+            raise IOError("Whole file not available")
+        return self._opener()
+
+    @classmethod
+    def from_path(cls, fpath):
+        """Return :class:`dtool.overlays.FileSample` read from fpath.
+
+        Only the start and the end of the file are read.
+        """
+        sample = cls(functools.partial(open, fpath, "rb"))
+        size = os.stat(fpath).st_size
+        with open(fpath, "rb") as fh:
+            sample.update(fh.read(HEAD_SIZE))
+            if size > HEAD_SIZE:
+                fh.seek(max(HEAD_SIZE, size - TAIL_SIZE))
+                sample.update(fh.read())
+        sample.size = size
+        return sample
+
+    @classmethod
+    def from_bytes(cls, content):
+        """Return :class:`dtool.overlays.FileSample` of a file's content."""
+        sample = cls(functools.partial(io.BytesIO, content))
+        sample.update(content)
+        return sample
+
+
+def _categorise_binary(fpath, sample):
+    try:
+        info = puremagic.magic_string(sample.data, filename=fpath)
+    except puremagic.PureError:
+        info = []
+    mimetype = None
+    for item in info:
+        guess = item[1]
+        if guess != u"":
+            mimetype = guess
+    return mimetype
+
+
+def _categorise_plaintext(sample):
+    if sample.size == 0:
+        return u"inode/x-empty"
+    return u"text/plain"
+
+
+def mimetype_from_sample(fpath, sample):
+    """Return the mimetype of a file.
+
+    Gives the same result as the mimetype overlay created by
+    :func:`dtoolutils.overlays.add_mimetype`.
+
+    :param fpath: path to the file
+    :param sample: :class:`dtool.overlays.FileSample` of the file
+    :returns: mimetype string
+    """
+    if is_binary_string(sample.head[:TEXT_CHUNK_SIZE]):
+        mimetype = _categorise_binary(fpath, sample)
+        if mimetype:
+            return mimetype
+        return u"application/octet-stream"
+    return _categorise_plaintext(sample)
+
+
+def size_from_sample(fpath, sample):
+    """Return the size of a file in bytes."""
+    return sample.size
+
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# JPEG markers starting a frame, whose header holds the image dimensions.
+_JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - set([0xC4, 0xC8, 0xCC])
+
+
+def _jpeg_dimensions(fh):
+    """Return width and height of the JPEG in fh, or None if not found."""
+    if fh.read(2) != b"\xff\xd8":
+        return None
+    while True:
+        byte = fh.read(1)
+        while byte and byte != b"\xff":
+            byte = fh.read(1)
+        while byte == b"\xff":
+            byte = fh.read(1)
+        if not byte:
+            return None
+        marker = ord(byte)
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # Markers without a segment.
+            continue
+        if marker in (0xD9, 0xDA):
+            # End of image, or start of the scan data, before any frame.
+            return None
+        length = fh.read(2)
+        if len(length) < 2:
+            return None
+        if marker in _JPEG_SOF_MARKERS:
+            frame = fh.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack(">HH", frame[1:5])
+            return width, height
+        fh.seek(struct.unpack(">H", length)[0] - 2, 1)
+
+
+def image_dimensions_from_sample(fpath, sample):
+    """Return the width and height of a PNG, GIF, BMP or JPEG image.
+
+    The dimensions are read from the start of the file. Only JPEG images
+    with a frame header beyond the start of the file, for example after a
+    large thumbnail, are read further.
+
+    :param fpath: path to the file
+    :param sample: :class:`dtool.overlays.FileSample` of the file
+    :returns: list of width and height in pixels, or None if the file is
+              not an image of a known format
+    """
+    head = sample.head
+    dimensions = None
+    if head[:8] == _PNG_SIGNATURE and head[12:16] == b"IHDR":
+        dimensions = struct.unpack(">II", head[16:24])
+    elif head[:6] in (b"GIF87a", b"GIF89a") and len(head) >= 10:
+        dimensions = struct.unpack("<HH", head[6:10])
+    elif head[:2] == b"BM" and len(head) >= 26:
+        if struct.unpack("<I", head[14:18])[0] == 12:
+            dimensions = struct.unpack("<HH", head[18:22])
+        else:
+            width, height = struct.unpack("<ii", head[18:26])
+            dimensions = width, abs(height)
+    elif head[:2] == b"\xff\xd8":
+        dimensions = _jpeg_dimensions(io.BytesIO(head))
+        if dimensions is None and sample.size > len(head):
+            with sample.open() as fh:
+                dimensions = _jpeg_dimensions(fh)
+    if dimensions is None:
+        return None
+    return list(dimensions)
+
+
+#: Number of computed overlay values kept by an
+#: :class:`dtool.overlays.OverlayCache`.
+DEFAULT_CACHE_SIZE = 10000
+
+#: Entry point group in which other packages can declare overlay functions.
+ENTRY_POINT_GROUP = "dtool.overlays"
+
+_OVERLAY_FUNCTIONS = {
+    "mimetype": mimetype_from_sample,
+    "size_in_bytes": size_from_sample,
+    "image_dimensions": image_dimensions_from_sample,
+}
+
+_entry_points_loaded = False
+
+
+def _load_entry_points():
+    """Register the overlay functions declared by installed packages."""
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+    _entry_points_loaded = True
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return
+    eps = entry_points()
+    if hasattr(eps, "select"):
+        eps = eps.select(group=ENTRY_POINT_GROUP)
+    else:
+        eps = eps.get(ENTRY_POINT_GROUP, [])
+    for ep in eps:
+        if ep.name not in _OVERLAY_FUNCTIONS:
+            _OVERLAY_FUNCTIONS[ep.name] = ep.load()
+
+
+def register_overlay_function(name, func):
+    """Register an overlay function.
+
+    :param name: name of the overlay
+    :param func: callable taking the path to a file and a
+                 :class:`dtool.overlays.FileSample` of it and returning a
+                 JSON serialisable value; must be picklable to be used by
+                 worker processes
+    """
+    _OVERLAY_FUNCTIONS[name] = func
+
+
+def overlay_function_names():
+    """Return sorted list of the names of the registered overlay
+    functions."""
+    _load_entry_points()
+    return sorted(_OVERLAY_FUNCTIONS)
+
+
+def get_overlay_function(name):
+    """Return a registered overlay function.
+
+    :raises: ValueError if no overlay function is registered under name
+    """
+    if name not in _OVERLAY_FUNCTIONS:
+        _load_entry_points()
+    try:
+        return _OVERLAY_FUNCTIONS[name]
+    except KeyError:
+        raise ValueError("Unknown overlay: {}".format(name))
+
+
+def compute_overlays(names, fpath, sample):
+    """Return dictionary with the values of a file for the named overlays.
+
+    :param names: names of registered overlay functions
+    :param fpath: path to the file
+    :param sample: :class:`dtool.overlays.FileSample` of the file
+    """
+    return dict((name, get_overlay_function(name)(fpath, sample))
+                for name in names)
+
+
+class OverlayCache(object):
+    """Overlay values keyed by overlay name and file hash.
+
+    Files with the same hash have the same content and therefore the same
+    overlay values, so values are only computed for hashes not seen before.
+    Known values, such as the current overlays of a dataset, are looked up
+    but never modified. Computed values are kept in a least recently used
+    cache of at most max_size values, so that memory use does not grow with
+    the number of files.
+
+    :param overlays: dictionary of overlay names and dictionaries of hashes
+                     and known values
+    :param max_size: maximum number of computed values kept
+    """
+
+    def __init__(self, overlays=None, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._known = overlays if overlays is not None else {}
+        self._computed = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, name, item_hash):
+        """Return cached value of a file for an overlay.
+
+        :raises: KeyError if the value is not cached
+        """
+        with self._lock:
+            values = self._known.get(name)
+            if values is not None and item_hash in values:
+                self.hits += 1
+                return values[item_hash]
+            key = (name, item_hash)
+            if key not in self._computed:
+                self.misses += 1
+                raise KeyError(key)
+            self.hits += 1
+            value = self._computed.pop(key)
+            self._computed[key] = value
+            return value
+
+    def add(self, item_hash, item_overlays):
+        """Cache computed overlay values of a file."""
+        with self._lock:
+            for name, value in item_overlays.items():
+                self._computed.pop((name, item_hash), None)
+                self._computed[(name, item_hash)] = value
+            while len(self._computed) > self.max_size:
+                self._computed.popitem(last=False)
+
+    def compute(self, names, item_hash, fpath, sample=None):
+        """Return dictionary with the values of a file for the named overlays.
+
+        Only the values that are not cached are computed, and then cached.
+
+        :param names: names of registered overlay functions
+        :param item_hash: hash of the file
+        :param fpath: path to the file
+        :param sample: :class:`dtool.overlays.FileSample` of the file, or a
+                       callable returning one; read from fpath if None
+        """
+        item_overlays = {}
+        missing = []
+        for name in names:
+            try:
+                item_overlays[name] = self.lookup(name, item_hash)
+            except KeyError:
+                missing.append(name)
+        if missing:
+            if sample is None:
+                sample = FileSample.from_path(fpath)
+            elif callable(sample):
+                sample = sample()
+            computed = compute_overlays(missing, fpath, sample)
+            self.add(item_hash, computed)
+            item_overlays.update(computed)
+        return item_overlays
+
+    def stats(self):
+        """Return dictionary with number of hits, misses and computed
+        values kept."""
+        return dict(hits=self.hits,
+                    misses=self.misses,
+                    size=len(self._computed))
+
+    def clear(self):
+        """Remove all computed values and reset the statistics."""
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self._computed = collections.OrderedDict()
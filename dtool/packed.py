@@ -0,0 +1,319 @@
+"""Module for packing small files into indexed tar shards.
+
+Datasets with lots of small files are slow to hash, copy and verify. Packing
+moves files smaller than a threshold into uncompressed tar shards in the
+``.packed`` directory of the manifest root. Each shard has an index, a JSON
+file next to it, recording the offset, size, mtime, hash and overlay values
+of each member. The manifest keeps an entry for each packed file, with the
+shard and offset of its data, so that single members can be read without
+unpacking the shard.
+
+A shard is only given its name once it and its index have been written, and
+the packed files are only removed, by :func:`dtool.packed.remove_originals`,
+once the manifest recording them has been written. Until then a file on
+disk whose size and mtime match its packed copy is taken to be packed.
+"""
+
+import os
+import io
+import json
+import tarfile
+import warnings
+
+from dtool.hashing import MultiHasher
+from dtool.overlays import FileSample, compute_overlays
+from dtool.walk import walk_files
+
+#: Name of the directory in the manifest root holding the shards.
+PACKED_DIR = ".packed"
+
+#: Suffix of the index file of a shard.
+INDEX_SUFFIX = ".index.json"
+
+#: Default size, in bytes, below which files are packed.
+DEFAULT_THRESHOLD = 2**20
+
+#: Default size, in bytes, above which a new shard is started.
+DEFAULT_SHARD_SIZE = 2**30
+
+
+class PackedShard(object):
+    """Read access to the members of a tar shard.
+
+    :param path: path to the shard
+    :raises: ValueError if the shard has changed since it was indexed
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path + INDEX_SUFFIX) as fh:
+            index = json.load(fh)
+        self.hash_function = index["hash_function"]
+        self.members = index["members"]
+        self._members = dict((m["path"], m) for m in self.members)
+        if os.path.getsize(path) != index["shard_size"]:
+            raise ValueError("Shard changed since indexed: {}".format(path))
+
+    def __contains__(self, rel_path):
+        return rel_path in self._members
+
+    def member(self, rel_path):
+        """Return the index record of a member."""
+        return self._members[rel_path]
+
+    def read(self, rel_path):
+        """Return the content of a member."""
+        record = self._members[rel_path]
+        with open(self.path, "rb") as fh:
+            fh.seek(record["offset"])
+            return fh.read(record["size"])
+
+    def open(self, rel_path):
+        """Return binary file-like object of a member."""
+        return io.BytesIO(self.read(rel_path))
+
+
+def shard_paths(abs_manifest_root):
+    """Return sorted list of paths to the shards below a manifest root."""
+    packed_dir = os.path.join(abs_manifest_root, PACKED_DIR)
+    if not os.path.isdir(packed_dir):
+        return []
+    return sorted(os.path.join(packed_dir, fn)
+                  for fn in os.listdir(packed_dir)
+                  if fn.endswith(".tar"))
+
+
+class PackedFiles(object):
+    """Read access to all the packed files below a manifest root.
+
+    :param abs_manifest_root: absolute path to the manifest root
+    """
+
+    def __init__(self, abs_manifest_root):
+        self.shards = []
+        for path in shard_paths(abs_manifest_root):
+            if not os.path.isfile(path + INDEX_SUFFIX):
+                warnings.warn("Skipping shard without index: {}".format(path))
+                continue
+            self.shards.append(PackedShard(path))
+        self._shards = {}
+        for shard in self.shards:
+            for record in shard.members:
+                self._shards[record["path"]] = shard
+
+    def __contains__(self, rel_path):
+        return rel_path in self._shards
+
+    def __len__(self):
+        return len(self._shards)
+
+    def is_original(self, rel_path, stat_result):
+        """Return True if a file on disk is the original of a packed file.
+
+        :param rel_path: path relative to the manifest root
+        :param stat_result: result of :func:`os.stat` of the file
+        """
+        shard = self._shards.get(rel_path)
+        if shard is None:
+            return False
+        record = shard.member(rel_path)
+        return (stat_result.st_size == record["size"] and
+                stat_result.st_mtime == record["mtime"])
+
+    def shard(self, rel_path):
+        """Return the :class:`dtool.packed.PackedShard` holding a file."""
+        return self._shards[rel_path]
+
+    def read(self, rel_path):
+        """Return the content of a packed file."""
+        return self._shards[rel_path].read(rel_path)
+
+    def open(self, rel_path):
+        """Return binary file-like object of a packed file."""
+        return self._shards[rel_path].open(rel_path)
+
+
+def member_metadata(
+        rel_path,
+        content,
+        hash_function,
+        extra_hashes=(),
+        overlays=("mimetype",)):
+    """Return index record of a file with the given content.
+
+    :param rel_path: path relative to the manifest root
+    :param content: bytes of the file
+    :param hash_function: name of the manifest's hash function
+    :param extra_hashes: names of additional hash functions
+    :param overlays: names of overlay functions from :mod:`dtool.overlays`
+    :returns: dictionary with hash, size and overlay values
+    """
+    hasher = MultiHasher([hash_function] + list(extra_hashes))
+    hasher.update(content)
+    hexdigests = hasher.hexdigests()
+    overlays = compute_overlays(
+        overlays, rel_path, FileSample.from_bytes(content))
+    for name in extra_hashes:
+        overlays[name] = hexdigests[name]
+    return dict(hash=hexdigests[hash_function],
+                size=len(content),
+                overlays=overlays)
+
+
+def _write_json(path, data):
+    with open(path + ".tmp", "w") as fh:
+        json.dump(data, fh, indent=2)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.rename(path + ".tmp", path)
+
+
+class _ShardWriter(object):
+
+    def __init__(self, path, hash_function, extra_hashes):
+        self.path = path
+        self.hash_function = hash_function
+        self.extra_hashes = extra_hashes
+        self.members = []
+        self._tmp_path = path + ".tmp"
+        self._fh = open(self._tmp_path, "wb")
+        self._tar = tarfile.open(
+            fileobj=self._fh, mode="w", format=tarfile.PAX_FORMAT)
+
+    @property
+    def size(self):
+        return self._fh.tell()
+
+    def add(self, abs_root, rel_path):
+        fpath = os.path.join(abs_root, rel_path)
+        stat_result = os.stat(fpath)
+        with open(fpath, "rb") as fh:
+            content = fh.read()
+        tarinfo = tarfile.TarInfo(rel_path.replace(os.sep, "/"))
+        tarinfo.size = len(content)
+        tarinfo.mtime = stat_result.st_mtime
+        tarinfo.mode = stat_result.st_mode & 0o777
+        self._tar.addfile(tarinfo, io.BytesIO(content))
+        # The data is followed by padding up to the next tar block.
+        num_blocks = -(-tarinfo.size // tarfile.BLOCKSIZE)
+        offset_data = self._tar.offset - num_blocks * tarfile.BLOCKSIZE
+
+        record = member_metadata(
+            rel_path, content, self.hash_function, self.extra_hashes)
+        record["path"] = rel_path
+        record["offset"] = offset_data
+        record["mtime"] = stat_result.st_mtime
+        self.members.append(record)
+
+    def close(self):
+        self._tar.close()
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        self._fh.close()
+        index = dict(hash_function=self.hash_function,
+                     shard_size=os.path.getsize(self._tmp_path),
+                     members=self.members)
+        # The shard gets its name once its index exists.
+        _write_json(self.path + INDEX_SUFFIX, index)
+        os.rename(self._tmp_path, self.path)
+
+    def abort(self):
+        self._tar.close()
+        self._fh.close()
+        os.unlink(self._tmp_path)
+
+
+def pack_files(
+        abs_manifest_root,
+        hash_function,
+        ignore=None,
+        ignore_prefixes=(),
+        threshold=DEFAULT_THRESHOLD,
+        shard_size=DEFAULT_SHARD_SIZE,
+        extra_hashes=()):
+    """Pack files smaller than threshold into tar shards.
+
+    Files are added to shards in path order. New shards are numbered after
+    the existing ones. Files already packed, with the same size and mtime
+    as their packed copy, are left out.
+
+    The packed files are not removed: update the manifest and then call
+    :func:`dtool.packed.remove_originals`.
+
+    :param abs_manifest_root: absolute path to the manifest root
+    :param hash_function: name of the manifest's hash function
+    :param ignore: :class:`dtool.walk.IgnorePatterns` of files to leave out
+    :param ignore_prefixes: relative path prefixes to leave out
+    :param threshold: size in bytes below which files are packed
+    :param shard_size: size in bytes above which a new shard is started
+    :param extra_hashes: names of additional hash functions whose values
+                         are recorded in the index
+    :returns: tuple of number of files packed and list of new shard paths
+    """
+    ignore_prefixes = list(ignore_prefixes) + [PACKED_DIR]
+    packed = PackedFiles(abs_manifest_root)
+    rel_paths = []
+    for rel_path in walk_files(abs_manifest_root, ignore, ignore_prefixes):
+        stat_result = os.stat(os.path.join(abs_manifest_root, rel_path))
+        if stat_result.st_size >= threshold:
+            continue
+        if packed.is_original(rel_path, stat_result):
+            continue
+        rel_paths.append(rel_path)
+    rel_paths.sort()
+    if not rel_paths:
+        return 0, []
+
+    packed_dir = os.path.join(abs_manifest_root, PACKED_DIR)
+    if not os.path.isdir(packed_dir):
+        os.mkdir(packed_dir)
+    shard_number = len(shard_paths(abs_manifest_root))
+
+    new_shards = []
+    writer = None
+    try:
+        for rel_path in rel_paths:
+            if writer is None:
+                path = os.path.join(
+                    packed_dir, "shard-{:05d}.tar".format(shard_number))
+                writer = _ShardWriter(path, hash_function, extra_hashes)
+                shard_number += 1
+            writer.add(abs_manifest_root, rel_path)
+            if writer.size >= shard_size:
+                writer.close()
+                new_shards.append(writer.path)
+                writer = None
+        if writer is not None:
+            writer.close()
+            new_shards.append(writer.path)
+            writer = None
+    finally:
+        if writer is not None:
+            writer.abort()
+
+    return len(rel_paths), new_shards
+
+
+def remove_originals(abs_manifest_root):
+    """Remove the files on disk that have been packed.
+
+    Only files with the same size and mtime as their packed copy are
+    removed. Call this once the manifest recording the packed files has
+    been written.
+
+    :param abs_manifest_root: absolute path to the manifest root
+    :returns: number of files removed
+    """
+    packed = PackedFiles(abs_manifest_root)
+    num_removed = 0
+    for shard in packed.shards:
+        for record in shard.members:
+            fpath = os.path.join(abs_manifest_root, record["path"])
+            try:
+                stat_result = os.stat(fpath)
+            except OSError:
+                continue
+            if packed.is_original(record["path"], stat_result):
+                os.unlink(fpath)
+                num_removed += 1
+    return num_removed
@@ -0,0 +1,170 @@
+"""Module for reading and hashing files in a pipeline.
+
+On high latency storage, such as NFS and GPFS mounts, reading a file and
+hashing it one after the other leaves the CPU idle while waiting for the
+storage and the storage idle while hashing. In the pipeline a pool of
+reader threads reads files in large chunks into bounded queues, from which
+hasher threads consume them. :mod:`hashlib` releases the GIL when hashing
+large buffers, so the threads hash in parallel.
+
+The chunks of a file are always consumed by the same hasher thread, in the
+order they were read.
+"""
+
+import os
+import mmap
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+#: Default number of bytes read at a time.
+DEFAULT_READ_SIZE = 4 * 2**20
+
+#: Default number of chunks each hasher thread's queue can hold.
+DEFAULT_QUEUE_DEPTH = 8
+
+_END = object()
+
+# Seconds to wait on a full or empty queue before checking whether the
+# pipeline has been stopped.
+_POLL_INTERVAL = 0.1
+
+
+def aligned_read_size(read_size):
+    """Return read size rounded up to a multiple of the page size."""
+    pages = max(1, -(-read_size // mmap.PAGESIZE))
+    return pages * mmap.PAGESIZE
+
+
+def _advise_sequential(fd):
+    """Tell the kernel the file will be read sequentially, if supported."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    except OSError:
+        pass
+
+
+class _Pipeline(object):
+
+    def __init__(self, consumers, readers, hashers, read_size, queue_depth):
+        self.consumers = consumers
+        self.read_size = aligned_read_size(read_size)
+        self.stopped = threading.Event()
+        self.tasks = queue.Queue()
+        self.chunks = [queue.Queue(maxsize=queue_depth)
+                       for _ in range(hashers)]
+        self.results = queue.Queue()
+        self.threads = (
+            [threading.Thread(target=self._read) for _ in range(readers)] +
+            [threading.Thread(target=self._hash, args=(chunks,))
+             for chunks in self.chunks])
+        for thread in self.threads:
+            thread.daemon = True
+
+    def _put(self, q, item):
+        """Put item on bounded queue; return False if stopped."""
+        while not self.stopped.is_set():
+            try:
+                q.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _read(self):
+        while not self.stopped.is_set():
+            index = self.tasks.get()
+            if index is None:
+                return
+            chunks = self.chunks[index % len(self.chunks)]
+            try:
+                fd = os.open(self.consumers[index].fpath, os.O_RDONLY)
+                try:
+                    _advise_sequential(fd)
+                    while True:
+                        buf = os.read(fd, self.read_size)
+                        if not buf:
+                            break
+                        if not self._put(chunks, (index, buf)):
+                            return
+                finally:
+                    os.close(fd)
+            except Exception as e:
+                self.results.put(e)
+                return
+            self._put(chunks, (index, _END))
+
+    def _hash(self, chunks):
+        while not self.stopped.is_set():
+            try:
+                item = chunks.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            if item is None:
+                return
+            index, buf = item
+            consumer = self.consumers[index]
+            try:
+                if buf is _END:
+                    self.results.put(consumer.result())
+                else:
+                    consumer.update(buf)
+            except Exception as e:
+                self.results.put(e)
+                return
+
+    def run(self):
+        for index in range(len(self.consumers)):
+            self.tasks.put(index)
+        for thread in self.threads:
+            self.tasks.put(None)
+            thread.start()
+        try:
+            for _ in range(len(self.consumers)):
+                result = self.results.get()
+                if isinstance(result, Exception):
+                    raise result
+                yield result
+        finally:
+            self.stopped.set()
+            for chunks in self.chunks:
+                try:
+                    chunks.put_nowait(None)
+                except queue.Full:
+                    pass
+            for thread in self.threads:
+                thread.join()
+
+
+def read_pipelined(
+        consumers,
+        readers=4,
+        hashers=2,
+        read_size=DEFAULT_READ_SIZE,
+        queue_depth=DEFAULT_QUEUE_DEPTH):
+    """Feed files to consumers using reader and hasher threads.
+
+    Each consumer has an ``fpath`` attribute with the path of the file to
+    read, an ``update`` method that is called with the chunks of the file
+    in order and a ``result`` method that is called once the whole file has
+    been read. Files are read in the order of the consumers using unbuffered
+    reads of read_size, rounded up to a multiple of the page size.
+
+    Memory use is bounded by read_size times queue_depth times the number
+    of hashers, plus a chunk per reader.
+
+    :param consumers: list of consumers
+    :param readers: number of reader threads
+    :param hashers: number of hasher threads
+    :param read_size: number of bytes read at a time
+    :param queue_depth: number of chunks each hasher thread's queue can hold
+    :returns: generator of the results of the consumers, in the order that
+              they complete
+    """
+    pipeline = _Pipeline(consumers, readers, hashers, read_size, queue_depth)
+    return pipeline.run()
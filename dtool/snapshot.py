@@ -0,0 +1,231 @@
+"""Module for taking cheap snapshots of datasets.
+
+A snapshot is a new dataset, with its own uuid, whose files share their
+data with the original dataset. Files are cloned using reflinks, the
+``FICLONE`` ioctl, on file systems that support them, such as Btrfs and XFS,
+and hard linked otherwise. Either way no data is copied, so a snapshot of a
+large dataset takes seconds and uses almost no extra space. The manifest and
+overlays are copied rather than regenerated, as the files are unchanged.
+
+Reflinked files are independent copies: changing the original later does
+not change the snapshot. Hard linked files are the same files as the
+originals, so changing an original in place also changes the snapshot;
+replacing it, by writing a new file and renaming it over the original, does
+not. A warning is issued when reflinks are not supported and files are hard
+linked instead.
+
+If taking the snapshot fails, the partial snapshot is removed.
+"""
+
+import os
+import json
+import uuid
+import errno
+import fcntl
+import stat
+import shutil
+import warnings
+
+from dtool.walk import IGNORE_FILE_NAME
+
+#: Snapshot methods: ``reflink``, ``hardlink`` or ``auto`` to use reflinks
+#: where supported and hard links otherwise.
+METHODS = ["auto", "reflink", "hardlink"]
+
+#: Request code of the Linux ioctl cloning a file, from <linux/fs.h>.
+FICLONE = 0x40049409
+
+# Errors meaning that reflinks are not supported for a pair of files.
+_REFLINK_UNSUPPORTED = (errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL,
+                        errno.EXDEV, errno.ENOSYS)
+
+_WRITE_BITS = 0o222
+
+
+def reflink(src, dst):
+    """Clone a file using a reflink, keeping its permissions and times.
+
+    :param src: path to the file to clone
+    :param dst: path of the clone; must not exist
+    :raises: OSError if the file system does not support reflinks
+    """
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        except (IOError, OSError):
+            os.close(dst_fd)
+            os.unlink(dst)
+            raise
+        os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    shutil.copystat(src, dst)
+
+
+class _Linker(object):
+    """Link files using reflinks or hard links, remembering whether reflinks
+    are supported."""
+
+    def __init__(self, method):
+        self.use_reflinks = method in ("auto", "reflink")
+        self.fall_back = method == "auto"
+
+    def link(self, paths):
+        src, dst = paths
+        if self.use_reflinks:
+            try:
+                reflink(src, dst)
+                return "reflink"
+            except (IOError, OSError) as e:
+                if not (self.fall_back and e.errno in _REFLINK_UNSUPPORTED):
+                    raise
+                if self.use_reflinks:
+                    warnings.warn(
+                        "Reflinks not supported, hard linking files: "
+                        "changing an original in place also changes the "
+                        "snapshot")
+                self.use_reflinks = False
+        try:
+            os.link(src, dst)
+        except OSError as e:
+            if e.errno == errno.EXDEV:
+                raise OSError(
+                    e.errno,
+                    "Cannot snapshot across file systems; use dtool copy",
+                    dst)
+            raise
+        return "hardlink"
+
+
+def _is_metadata(rel_path, readme_path):
+    return (rel_path.startswith(".dtool" + os.sep) or
+            rel_path in (readme_path, IGNORE_FILE_NAME))
+
+
+def _make_readonly(path):
+    mode = os.lstat(path).st_mode
+    os.chmod(path, mode & ~_WRITE_BITS)
+
+
+def _remove_tree(path):
+    # Only the directories need to be writable to remove their files; the
+    # hard linked files share their permissions with the originals.
+    for dir_path, _, _ in os.walk(path):
+        os.chmod(dir_path, os.lstat(dir_path).st_mode | stat.S_IRWXU)
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def snapshot_dataset(
+        dataset,
+        dest_path,
+        method="auto",
+        readonly=True,
+        workers=8):
+    """Take a snapshot of a dataset.
+
+    The data files are reflinked or hard linked. The metadata files, in the
+    ``.dtool`` directory, the README and the ignore file, are copied. The
+    snapshot gets a new uuid and records the uuid of the original dataset as
+    ``snapshot_of`` in its admin metadata.
+
+    A read-only snapshot has its directories and copied or reflinked files
+    made read-only. Hard linked files keep their permissions, which they
+    share with the originals. Falling back to hard links with the ``auto``
+    method issues a :class:`UserWarning`. The snapshot is removed if taking
+    it fails.
+
+    :param dataset: :class:`dtoolcore.DataSet`
+    :param dest_path: path of the snapshot; must not exist
+    :param method: one of ``auto``, ``reflink`` or ``hardlink``
+    :param readonly: make the snapshot read-only
+    :param workers: number of threads used to link files
+    :returns: tuple of the snapshot as a :class:`dtoolcore.DataSet` and a
+              dictionary with the number of files per method used
+    :raises: ValueError if the method is not known, OSError if dest_path
+             already exists, if reflinks were requested but are not
+             supported, or if dest_path is on another file system
+    """
+    from dtoolcore import DataSet
+
+    if method not in METHODS:
+        raise ValueError("Unknown snapshot method: {}".format(method))
+    src_path = dataset._abs_path
+    dest_path = os.path.abspath(dest_path)
+    if os.path.exists(dest_path):
+        raise OSError("Already exists: {}".format(dest_path))
+    try:
+        counts = _snapshot_dataset(
+            dataset, src_path, dest_path, method, readonly, workers)
+    except BaseException:
+        _remove_tree(dest_path)
+        raise
+    return DataSet.from_path(dest_path), counts
+
+
+def _snapshot_dataset(dataset, src_path, dest_path, method, readonly,
+                      workers):
+    from multiprocessing.pool import ThreadPool
+
+    readme_path = dataset._admin_metadata.get("readme_path", "README.yml")
+    admin_path = os.path.join(".dtool", "dtool")
+
+    to_link = []
+    to_copy = []
+    dir_paths = []
+    for dir_path, _, file_names in os.walk(src_path):
+        dest_dir = os.path.normpath(
+            os.path.join(dest_path, os.path.relpath(dir_path, src_path)))
+        os.makedirs(dest_dir)
+        dir_paths.append((dir_path, dest_dir))
+        for fn in file_names:
+            src = os.path.join(dir_path, fn)
+            rel_path = os.path.relpath(src, src_path)
+            if rel_path == admin_path:
+                continue
+            paths = (src, os.path.join(dest_dir, fn))
+            if _is_metadata(rel_path, readme_path):
+                to_copy.append(paths)
+            else:
+                to_link.append(paths)
+
+    counts = dict(reflink=0, hardlink=0, copy=0)
+    linker = _Linker(method)
+    if to_link:
+        # Find out whether reflinks are supported before linking in
+        # parallel.
+        counts[linker.link(to_link[0])] += 1
+    pool = ThreadPool(workers)
+    try:
+        for used in pool.imap_unordered(linker.link, to_link[1:]):
+            counts[used] += 1
+    finally:
+        pool.terminate()
+        pool.join()
+    for src, dst in to_copy:
+        shutil.copy2(src, dst)
+        counts["copy"] += 1
+
+    admin_metadata = dict(dataset._admin_metadata)
+    admin_metadata["snapshot_of"] = admin_metadata["uuid"]
+    admin_metadata["uuid"] = str(uuid.uuid4())
+    with open(os.path.join(dest_path, admin_path), "w") as fh:
+        json.dump(admin_metadata, fh)
+
+    if readonly:
+        for src, dst in to_copy:
+            _make_readonly(dst)
+        if counts["reflink"]:
+            for src, dst in to_link:
+                if os.stat(dst).st_nlink == 1:
+                    _make_readonly(dst)
+        _make_readonly(os.path.join(dest_path, admin_path))
+    # Deepest directories first, so that their parents are still writable
+    # and their times are not changed afterwards.
+    for dir_path, dest_dir in reversed(dir_paths):
+        shutil.copystat(dir_path, dest_dir)
+        if readonly:
+            _make_readonly(dest_dir)
+
+    return counts
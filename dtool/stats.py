@@ -0,0 +1,132 @@
+"""Module for summarising the files in a dataset before hashing them.
+
+Scanning a dataset only requires listing directories and calling stat on
+each file, so it takes seconds where hashing may take hours.
+"""
+
+import os
+import bisect
+import datetime
+
+from dtool.utils import human_readable_size
+from dtool.walk import (
+    IGNORE_FILE_NAME,
+    IgnorePatterns,
+    list_directory,
+    walk_entries,
+)
+
+#: Exclusive upper bounds, in bytes, of the file size histogram bins.
+SIZE_BINS = [1, 2**10, 2**14, 2**18, 2**22, 2**26, 2**30, 2**34]
+
+#: Bytes per second a single worker is assumed to hash.
+HASH_THROUGHPUT = 100 * 2**20
+
+#: Seconds assumed to be spent opening and closing each file.
+PER_FILE_OVERHEAD = 0.002
+
+#: Number of files above which users are warned before hashing.
+DEFAULT_WARN_FILES = 100000
+
+
+def _bin_labels():
+    labels = ["0 B"]
+    for upper in SIZE_BINS[1:]:
+        labels.append("< {}".format(human_readable_size(upper)))
+    labels.append(">= {}".format(human_readable_size(SIZE_BINS[-1])))
+    return labels
+
+
+class DatasetStats(object):
+    """Number of files, total size and file size histogram of a dataset."""
+
+    def __init__(self):
+        self.num_files = 0
+        self.total_size = 0
+        self.histogram = [0] * (len(SIZE_BINS) + 1)
+
+    def add(self, size):
+        """Add a file of the given size in bytes."""
+        self.num_files += 1
+        self.total_size += size
+        self.histogram[bisect.bisect_right(SIZE_BINS, size)] += 1
+
+    def merge(self, other):
+        """Add the files counted in other."""
+        self.num_files += other.num_files
+        self.total_size += other.total_size
+        self.histogram = [
+            a + b for a, b in zip(self.histogram, other.histogram)]
+
+    def estimated_hashing_time(self, workers=1):
+        """Return estimated time it will take to hash the files.
+
+        :param workers: number of worker processes used to hash files
+        :returns: :class:`datetime.timedelta`
+        """
+        seconds = float(self.total_size) / HASH_THROUGHPUT
+        seconds += self.num_files * PER_FILE_OVERHEAD
+        return datetime.timedelta(seconds=int(round(seconds / workers)))
+
+    def report(self, workers=1):
+        """Return multi-line string summarising the files."""
+        lines = [
+            "Number of files: {}".format(self.num_files),
+            "Total size: {}".format(human_readable_size(self.total_size)),
+            "Estimated hashing time: {}".format(
+                self.estimated_hashing_time(workers)),
+            "File sizes:",
+        ]
+        width = max(len(label) for label in _bin_labels())
+        for label, count in zip(_bin_labels(), self.histogram):
+            lines.append("  {} {}".format(label.ljust(width), count))
+        return "\n".join(lines)
+
+
+def _scan_directory(task):
+    abs_root, rel_dir, ignore, ignore_prefixes = task
+    stats = DatasetStats()
+    for _, entry in walk_entries(abs_root, ignore, ignore_prefixes, rel_dir):
+        stats.add(entry.stat().st_size)
+    return stats
+
+
+def scan_dataset(dataset, workers=8):
+    """Return :class:`dtool.stats.DatasetStats` of a dataset's files.
+
+    The files considered are the ones that would be included in the
+    manifest. The sub-directories of the manifest root are scanned in
+    parallel using threads, which suits network file systems where most of
+    the time is spent waiting for metadata.
+
+    :param dataset: :class:`dtoolcore.DataSet`
+    :param workers: number of threads used to scan directories
+    :returns: :class:`dtool.stats.DatasetStats`
+    """
+    manifest = dataset._structural_metadata
+    abs_root = manifest.abs_manifest_root
+    ignore = IgnorePatterns.from_path(
+        os.path.join(dataset._abs_path, IGNORE_FILE_NAME))
+
+    stats = DatasetStats()
+    files, sub_dirs = list_directory(
+        abs_root, "", ignore, manifest.ignore_prefixes)
+    for _, entry in files:
+        stats.add(entry.stat().st_size)
+
+    tasks = [(abs_root, d, ignore, manifest.ignore_prefixes)
+             for d in sub_dirs]
+    if not tasks:
+        return stats
+
+    # Imported here to keep the start up of the dtool command fast.
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(workers)
+    try:
+        for sub_dir_stats in pool.imap_unordered(_scan_directory, tasks):
+            stats.merge(sub_dir_stats)
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return stats
@@ -0,0 +1,202 @@
+"""Module for copying datasets between file systems.
+
+Files are copied in parallel by a pool of threads using
+:func:`os.copy_file_range`, or :func:`os.sendfile` where that is not
+supported, so that the data is copied by the kernel without passing through
+user space; on file systems that support it the copy may even be done by
+the storage server. Plain reads and writes are the last resort.
+
+By default each copied file is then hashed at the destination and checked
+against the source manifest. This reads the whole copy back. It may come
+from the page cache when the data passed through this machine and fits in
+memory. It comes from the storage for files larger than the page cache, and
+for copies done by the storage server, such as NFS server side copies, where
+the data never reaches this machine. Verification can be turned off to copy
+at the speed of the storage, and the copy verified later with
+:func:`dtool.verify.verify_dataset`.
+
+If copying fails, the partial copy is removed.
+"""
+
+import os
+import errno
+import shutil
+
+from dtool.manifest import _imap_largest_first
+from dtool.packed import PackedFiles
+from dtool.verify import VerificationResult, _file_hash, _packed_hash
+
+#: Number of bytes copied by the kernel per call.
+COPY_CHUNK_SIZE = 2**30
+
+# Errors meaning that a copy method is not supported for a pair of files.
+_UNSUPPORTED = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP)
+
+
+def _copy_with(func, src_fd, dst_fd):
+    """Copy until end of file using func; return False if not supported."""
+    try:
+        while func(src_fd, dst_fd) > 0:
+            pass
+    except OSError as e:
+        if e.errno in _UNSUPPORTED:
+            return False
+        raise
+    return True
+
+
+def copy_fd(src_fd, dst_fd):
+    """Copy the rest of a file, from the current offsets, in the kernel.
+
+    :param src_fd: file descriptor open for reading
+    :param dst_fd: file descriptor open for writing
+    :returns: name of the method used
+    """
+    if hasattr(os, "copy_file_range"):
+        def copy_range(src, dst):
+            return os.copy_file_range(src, dst, COPY_CHUNK_SIZE)
+        if _copy_with(copy_range, src_fd, dst_fd):
+            return "copy_file_range"
+    if hasattr(os, "sendfile"):
+        def send(src, dst):
+            return os.sendfile(dst, src, None, COPY_CHUNK_SIZE)
+        if _copy_with(send, src_fd, dst_fd):
+            return "sendfile"
+    while True:
+        buf = os.read(src_fd, 2**20)
+        if not buf:
+            break
+        while buf:
+            buf = buf[os.write(dst_fd, buf):]
+    return "read"
+
+
+def copy_file(src, dst):
+    """Copy a file, its permissions and its times.
+
+    :param src: path to the file to copy
+    :param dst: path to copy the file to; its directory must exist
+    :returns: name of the method used to copy the data
+    """
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            method = copy_fd(src_fd, dst_fd)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    shutil.copystat(src, dst)
+    return method
+
+
+def _copy_task(task):
+    """Copy a file and return its relative path and hash at the destination.
+
+    :param task: tuple of source path, destination path, and the hash
+                 function name, destination manifest root and manifest
+                 path if the file is to be hashed
+    :returns: tuple of manifest path and hash, or None
+    """
+    src, dst, hash_function, manifest_root, manifest_path = task
+    copy_file(src, dst)
+    if hash_function is None:
+        return None
+    return _file_hash((hash_function, manifest_root, manifest_path))
+
+
+def copy_dataset(dataset, dest_path, workers=8, verify=True):
+    """Copy a dataset, checking the copied files against its manifest.
+
+    Every file of the dataset directory is copied, including its admin
+    metadata, so the copy has the same uuid. Directories are created first
+    and the files then copied in parallel, largest first. If verifying, the
+    files in the manifest are hashed after being copied and packed files are
+    checked by reading them from the copied shards. The destination is
+    removed if copying fails.
+
+    :param dataset: :class:`dtoolcore.DataSet`
+    :param dest_path: path to copy the dataset to; must not exist
+    :param workers: number of threads used to copy files
+    :param verify: hash the copied files and check them against the
+                   manifest; otherwise only missing files are reported
+    :returns: :class:`dtool.verify.VerificationResult` with the files whose
+              copy does not match the manifest
+    :raises: OSError if dest_path already exists
+    """
+    src_path = dataset._abs_path
+    dest_path = os.path.abspath(dest_path)
+    if os.path.exists(dest_path):
+        raise OSError("Already exists: {}".format(dest_path))
+    try:
+        return _copy_dataset(dataset, src_path, dest_path, workers, verify)
+    except BaseException:
+        shutil.rmtree(dest_path, ignore_errors=True)
+        raise
+
+
+def _copy_dataset(dataset, src_path, dest_path, workers, verify):
+    from multiprocessing.pool import ThreadPool
+
+    manifest = dataset._structural_metadata
+    hash_function = manifest["hash_function"]
+    src_root = manifest.abs_manifest_root
+    dest_root = os.path.join(dest_path, os.path.relpath(src_root, src_path))
+    entries = dict((entry["path"], entry) for entry in manifest["file_list"])
+
+    tasks = []
+    sizes = []
+    dir_paths = []
+    for dir_path, _, file_names in os.walk(src_path):
+        dest_dir = os.path.normpath(
+            os.path.join(dest_path, os.path.relpath(dir_path, src_path)))
+        os.makedirs(dest_dir)
+        dir_paths.append((dir_path, dest_dir))
+        for fn in file_names:
+            src = os.path.join(dir_path, fn)
+            dst = os.path.join(dest_dir, fn)
+            manifest_path = os.path.relpath(src, src_root)
+            entry = entries.get(manifest_path)
+            if verify and entry is not None and "shard" not in entry:
+                tasks.append(
+                    (src, dst, hash_function, dest_root, manifest_path))
+            else:
+                tasks.append((src, dst, None, None, None))
+            sizes.append(os.stat(src).st_size)
+
+    result = VerificationResult()
+    copied = set()
+    pool = ThreadPool(workers)
+    try:
+        for item in _imap_largest_first(pool, _copy_task, tasks, sizes):
+            if item is None:
+                continue
+            rel_path, file_hash = item
+            copied.add(rel_path)
+            if file_hash != entries[rel_path]["hash"]:
+                result.changed.append(rel_path)
+    finally:
+        pool.terminate()
+        pool.join()
+
+    # Copying the files changed the times of the directories.
+    for dir_path, dest_dir in dir_paths:
+        shutil.copystat(dir_path, dest_dir)
+
+    packed = PackedFiles(dest_root)
+    for rel_path, entry in entries.items():
+        if rel_path in copied:
+            continue
+        if "shard" in entry and rel_path in packed:
+            if not verify:
+                continue
+            file_hash = _packed_hash(packed, hash_function, rel_path)
+            if file_hash != entry["hash"]:
+                result.changed.append(rel_path)
+        elif not verify and os.path.isfile(
+                os.path.join(dest_root, rel_path)):
+            continue
+        else:
+            result.missing.append(rel_path)
+    return result
@@ -0,0 +1,112 @@
+"""Module for classifying the directories of a project tree.
+
+Directories are classified as datasets, collections or unmanaged
+directories by reading their admin metadata, the ``.dtool/dtool`` file,
+only. Directories are listed and classified concurrently using threads,
+which suits network file systems where most of the time is spent waiting
+for metadata.
+"""
+
+import os
+import json
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
+#: Type of directories that are not dtool objects.
+UNMANAGED = "unmanaged"
+
+
+def classify_directory(path):
+    """Return dictionary describing the dtool object in a directory.
+
+    :param path: path to a directory
+    :returns: dictionary with path, type, name and uuid; name and uuid are
+              None for unmanaged directories
+    """
+    info = dict(path=path, type=UNMANAGED, name=None, uuid=None)
+    dtool_file_path = os.path.join(path, ".dtool", "dtool")
+    try:
+        with open(dtool_file_path) as fh:
+            admin_metadata = json.load(fh)
+    except (IOError, OSError, ValueError):
+        return info
+    info["type"] = admin_metadata.get("type", UNMANAGED)
+    info["name"] = admin_metadata.get("name")
+    info["uuid"] = admin_metadata.get("uuid")
+    return info
+
+
+def _scan(path):
+    """Return classification of a directory and the sub-directories to scan.
+
+    The contents of datasets are not scanned.
+    """
+    info = classify_directory(path)
+    sub_dirs = []
+    if info["type"] != "dataset":
+        try:
+            entries = list(scandir(path))
+        except OSError:
+            entries = []
+        for entry in entries:
+            if entry.name == ".dtool":
+                continue
+            if entry.is_dir() and not entry.is_symlink():
+                sub_dirs.append(entry.path)
+    return info, sub_dirs
+
+
+def classify_tree(root, workers=16):
+    """Return classifications of the directories in a tree.
+
+    The tree is walked once, a level at a time, with the directories of
+    each level being scanned by a pool of threads. Datasets are not
+    descended into and symbolic links to directories are not followed.
+
+    :param root: path to the root of the tree
+    :param workers: number of threads used to scan directories
+    :returns: list of dictionaries, as returned by
+              :func:`dtool.tree.classify_directory`, sorted by path
+    """
+    from multiprocessing.pool import ThreadPool
+
+    infos = []
+    level = [os.path.abspath(root)]
+    pool = ThreadPool(workers)
+    try:
+        while level:
+            next_level = []
+            for info, sub_dirs in pool.imap_unordered(_scan, level):
+                infos.append(info)
+                next_level.extend(sub_dirs)
+            level = next_level
+    finally:
+        pool.terminate()
+        pool.join()
+
+    infos.sort(key=lambda info: info["path"])
+    return infos
+
+
+def summary_table(infos):
+    """Return table of classified directories followed by a summary.
+
+    :param infos: list of dictionaries as returned by
+                  :func:`dtool.tree.classify_tree`
+    :returns: string
+    """
+    lines = []
+    counts = {}
+    for info in infos:
+        counts[info["type"]] = counts.get(info["type"], 0) + 1
+        lines.append("{:<12}{:<24}{}".format(
+            info["type"], info["name"] or "-", info["path"]))
+    lines.append("")
+    for dtool_type in ["dataset", "collection", UNMANAGED]:
+        lines.append("{}: {}".format(dtool_type, counts.pop(dtool_type, 0)))
+    for dtool_type in sorted(counts):
+        lines.append("{}: {}".format(dtool_type, counts[dtool_type]))
+    return "\n".join(lines)
@@ -1,13 +1,103 @@
 """dtool utilities."""
 
+import os
 import getpass
 import datetime
 
-from jinja2 import Environment, PackageLoader
+_JINJA2_ENV = None
 
-JINJA2_ENV = Environment(
-    loader=PackageLoader('dtool', 'templates'),
-    keep_trailing_newline=True)
+
+def get_jinja2_env():
+    """Return the Jinja2 environment used for rendering templates.
+
+    The environment is built on first use, so that importing this module
+    does not import Jinja2.
+    """
+    global _JINJA2_ENV
+    if _JINJA2_ENV is None:
+        from jinja2 import Environment, PackageLoader
+        _JINJA2_ENV = Environment(
+            loader=PackageLoader('dtool', 'templates'),
+            keep_trailing_newline=True)
+    return _JINJA2_ENV
+
+
+def __getattr__(name):
+    # Keep dtool.utils.JINJA2_ENV working while building it on first use;
+    # module __getattr__ needs Python 3.7 or later.
+    if name == "JINJA2_ENV":
+        return get_jinja2_env()
+    raise AttributeError(
+        "module {!r} has no attribute {!r}".format(__name__, name))
+
+
+class TemplateCache(object):
+    """Cache of compiled templates and the variables they use.
+
+    Each template is read, parsed and compiled once. The entries are keyed
+    by template name and the modification time of the template source, so
+    that a changed template is reloaded.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _mtime(filename):
+        if filename is None or not os.path.isfile(filename):
+            return None
+        return os.path.getmtime(filename)
+
+    def _lookup(self, template_name):
+        entry = self._entries.get(template_name)
+        if entry is not None:
+            filename, mtime, _, _ = entry
+            if self._mtime(filename) == mtime:
+                self.hits += 1
+                return entry
+
+        self.misses += 1
+        import jinja2.meta
+        jinja2_env = get_jinja2_env()
+        source, filename, _ = jinja2_env.loader.get_source(
+            jinja2_env, template_name)
+        mtime = self._mtime(filename)
+        ast = jinja2_env.parse(source, template_name, filename)
+        variables = frozenset(jinja2.meta.find_undeclared_variables(ast))
+        code = jinja2_env.compile(ast, template_name, filename)
+        template = jinja2_env.template_class.from_code(
+            jinja2_env, code, jinja2_env.make_globals(None))
+        entry = (filename, mtime, template, variables)
+        self._entries[template_name] = entry
+        return entry
+
+    def get_template(self, template_name):
+        """Return compiled :class:`jinja2.Template`."""
+        return self._lookup(template_name)[2]
+
+    def get_variables(self, template_name):
+        """Return frozenset of the names of the variables in a template."""
+        return self._lookup(template_name)[3]
+
+    def stats(self):
+        """Return dictionary with number of hits, misses and entries."""
+        return dict(hits=self.hits, misses=self.misses, size=len(self))
+
+    def clear(self):
+        """Remove all entries and reset the statistics."""
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+
+
+#: Template cache shared by :func:`dtool.utils.write_templated_file` and
+#: :meth:`dtool.metadata.DescriptiveMetadata.persist_to_path`.
+TEMPLATE_CACHE = TemplateCache()
 
 
 def write_templated_file(path, template_name, variables):
@@ -18,7 +108,7 @@ def write_templated_file(path, template_name, variables):
     :param template_name: Name of template to use
     :param variables: Dict containing variables to be templated
     """
-    template = JINJA2_ENV.get_template(template_name)
+    template = TEMPLATE_CACHE.get_template(template_name)
 
     with open(path, 'w') as fh:
         fh.write(template.render(variables))
@@ -33,3 +123,15 @@ def auto_metadata(email_domain):
     return {"date": str(datetime.date.today()),
             "owner_username": username,
             "owner_email": email}
+
+
+def human_readable_size(num_bytes):
+    """Return human readable string representation of a number of bytes."""
+    if num_bytes < 1024:
+        return "{} B".format(num_bytes)
+    size = float(num_bytes)
+    for unit in ["KiB", "MiB", "GiB", "TiB"]:
+        size = size / 1024
+        if size < 1024:
+            break
+    return "{:.1f} {}".format(size, unit)
@@ -0,0 +1,185 @@
+"""Module for verifying a dataset against its manifest.
+
+Three modes are supported:
+
+``full``
+    Rehash every file, in parallel across worker processes.
+``quick``
+    Compare the size and mtime of every file with the manifest.
+``sampled``
+    Rehash a random, reproducible, percentage of the files.
+
+In all modes files missing from disk, files on disk that are not in the
+manifest and files whose size differs from the manifest are reported.
+Files packed into shards by :mod:`dtool.packed` are checked against their
+shard's index and, when rehashed, read from the shard.
+"""
+
+import os
+import math
+import random
+import multiprocessing
+
+from dtool.hashing import BUF_SIZE, get_hash_function
+from dtool.manifest import _imap_largest_first
+from dtool.packed import PACKED_DIR, PackedFiles
+from dtool.walk import IGNORE_FILE_NAME, IgnorePatterns, walk_files
+
+#: Verification modes.
+MODES = ["full", "quick", "sampled"]
+
+
+class VerificationResult(object):
+    """Relative paths of the files that do not match the manifest."""
+
+    def __init__(self):
+        self.missing = []
+        self.changed = []
+        self.extra = []
+
+    @property
+    def ok(self):
+        """True if the dataset matches its manifest."""
+        return not (self.missing or self.changed or self.extra)
+
+    def as_dict(self):
+        """Return dictionary with sorted lists of missing, changed and extra
+        files."""
+        return dict(missing=sorted(self.missing),
+                    changed=sorted(self.changed),
+                    extra=sorted(self.extra))
+
+
+def _file_hash(task):
+    """Return relative path and hash of a file.
+
+    This is a module level function so that it can be sent to worker
+    processes.
+
+    :param task: tuple of hash function name, manifest root and relative
+                 path
+    :returns: tuple of relative path and hash
+    """
+    hash_function, abs_manifest_root, rel_path = task
+    hasher = get_hash_function(hash_function)()
+    with open(os.path.join(abs_manifest_root, rel_path), "rb") as fh:
+        buf = fh.read(BUF_SIZE)
+        while len(buf) > 0:
+            hasher.update(buf)
+            buf = fh.read(BUF_SIZE)
+    return rel_path, hasher.hexdigest()
+
+
+def _packed_hash(packed, hash_function, rel_path):
+    """Return hash of a packed file."""
+    hasher = get_hash_function(hash_function)()
+    hasher.update(packed.read(rel_path))
+    return hasher.hexdigest()
+
+
+def _sample(entries, percent, seed):
+    """Return a reproducible random sample of the entries."""
+    entries = sorted(entries, key=lambda entry: entry["path"])
+    k = int(math.ceil(len(entries) * percent / 100.0))
+    return random.Random(seed).sample(entries, min(k, len(entries)))
+
+
+def verify_dataset(
+        dataset,
+        mode="full",
+        workers=1,
+        percent=10,
+        seed=0,
+        fail_fast=False):
+    """Return :class:`dtool.verify.VerificationResult` of a dataset.
+
+    :param dataset: :class:`dtoolcore.DataSet`
+    :param mode: one of ``full``, ``quick`` or ``sampled``
+    :param workers: number of worker processes used to hash files
+    :param percent: percentage of files rehashed in sampled mode
+    :param seed: seed of the random sample in sampled mode
+    :param fail_fast: return as soon as a file that does not match the
+                      manifest is found
+    :returns: :class:`dtool.verify.VerificationResult`
+    :raises: ValueError if the mode is not known
+    """
+    if mode not in MODES:
+        raise ValueError("Unknown verification mode: {}".format(mode))
+
+    manifest = dataset._structural_metadata
+    abs_root = manifest.abs_manifest_root
+    entries = dict((entry["path"], entry) for entry in manifest["file_list"])
+    ignore = IgnorePatterns.from_path(
+        os.path.join(dataset._abs_path, IGNORE_FILE_NAME))
+
+    ignore_prefixes = list(manifest.ignore_prefixes) + [PACKED_DIR]
+    packed = PackedFiles(abs_root)
+
+    result = VerificationResult()
+    to_hash = []
+    on_disk = set()
+    for rel_path in walk_files(abs_root, ignore, ignore_prefixes):
+        entry = entries.get(rel_path)
+        if entry is None:
+            result.extra.append(rel_path)
+        else:
+            on_disk.add(rel_path)
+            stat_result = os.stat(os.path.join(abs_root, rel_path))
+            if stat_result.st_size != entry["size"]:
+                result.changed.append(rel_path)
+            elif mode == "quick" and stat_result.st_mtime != entry["mtime"]:
+                result.changed.append(rel_path)
+            elif mode != "quick":
+                to_hash.append(entry)
+        if fail_fast and not result.ok:
+            return result
+
+    for rel_path, entry in entries.items():
+        if rel_path in on_disk:
+            continue
+        if "shard" not in entry or rel_path not in packed:
+            result.missing.append(rel_path)
+        else:
+            record = packed.shard(rel_path).member(rel_path)
+            if record["size"] != entry["size"]:
+                result.changed.append(rel_path)
+            elif mode == "quick" and record["mtime"] != entry["mtime"]:
+                result.changed.append(rel_path)
+            elif mode != "quick":
+                to_hash.append(entry)
+        if fail_fast and not result.ok:
+            return result
+
+    if mode == "sampled":
+        to_hash = _sample(to_hash, percent, seed)
+
+    hash_function = manifest["hash_function"]
+    for entry in [e for e in to_hash if "shard" in e]:
+        rel_path = entry["path"]
+        if _packed_hash(packed, hash_function, rel_path) != entry["hash"]:
+            result.changed.append(rel_path)
+            if fail_fast:
+                return result
+    to_hash = [entry for entry in to_hash if "shard" not in entry]
+    if not to_hash:
+        return result
+
+    tasks = [(hash_function, abs_root, entry["path"])
+             for entry in to_hash]
+    sizes = [entry["size"] for entry in to_hash]
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+    try:
+        for rel_path, file_hash in _imap_largest_first(
+                pool, _file_hash, tasks, sizes):
+            if file_hash != entries[rel_path]["hash"]:
+                result.changed.append(rel_path)
+                if fail_fast:
+                    break
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    return result
@@ -0,0 +1,205 @@
+"""Module for finding the files in a dataset.
+
+Files and directories can be excluded from a dataset's manifest by listing
+gitignore-style patterns in a ``.dtoolignore`` file in the dataset
+directory. The patterns are matched against paths relative to the manifest
+root. Ignored directories are not descended into.
+"""
+
+import os
+import re
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
+#: Name of the file containing the patterns of files to ignore.
+IGNORE_FILE_NAME = ".dtoolignore"
+
+
+def _translate(glob):
+    """Return regular expression string matching the glob.
+
+    ``*`` and ``?`` do not match ``/``, ``**`` matches across directories.
+    """
+    i, n = 0, len(glob)
+    res = []
+    while i < n:
+        c = glob[i]
+        if c == "*":
+            if glob[i:i + 3] == "**/":
+                res.append("(?:.*/)?")
+                i += 3
+                continue
+            if glob[i:i + 2] == "**":
+                res.append(".*")
+                i += 2
+                continue
+            res.append("[^/]*")
+        elif c == "?":
+            res.append("[^/]")
+        elif c == "[":
+            j = glob.find("]", i + 2)
+            if j == -1:
+                res.append(re.escape(c))
+            else:
+                content = glob[i + 1:j].replace("\\", "\\\\")
+                if content.startswith("!"):
+                    content = "^" + content[1:]
+                res.append("[{}]".format(content))
+                i = j
+        else:
+            res.append(re.escape(c))
+        i += 1
+    return "".join(res)
+
+
+class _Pattern(object):
+    """Compiled gitignore-style pattern."""
+
+    def __init__(self, line):
+        self.negate = line.startswith("!")
+        if self.negate:
+            line = line[1:]
+        elif line.startswith("\\#") or line.startswith("\\!"):
+            line = line[1:]
+        self.dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if "/" in line:
+            regex = "^" + _translate(line.lstrip("/")) + "$"
+        else:
+            regex = "^(?:.*/)?" + _translate(line) + "$"
+        self.regex = re.compile(regex)
+
+    def matches(self, rel_path, is_dir):
+        if self.dir_only and not is_dir:
+            return False
+        return self.regex.match(rel_path) is not None
+
+
+class IgnorePatterns(object):
+    """Gitignore-style patterns of paths to ignore.
+
+    The patterns are compiled once. As in gitignore, blank lines and lines
+    starting with ``#`` are skipped, a trailing ``/`` only matches
+    directories, a leading ``!`` re-includes a path and the last matching
+    pattern wins.
+
+    :param lines: iterable of pattern lines
+    """
+
+    def __init__(self, lines=()):
+        self._patterns = []
+        for line in lines:
+            line = line.rstrip("\n").rstrip("\r")
+            if not line.strip() or line.startswith("#"):
+                continue
+            self._patterns.append(_Pattern(line.rstrip(" ")))
+
+    def __len__(self):
+        return len(self._patterns)
+
+    @classmethod
+    def from_path(cls, fpath):
+        """Return :class:`dtool.walk.IgnorePatterns` read from file.
+
+        Returns empty patterns if the file does not exist.
+        """
+        if not os.path.isfile(fpath):
+            return cls()
+        with open(fpath) as fh:
+            return cls(fh)
+
+    def is_ignored(self, rel_path, is_dir=False):
+        """Return True if the relative path should be ignored.
+
+        :param rel_path: path relative to the manifest root using ``/`` as
+                         the separator
+        :param is_dir: True if the path is a directory
+        :returns: bool
+        """
+        ignored = False
+        for pattern in self._patterns:
+            if pattern.matches(rel_path, is_dir):
+                ignored = not pattern.negate
+        return ignored
+
+
+def _posix_path(rel_path):
+    if os.sep == "/":
+        return rel_path
+    return rel_path.replace(os.sep, "/")
+
+
+def list_directory(abs_root, rel_dir, ignore, ignore_prefixes=()):
+    """Return files and sub-directories of a directory below abs_root.
+
+    Paths matching the ignore patterns or ignore prefixes are left out.
+
+    :param abs_root: absolute path to the root of the walk
+    :param rel_dir: directory to list relative to abs_root
+    :param ignore: :class:`dtool.walk.IgnorePatterns`
+    :param ignore_prefixes: relative path prefixes to ignore
+    :returns: tuple of list of (relative path, :class:`os.DirEntry`) pairs
+              of files and list of relative paths of sub-directories
+    """
+    ignore_prefixes = tuple(ignore_prefixes)
+    abs_dir = os.path.join(abs_root, rel_dir) if rel_dir else abs_root
+    files = []
+    sub_dirs = []
+    for entry in scandir(abs_dir):
+        if rel_dir:
+            rel_path = os.path.join(rel_dir, entry.name)
+        else:
+            rel_path = entry.name
+        if rel_path.startswith(ignore_prefixes):
+            continue
+        # The directory entry type is used so that no stat calls are
+        # needed on file systems that provide it.
+        is_dir = entry.is_dir()
+        if ignore.is_ignored(_posix_path(rel_path), is_dir):
+            continue
+        if not is_dir:
+            files.append((rel_path, entry))
+        elif not entry.is_symlink():
+            sub_dirs.append(rel_path)
+    return files, sub_dirs
+
+
+def walk_entries(abs_root, ignore=None, ignore_prefixes=(), rel_dir=""):
+    """Yield relative paths and directory entries of files below abs_root.
+
+    Files are yielded in the same order as by :func:`os.walk`. Ignored
+    directories are pruned rather than walked. Symbolic links to
+    directories are not followed.
+
+    :param abs_root: absolute path to the root of the walk
+    :param ignore: :class:`dtool.walk.IgnorePatterns`
+    :param ignore_prefixes: relative path prefixes to ignore
+    :param rel_dir: directory to start the walk from relative to abs_root
+    :returns: generator of (relative path, :class:`os.DirEntry`) pairs
+    """
+    if ignore is None:
+        ignore = IgnorePatterns()
+    files, sub_dirs = list_directory(
+        abs_root, rel_dir, ignore, ignore_prefixes)
+    for item in files:
+        yield item
+    for sub_dir in sub_dirs:
+        for item in walk_entries(abs_root, ignore, ignore_prefixes, sub_dir):
+            yield item
+
+
+def walk_files(abs_root, ignore=None, ignore_prefixes=()):
+    """Yield relative paths to files below abs_root.
+
+    See :func:`dtool.walk.walk_entries`.
+
+    :param abs_root: absolute path to the directory to walk
+    :param ignore: :class:`dtool.walk.IgnorePatterns`
+    :param ignore_prefixes: relative path prefixes to ignore
+    :returns: generator of relative paths
+    """
+    for rel_path, _ in walk_entries(abs_root, ignore, ignore_prefixes):
+        yield rel_path
@@ -0,0 +1,407 @@
+"""Module for keeping a dataset's manifest up to date as files change.
+
+Rather than rescanning and rehashing on a schedule, a
+:class:`dtool.watch.ManifestWatcher` uses Linux inotify, through
+:mod:`ctypes`, to learn which files under the manifest root are created,
+closed after writing, moved or deleted. Files are hashed once they have been
+closed after writing and left alone for a debounce interval, by a pool of
+background threads. The manifest and its overlays are rewritten at
+intervals, only if something has changed.
+
+If the kernel's inotify event queue overflows, the watcher falls back to an
+incremental update of the whole manifest.
+"""
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import threading
+import ctypes
+import ctypes.util
+
+from dtoolcore import DataSet
+
+from dtool.archive import ARCHIVE_OVERLAY
+from dtool.manifest import (
+    _entries_with_stat,
+    _file_metadata,
+    _read_overlays,
+    dataset_manifest_writer,
+    resolve_overlay_functions,
+    resolve_overlays,
+    update_manifest,
+)
+from dtool.overlays import OverlayCache
+from dtool.packed import PACKED_DIR
+from dtool.walk import (
+    IGNORE_FILE_NAME,
+    IgnorePatterns,
+    _posix_path,
+    list_directory,
+)
+
+#: Default number of seconds a file must be left alone before it is hashed.
+DEFAULT_DEBOUNCE = 2.0
+
+#: Default number of seconds between writes of the manifest.
+DEFAULT_FLUSH_INTERVAL = 60.0
+
+# Seconds to wait for events before checking on hashing and flushing.
+_POLL_INTERVAL = 0.5
+
+try:
+    _fsencode = os.fsencode
+    _fsdecode = os.fsdecode
+except AttributeError:
+    # Python 2, where paths are usually byte strings already.
+    def _fsencode(path):
+        if isinstance(path, bytes):
+            return path
+        return path.encode(sys.getfilesystemencoding())
+
+    def _fsdecode(name):
+        return name
+
+# inotify constants from <sys/inotify.h>.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+#: Events watched in every directory below the manifest root.
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR)
+
+_EVENT = struct.Struct("iIII")
+
+
+def _load_libc():
+    libc_name = ctypes.util.find_library("c") or "libc.so.6"
+    try:
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, "inotify_init1"):
+        return None
+    libc.inotify_add_watch.argtypes = [
+        ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return libc
+
+
+_LIBC = _load_libc()
+
+
+def inotify_available():
+    """Return True if inotify is available on this system."""
+    return _LIBC is not None
+
+
+class Inotify(object):
+    """Minimal wrapper around a Linux inotify instance.
+
+    :raises: OSError if inotify is not available
+    """
+
+    def __init__(self):
+        if _LIBC is None:
+            raise OSError("inotify is not available on this system")
+        self.fd = _LIBC.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        """Return watch descriptor of a directory."""
+        wd = _LIBC.inotify_add_watch(
+            self.fd, _fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        """Stop watching a directory."""
+        _LIBC.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self, timeout):
+        """Return list of events, waiting at most timeout seconds.
+
+        :returns: list of tuples of watch descriptor, mask, cookie and name
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            buf = os.read(self.fd, 2**16)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+        events = []
+        offset = 0
+        while offset < len(buf):
+            wd, mask, cookie, length = _EVENT.unpack_from(buf, offset)
+            offset += _EVENT.size
+            name = buf[offset:offset + length].rstrip(b"\0")
+            offset += length
+            events.append((wd, mask, cookie, _fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ManifestWatcher(object):
+    """Keep the manifest and overlays of a dataset up to date.
+
+    Call :meth:`start`, then :meth:`poll` repeatedly, and finally
+    :meth:`close`; or call :meth:`run`, which does all three.
+
+    :param dataset: :class:`dtoolcore.DataSet`
+    :param debounce: seconds a file must be left alone before it is hashed
+    :param flush_interval: seconds between writes of the manifest
+    :param workers: number of threads used to hash files
+    """
+
+    def __init__(
+            self,
+            dataset,
+            debounce=DEFAULT_DEBOUNCE,
+            flush_interval=DEFAULT_FLUSH_INTERVAL,
+            workers=1):
+        self.path = dataset._abs_path
+        self.debounce = debounce
+        self.flush_interval = flush_interval
+        self.workers = workers
+        self.num_flushes = 0
+        self._stopped = threading.Event()
+        self._inotify = None
+        self._pool = None
+        self._dirs = {}
+        self._items = {}
+        self._pending = {}
+        self._hashing = {}
+        self._dirty = False
+        self._last_flush = time.time()
+
+    def _load(self):
+        """Load the items of the manifest on disk."""
+        self.dataset = DataSet.from_path(self.path)
+        manifest = self.dataset._structural_metadata
+        self.abs_root = manifest.abs_manifest_root
+        self.hash_function = manifest["hash_function"]
+        self.extra_hashes, self.archives = resolve_overlays(self.dataset)
+        self.overlays = resolve_overlay_functions(self.dataset)
+        self.overlay_names = self.overlays + self.extra_hashes
+        if self.archives:
+            self.overlay_names.append(ARCHIVE_OVERLAY)
+        self.ignore = IgnorePatterns.from_path(
+            os.path.join(self.path, IGNORE_FILE_NAME))
+        self.ignore_prefixes = tuple(manifest.ignore_prefixes) + (PACKED_DIR,)
+
+        overlays = _read_overlays(self.dataset, self.overlay_names)
+        self._overlay_cache = OverlayCache(overlays)
+        self._items = {}
+        for entry in _entries_with_stat(self.dataset):
+            item_overlays = dict(
+                (name, overlays.get(name, {}).get(entry["hash"]))
+                for name in self.overlay_names)
+            self._items[entry["path"]] = (entry, item_overlays)
+
+    def _watch_tree(self, rel_dir, mark_files):
+        """Watch a directory and the directories below it.
+
+        If mark_files, the files found are queued for hashing.
+        """
+        abs_dir = os.path.join(self.abs_root, rel_dir)
+        try:
+            wd = self._inotify.add_watch(abs_dir)
+            files, sub_dirs = list_directory(
+                self.abs_root, rel_dir, self.ignore, self.ignore_prefixes)
+        except OSError:
+            return
+        self._dirs[wd] = rel_dir
+        now = time.time()
+        if mark_files:
+            for rel_path, _ in files:
+                self._pending[rel_path] = now
+        for sub_dir in sub_dirs:
+            self._watch_tree(sub_dir, mark_files)
+
+    def _unwatch_tree(self, rel_dir):
+        """Stop watching a directory and forget the files below it."""
+        prefix = rel_dir + os.sep
+        for wd, path in list(self._dirs.items()):
+            if path == rel_dir or path.startswith(prefix):
+                self._inotify.rm_watch(wd)
+                del self._dirs[wd]
+        for paths in [self._items, self._pending, self._hashing]:
+            for rel_path in [p for p in paths if p.startswith(prefix)]:
+                del paths[rel_path]
+                self._dirty = True
+
+    def _is_ignored(self, rel_path, is_dir):
+        if rel_path.startswith(self.ignore_prefixes):
+            return True
+        return self.ignore.is_ignored(_posix_path(rel_path), is_dir)
+
+    def start(self):
+        """Watch the manifest root and catch up with changes made since the
+        manifest was last written."""
+        from multiprocessing.pool import ThreadPool
+
+        self._load()
+        self._inotify = Inotify()
+        # Start watching before catching up, so that no change is missed.
+        self._watch_tree("", mark_files=False)
+        update_manifest(self.dataset, workers=self.workers, incremental=True)
+        self._load()
+        self._pool = ThreadPool(self.workers)
+        self._last_flush = time.time()
+
+    def _rescan(self):
+        """Recover from a lost event by updating the whole manifest."""
+        self._wait_for_hashing()
+        self.flush()
+        self._watch_tree("", mark_files=False)
+        update_manifest(self.dataset, workers=self.workers, incremental=True)
+        self._load()
+        self._pending = {}
+
+    def _handle(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            self._rescan()
+            return
+        rel_dir = self._dirs.get(wd)
+        if rel_dir is None:
+            return
+        if mask & IN_IGNORED:
+            del self._dirs[wd]
+            return
+        if not name:
+            return
+        rel_path = os.path.join(rel_dir, name) if rel_dir else name
+        is_dir = bool(mask & IN_ISDIR)
+        if self._is_ignored(rel_path, is_dir):
+            return
+        if is_dir:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self._watch_tree(rel_path, mark_files=True)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self._unwatch_tree(rel_path)
+        elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            self._pending[rel_path] = time.time()
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            self._pending.pop(rel_path, None)
+            self._hashing.pop(rel_path, None)
+            if self._items.pop(rel_path, None) is not None:
+                self._dirty = True
+
+    def _submit(self, force=False):
+        """Start hashing the files that have been left alone long enough."""
+        now = time.time()
+        for rel_path, last_event in list(self._pending.items()):
+            if rel_path in self._hashing:
+                continue
+            if not force and now - last_event < self.debounce:
+                continue
+            del self._pending[rel_path]
+            task = (self.hash_function, self.abs_root, rel_path,
+                    self.extra_hashes, self.archives, self.overlays)
+            self._hashing[rel_path] = self._pool.apply_async(
+                _file_metadata, (task, self._overlay_cache))
+
+    def _collect(self):
+        """Record the items of the files that have been hashed."""
+        for rel_path, result in list(self._hashing.items()):
+            if not result.ready():
+                continue
+            del self._hashing[rel_path]
+            try:
+                item = result.get()
+            except (IOError, OSError):
+                # The file was removed before it could be hashed.
+                continue
+            if rel_path in self._pending:
+                # The file changed again while it was being hashed.
+                continue
+            self._items[rel_path] = item
+            self._dirty = True
+
+    def _wait_for_hashing(self):
+        for result in self._hashing.values():
+            result.wait()
+        self._collect()
+
+    def flush(self):
+        """Write the manifest and overlays if anything has changed."""
+        self._last_flush = time.time()
+        if not self._dirty:
+            return
+        with dataset_manifest_writer(
+                self.dataset, self.overlay_names) as writer:
+            for entry, item_overlays in self._items.values():
+                writer.add(entry, item_overlays)
+            writer.write()
+        self._dirty = False
+        self.num_flushes += 1
+
+    def poll(self, timeout=_POLL_INTERVAL):
+        """Handle the events that arrive within timeout seconds, hash the
+        files that are ready and flush the manifest if it is due."""
+        for wd, mask, _, name in self._inotify.read_events(timeout):
+            self._handle(wd, mask, name)
+        self._submit()
+        self._collect()
+        if time.time() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def stop(self):
+        """Make :meth:`run` return; may be called from another thread."""
+        self._stopped.set()
+
+    def close(self):
+        """Hash the files still queued, flush the manifest and stop
+        watching."""
+        if self._pool is not None:
+            self._submit(force=True)
+            self._wait_for_hashing()
+            self.flush()
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def run(self, duration=None):
+        """Watch the dataset until stopped, or for duration seconds.
+
+        :param duration: seconds to watch for; until stopped if None
+        """
+        deadline = None
+        if duration is not None:
+            deadline = time.time() + duration
+        self.start()
+        try:
+            while not self._stopped.is_set():
+                timeout = _POLL_INTERVAL
+                if deadline is not None:
+                    timeout = min(timeout, deadline - time.time())
+                    if timeout <= 0:
+                        break
+                self.poll(timeout)
+        finally:
+            self.close()
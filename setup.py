@@ -16,11 +16,13 @@ setup(name="dtool",
       url=url,
       download_url="{}/tarball/{}".format(url, version),
       install_requires=[
+        "binaryornot",
         "click",
-        "dtoolcore",
-        "dtoolutils",
+        "dtoolcore>=0.14.0",
         "jinja2",
+        "puremagic>=1.4,<2",
         "pyyaml",
+        "scandir; python_version < '3.5'",
       ],
       entry_points={
           'console_scripts': ['dtool=dtool.cli:cli']
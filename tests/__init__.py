@@ -11,6 +11,7 @@ from dtoolcore import DataSet
 
 _HERE = os.path.dirname(__file__)
 TEST_SAMPLE_DATASET = os.path.join(_HERE, "data", "sample_data")
+TEST_INPUT_DATA = os.path.join(_HERE, "data", "mimetype", "input", "archive")
 
 
 @contextlib.contextmanager
@@ -57,3 +58,45 @@ def tmp_dataset_fixture(request):
         shutil.rmtree(d)
 
     return DataSet.from_path(dataset_path)
+
+
+def copy_tree(src, dst):
+    """Copy the contents of directory src into dst, which may exist."""
+    for dir_path, _, file_names in os.walk(src):
+        dest_dir = os.path.join(dst, os.path.relpath(dir_path, src))
+        if not os.path.isdir(dest_dir):
+            os.makedirs(dest_dir)
+        for fn in file_names:
+            shutil.copy2(os.path.join(dir_path, fn), dest_dir)
+
+
+def create_dataset(path, files=None, readme=None, name="test_dataset",
+                   update=None):
+    """Create a dataset in path and return it.
+
+    :param path: path to the dataset; created if it does not exist
+    :param files: dictionary of relative paths and contents of the data
+                  files; defaults to a copy of TEST_INPUT_DATA
+    :param readme: content of the README.yml file
+    :param name: name of the dataset
+    :param update: function called with the dataset to update its manifest,
+                   such as :func:`dtool.manifest.update_manifest`; the
+                   manifest is left empty if None
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    dataset = DataSet(name, "data")
+    dataset.persist_to_path(path)
+    data_dir = os.path.join(path, "data")
+    if files is None:
+        copy_tree(TEST_INPUT_DATA, data_dir)
+    else:
+        for rel_path, content in files.items():
+            with open(os.path.join(data_dir, rel_path), "w") as fh:
+                fh.write(content)
+    if readme is not None:
+        with open(os.path.join(path, "README.yml"), "w") as fh:
+            fh.write(readme)
+    if update is not None:
+        update(dataset)
+    return DataSet.from_path(path)
@@ -188,3 +188,42 @@ def test_metadata_from_path(tmp_dir_fixture):  # NOQA
 
     expected = {"project_name": "my_project"}
     assert metadata_from_path(tmp_dir_fixture) == expected
+
+
+def test_metadata_resolver(tmp_dir_fixture):  # NOQA
+    from dtoolcore import Collection, DataSet
+    from dtool.metadata import DescriptiveMetadata, MetadataResolver
+
+    project_path = tmp_dir_fixture
+    Collection().persist_to_path(project_path)
+    DescriptiveMetadata([
+        ("project_name", "my_project"),
+        ("dataset_name", "should_not_see_this")]).persist_to_path(project_path)
+
+    dataset_paths = []
+    for name in ["ds1", "ds2"]:
+        dataset_path = os.path.join(project_path, name)
+        os.mkdir(dataset_path)
+        DataSet(name).persist_to_path(dataset_path)
+        DescriptiveMetadata([("dataset_name", name)]).persist_to_path(
+            dataset_path)
+        dataset_paths.append(dataset_path)
+
+    resolver = MetadataResolver()
+    for dataset_path in dataset_paths:
+        expected = DataSet.from_path(dataset_path).descriptive_metadata
+        assert resolver.resolve(dataset_path) == expected
+    # The project README is only parsed once.
+    assert resolver.stats() == dict(hits=1, misses=3, size=3)
+
+    # Only the dataset's own README when not inheriting.
+    resolver = MetadataResolver(levels=0)
+    assert resolver.resolve(dataset_paths[0]) == {"dataset_name": "ds1"}
+
+    # A changed README is parsed again.
+    resolver = MetadataResolver()
+    resolver.resolve(project_path)
+    DescriptiveMetadata([("project_name", "renamed")]).persist_to_path(
+        project_path)
+    assert resolver.resolve(project_path) == {"project_name": "renamed"}
+    assert resolver.stats()["misses"] == 2
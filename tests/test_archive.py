@@ -0,0 +1,149 @@
+"""Tests for the dtool archive module."""
+
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from . import copy_tree, tmp_dir_fixture  # NOQA
+
+HERE = os.path.dirname(__file__)
+TEST_INPUT_DATA = os.path.join(HERE, "data", "mimetype", "input", "archive")
+
+SHA1_ABC = "a9993e364706816aba3e25717850c26c9cd0d89d"
+
+
+def _write_tar(fpath, mode="w"):
+    with tarfile.open(fpath, mode) as tar:
+        tarinfo = tarfile.TarInfo("sub")
+        tarinfo.type = tarfile.DIRTYPE
+        tar.addfile(tarinfo)
+        tarinfo = tarfile.TarInfo("sub/abc.txt")
+        tarinfo.size = 3
+        tar.addfile(tarinfo, io.BytesIO(b"abc"))
+
+
+def _write_zip(fpath):
+    with zipfile.ZipFile(fpath, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("sub/", "")
+        zf.writestr("sub/abc.txt", "abc")
+
+
+@pytest.mark.parametrize("name", ["a.tar", "a.tar.gz", "a.zip"])
+def test_archive_members(tmp_dir_fixture, name):  # NOQA
+    from dtool.archive import archive_members_from_path
+
+    fpath = os.path.join(tmp_dir_fixture, name)
+    if name == "a.zip":
+        _write_zip(fpath)
+    elif name == "a.tar.gz":
+        _write_tar(fpath, "w:gz")
+    else:
+        _write_tar(fpath)
+
+    assert archive_members_from_path(fpath, "shasum") == [
+        dict(path="sub/abc.txt", size=3, hash=SHA1_ABC)]
+
+
+def test_archive_members_of_other_files():
+    from dtool.archive import archive_members_from_path
+
+    for fn in os.listdir(TEST_INPUT_DATA):
+        fpath = os.path.join(TEST_INPUT_DATA, fn)
+        assert archive_members_from_path(fpath, "shasum") is None
+
+
+def _patch_zip(fpath, flags=0, method=None):
+    """Set flags and the compression method in the headers of a zip."""
+    with open(fpath, "rb") as fh:
+        data = bytearray(fh.read())
+    # Offsets of the flags in local file and central directory headers; the
+    # compression method follows them.
+    for magic, offset in [(b"PK\x03\x04", 6), (b"PK\x01\x02", 8)]:
+        start = data.find(magic)
+        while start != -1:
+            data[start + offset] |= flags
+            if method is not None:
+                data[start + offset + 2] = method
+            start = data.find(magic, start + 1)
+    with open(fpath, "wb") as fh:
+        fh.write(data)
+
+
+@pytest.mark.parametrize("patch", [dict(flags=0x1), dict(method=99)])
+def test_archive_members_unreadable_zip(tmp_dir_fixture, patch):  # NOQA
+    from dtool.archive import archive_members_from_path
+
+    # Members that are encrypted or use an unsupported compression method.
+    fpath = os.path.join(tmp_dir_fixture, "a.zip")
+    _write_zip(fpath)
+    _patch_zip(fpath, **patch)
+    assert archive_members_from_path(fpath, "shasum") is None
+
+
+def test_archive_members_read_error(tmp_dir_fixture, mocker):  # NOQA
+    from dtool.archive import archive_members_from_path
+
+    fpath = os.path.join(tmp_dir_fixture, "a.tar")
+    _write_tar(fpath)
+    mocker.patch("dtool.archive._tar_members", side_effect=IOError(5, "EIO"))
+    with pytest.raises(IOError):
+        archive_members_from_path(fpath, "shasum")
+
+
+def test_looks_like_archive(tmp_dir_fixture):  # NOQA
+    from dtool.archive import looks_like_archive
+
+    for name, mode in [("a.tar", "w"), ("a.tar.gz", "w:gz"),
+                       ("a.tar.bz2", "w:bz2"), ("a.tar.xz", "w:xz")]:
+        fpath = os.path.join(tmp_dir_fixture, name)
+        _write_tar(fpath, mode)
+        with open(fpath, "rb") as fh:
+            assert looks_like_archive(fh.read(512))
+
+    fpath = os.path.join(tmp_dir_fixture, "a.zip")
+    _write_zip(fpath)
+    with open(fpath, "rb") as fh:
+        content = fh.read()
+    assert looks_like_archive(content[:512])
+    assert looks_like_archive(b"#!/bin/sh\n", content[-36:])
+
+    for fn in os.listdir(TEST_INPUT_DATA):
+        with open(os.path.join(TEST_INPUT_DATA, fn), "rb") as fh:
+            content = fh.read()
+        assert not looks_like_archive(content[:512], content[-36:])
+
+
+def test_update_manifest_with_archives(tmp_dir_fixture, mocker):  # NOQA
+    from dtoolcore import DataSet
+    import dtool.manifest
+    from dtool.archive import ARCHIVE_OVERLAY
+    from dtool.manifest import update_manifest
+
+    dataset = DataSet("test_dataset", "data")
+    dataset.persist_to_path(tmp_dir_fixture)
+    data_dir = os.path.join(tmp_dir_fixture, "data")
+    copy_tree(TEST_INPUT_DATA, data_dir)
+    _write_tar(os.path.join(data_dir, "a.tar"))
+
+    # Only the files that look like archives are read again.
+    spy = mocker.spy(dtool.manifest, "archive_members_from_path")
+    update_manifest(dataset, archives=True)
+    assert [call[0][0] for call in spy.call_args_list] == [
+        os.path.join(data_dir, "a.tar")]
+    dataset = DataSet.from_path(tmp_dir_fixture)
+    overlay = dataset.access_overlays()[ARCHIVE_OVERLAY]
+    hashes = dict((entry["path"], entry["hash"])
+                  for entry in dataset.manifest["file_list"])
+    assert overlay[hashes["a.tar"]] == [
+        dict(path="sub/abc.txt", size=3, hash=SHA1_ABC)]
+    assert overlay[hashes["tiny.png"]] is None
+
+    # The overlay is kept up to date once it exists.
+    _write_zip(os.path.join(data_dir, "b.zip"))
+    update_manifest(dataset, incremental=True)
+    dataset = DataSet.from_path(tmp_dir_fixture)
+    overlay = dataset.access_overlays()[ARCHIVE_OVERLAY]
+    assert len(overlay) == len(dataset.manifest["file_list"])
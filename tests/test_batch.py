@@ -0,0 +1,105 @@
+"""Tests for the dtool batch module."""
+
+import os
+
+from . import tmp_dir_fixture  # NOQA
+
+SCHEMA = [
+    ("project_name", u"project_name"),
+    ("dataset_name", u"dataset_name"),
+    ("owner_name", u"Your Name"),
+]
+
+
+def _create_runs(root, names):
+    paths = []
+    for name in names:
+        path = os.path.join(root, name)
+        os.mkdir(path)
+        with open(os.path.join(path, "reads.fq"), "w") as fh:
+            fh.write("@read\nACGT\n+\nIIII\n")
+        paths.append(path)
+    return paths
+
+
+def test_read_metadata_file(tmp_dir_fixture):  # NOQA
+    from dtool.batch import read_metadata_file
+
+    fpath = os.path.join(tmp_dir_fixture, "metadata.yml")
+    with open(fpath, "w") as fh:
+        fh.write("defaults:\n"
+                 "  owner_name: Test User\n"
+                 "directories:\n"
+                 "  {}:\n"
+                 "    dataset_name: renamed\n"
+                 "  {}:\n".format(
+                     os.path.join(tmp_dir_fixture, "run1"),
+                     os.path.join(tmp_dir_fixture, "run2")))
+
+    defaults, directories = read_metadata_file(fpath)
+    assert defaults == {"owner_name": "Test User"}
+    assert directories == {
+        os.path.join(tmp_dir_fixture, "run1"): {"dataset_name": "renamed"},
+        os.path.join(tmp_dir_fixture, "run2"): {},
+    }
+
+
+def test_batch_markup(tmp_dir_fixture):  # NOQA
+    import yaml
+    from dtoolcore import DataSet
+    from dtool.batch import batch_markup
+    from dtool.metadata import METADATA_RESOLVER
+    from dtool.project import Project
+
+    Project("sequencing").persist_to_path(tmp_dir_fixture)
+    paths = _create_runs(tmp_dir_fixture, ["run1", "run2", "run3"])
+    DataSet("already").persist_to_path(paths[2])
+    missing = os.path.join(tmp_dir_fixture, "missing")
+
+    METADATA_RESOLVER.clear()
+    results = batch_markup(
+        paths + [missing],
+        SCHEMA,
+        defaults={"owner_name": "Test User"},
+        directories={paths[0]: {"dataset_name": "renamed"}},
+        workers=3)
+
+    # The parent metadata is only parsed once for all directories.
+    assert METADATA_RESOLVER.stats()["misses"] == 1
+
+    assert [result["path"] for result in results] == paths + [missing]
+    assert [result["status"] for result in results] == [
+        "ok", "ok", "error", "error"]
+    assert "Already a dtool object" in results[2]["error"]
+
+    dataset = DataSet.from_path(paths[0])
+    assert dataset.name == "renamed"
+    assert dataset.uuid == results[0]["uuid"]
+    assert len(dataset.identifiers) == 1
+    with open(os.path.join(paths[1], "README.yml")) as fh:
+        readme = yaml.safe_load(fh)
+    assert readme["dataset_name"] == "run2"
+    assert readme["project_name"] == "sequencing"
+    assert readme["owners"][0]["name"] == "Test User"
+
+
+def test_batch_markup_dataset_name(tmp_dir_fixture):  # NOQA
+    from dtoolcore import DataSet
+    from dtool.batch import batch_markup
+    from dtool.metadata import METADATA_RESOLVER
+
+    # Names inherited from the parent directory or given as a default are
+    # not used for all the datasets.
+    with open(os.path.join(tmp_dir_fixture, "README.yml"), "w") as fh:
+        fh.write("dataset_name: parent\nproject_name: sequencing\n")
+    paths = _create_runs(tmp_dir_fixture, ["run1", "run2"])
+
+    METADATA_RESOLVER.clear()
+    results = batch_markup(
+        paths,
+        SCHEMA,
+        defaults={"dataset_name": "shared"},
+        directories={paths[0]: {"dataset_name": "renamed"}})
+    assert [result["status"] for result in results] == ["ok", "ok"]
+    assert DataSet.from_path(paths[0]).name == "renamed"
+    assert DataSet.from_path(paths[1]).name == "run2"
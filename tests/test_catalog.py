@@ -0,0 +1,128 @@
+"""Tests for the dtool catalog module."""
+
+import os
+import shutil
+
+from . import create_dataset, tmp_dir_fixture  # NOQA
+
+
+def _create_project(root):
+    from dtool.manifest import update_manifest
+    create_dataset(
+        os.path.join(root, "reads"),
+        {"a.BAM": "x" * 100, "b.bam": "y" * 10, "notes.txt": "notes"},
+        readme="organism: wheat\n",
+        name="reads",
+        update=update_manifest)
+    create_dataset(
+        os.path.join(root, "sub", "more_reads"),
+        {"c.bam": "z" * 200},
+        readme="organism: brassica\n",
+        name="more_reads",
+        update=update_manifest)
+
+
+def test_catalog_query(tmp_dir_fixture):  # NOQA
+    from dtool.catalog import Catalog
+
+    _create_project(tmp_dir_fixture)
+    with Catalog(tmp_dir_fixture) as catalog:
+        result = catalog.refresh()
+        assert result["added"] == ["reads", os.path.join("sub", "more_reads")]
+
+        items = list(catalog.query(suffix="bam", min_size=50))
+        assert [(item["name"], item["path"]) for item in items] == [
+            ("reads", "a.BAM"), ("more_reads", "c.bam")]
+        assert items[0]["dataset"] == os.path.join(tmp_dir_fixture, "reads")
+
+        items = list(catalog.query(
+            suffix=".bam", metadata={"organism": "wheat"}))
+        assert [item["path"] for item in items] == ["a.BAM", "b.bam"]
+
+        items = list(catalog.query(mimetype="text/plain", max_size=5))
+        assert [item["path"] for item in items] == ["notes.txt"]
+
+        assert len(list(catalog.query(limit=2))) == 2
+
+
+def test_catalog_refresh(tmp_dir_fixture):  # NOQA
+    from dtoolcore import DataSet
+    from dtool.catalog import Catalog
+    from dtool.manifest import update_manifest
+
+    _create_project(tmp_dir_fixture)
+    with Catalog(tmp_dir_fixture) as catalog:
+        catalog.refresh()
+
+    reads_path = os.path.join(tmp_dir_fixture, "reads")
+    with open(os.path.join(reads_path, "data", "d.bam"), "w") as fh:
+        fh.write("d")
+    update_manifest(DataSet.from_path(reads_path))
+    shutil.rmtree(os.path.join(tmp_dir_fixture, "sub"))
+    create_dataset(os.path.join(tmp_dir_fixture, "new"), {"e.bam": "e"},
+                   readme="", name="new", update=update_manifest)
+
+    with Catalog(tmp_dir_fixture) as catalog:
+        result = catalog.refresh()
+        assert result == dict(
+            added=["new"],
+            updated=["reads"],
+            removed=[os.path.join("sub", "more_reads")],
+            unchanged=[])
+        paths = [item["path"] for item in catalog.query(suffix=".bam")]
+        assert paths == ["e.bam", "a.BAM", "b.bam", "d.bam"]
+        count = catalog.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+        assert count == 5
+
+        result = catalog.refresh()
+        assert result["unchanged"] == ["new", "reads"]
+
+
+def test_catalog_refresh_inherited_metadata(tmp_dir_fixture):  # NOQA
+    from dtool.catalog import Catalog
+    from dtool.metadata import DescriptiveMetadata
+    from dtool.project import Project
+
+    Project("my_project").persist_to_path(tmp_dir_fixture)
+    _create_project(tmp_dir_fixture)
+    with Catalog(tmp_dir_fixture) as catalog:
+        catalog.refresh()
+        items = list(catalog.query(metadata={"project_name": "my_project"}))
+        assert len(items) == 3
+
+    # Editing the project README changes the metadata of the dataset
+    # directly below it; sub is not a dtool object, so more_reads does not
+    # inherit from the project.
+    DescriptiveMetadata([("project_name", "renamed")]).persist_to_path(
+        tmp_dir_fixture)
+    with Catalog(tmp_dir_fixture) as catalog:
+        result = catalog.refresh()
+        assert result["updated"] == ["reads"]
+        assert result["unchanged"] == [os.path.join("sub", "more_reads")]
+        assert not list(catalog.query(metadata={"project_name": "my_project"}))
+        items = list(catalog.query(metadata={"project_name": "renamed"}))
+        assert len(items) == 3
+        assert catalog.refresh()["updated"] == []
+
+
+def test_catalog_query_template_fields(tmp_dir_fixture):  # NOQA
+    from dtool.catalog import Catalog
+    from dtool.cli import README_SCHEMA
+    from dtool.manifest import update_manifest
+    from dtool.metadata import DescriptiveMetadata
+
+    path = os.path.join(tmp_dir_fixture, "ds")
+    create_dataset(path, {"a.txt": "a"}, update=update_manifest)
+    metadata = DescriptiveMetadata(README_SCHEMA)
+    metadata.update(dict(date="2017-06-13"))
+    metadata.persist_to_path(path, template="dtool_dataset_README.yml")
+
+    with Catalog(tmp_dir_fixture) as catalog:
+        catalog.refresh()
+        for key, value in [("creation_date", "2017-06-13"),
+                           ("confidential", "False"),
+                           ("confidential", False),
+                           ("project_name", "project_name")]:
+            items = list(catalog.query(metadata={key: value}))
+            assert [item["path"] for item in items] == ["a.txt"]
+        assert not list(catalog.query(metadata={"confidential": "True"}))
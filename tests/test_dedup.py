@@ -0,0 +1,100 @@
+"""Tests for the dtool dedup module."""
+
+import os
+
+from . import create_dataset, tmp_dir_fixture  # NOQA
+
+
+def _backdate(dataset):
+    """Give the files the same mtime, as if copied with their times
+    preserved."""
+    from dtool.manifest import update_manifest
+    data_dir = os.path.join(dataset._abs_path, "data")
+    for fn in os.listdir(data_dir):
+        os.utime(os.path.join(data_dir, fn), (1500000000, 1500000000))
+    update_manifest(dataset)
+
+
+def _create_project(root):
+    for rel_path, files in [
+            ("ds1", {"big.txt": "x" * 100, "small.txt": "y",
+                     "unique.txt": "1"}),
+            ("ds2", {"big_copy.txt": "x" * 100, "unique.txt": "2"}),
+            (os.path.join("sub", "ds3"), {"big.txt": "x" * 100,
+                                          "small.txt": "y"})]:
+        path = os.path.join(root, rel_path)
+        create_dataset(path, files, name=os.path.basename(path),
+                       update=_backdate)
+
+
+def test_duplicate_groups(tmp_dir_fixture):  # NOQA
+    from dtool.dedup import build_duplicate_index
+
+    _create_project(tmp_dir_fixture)
+    db_path = os.path.join(tmp_dir_fixture, "dedup.sqlite")
+    with build_duplicate_index(tmp_dir_fixture, db_path) as index:
+        groups = list(index.groups())
+        assert [g["reclaimable"] for g in groups] == [200, 1]
+        assert groups[0]["size"] == 100
+        assert groups[0]["paths"] == [
+            os.path.join(tmp_dir_fixture, "ds1", "data", "big.txt"),
+            os.path.join(tmp_dir_fixture, "ds2", "data", "big_copy.txt"),
+            os.path.join(tmp_dir_fixture, "sub", "ds3", "data", "big.txt")]
+
+        assert len(list(index.groups(min_size=2))) == 1
+
+
+def test_hardlink_group(tmp_dir_fixture):  # NOQA
+    from dtool.dedup import build_duplicate_index, hardlink_group
+
+    _create_project(tmp_dir_fixture)
+    db_path = os.path.join(tmp_dir_fixture, "dedup.sqlite")
+    with build_duplicate_index(tmp_dir_fixture, db_path) as index:
+        group = next(index.groups())
+
+        # Files changed since their manifest was written are left alone.
+        with open(group["paths"][2], "w") as fh:
+            fh.write("z" * 100)
+
+        assert hardlink_group(group, index) == (1, 100, [])
+        stat_results = [os.stat(p) for p in group["paths"]]
+        assert stat_results[0].st_ino == stat_results[1].st_ino
+        assert stat_results[0].st_ino != stat_results[2].st_ino
+
+        # Files that are already linked are not linked again.
+        assert hardlink_group(group, index) == (0, 0, [])
+
+
+def test_hardlink_group_mtime_and_mode(tmp_dir_fixture):  # NOQA
+    from dtool.dedup import build_duplicate_index, hardlink_group
+    from dtool.manifest import update_manifest
+    from dtoolcore import DataSet
+
+    _create_project(tmp_dir_fixture)
+    ds2_path = os.path.join(tmp_dir_fixture, "ds2")
+    os.utime(os.path.join(ds2_path, "data", "big_copy.txt"), (1, 1))
+    os.chmod(os.path.join(tmp_dir_fixture, "sub", "ds3", "data", "big.txt"),
+             0o600)
+    update_manifest(DataSet.from_path(ds2_path))
+
+    db_path = os.path.join(tmp_dir_fixture, "dedup.sqlite")
+    with build_duplicate_index(tmp_dir_fixture, db_path) as index:
+        group = next(index.groups())
+        # Linking would change the mtime or mode of these files.
+        assert hardlink_group(group, index) == (0, 0, [])
+
+
+def test_hardlink_group_error(tmp_dir_fixture, mocker):  # NOQA
+    from dtool.dedup import build_duplicate_index, hardlink_group
+
+    _create_project(tmp_dir_fixture)
+    db_path = os.path.join(tmp_dir_fixture, "dedup.sqlite")
+    with build_duplicate_index(tmp_dir_fixture, db_path) as index:
+        group = next(index.groups())
+        mocker.patch("os.rename", side_effect=OSError(30, "Read-only"))
+        num_linked, reclaimed, errors = hardlink_group(group, index)
+        assert (num_linked, reclaimed) == (0, 0)
+        assert errors == [(group["paths"][1], "Read-only"),
+                          (group["paths"][2], "Read-only")]
+        data_dir = os.path.dirname(group["paths"][1])
+        assert sorted(os.listdir(data_dir)) == ["big_copy.txt", "unique.txt"]
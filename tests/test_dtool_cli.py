@@ -1,20 +1,19 @@
 """Tests for the dtool cli."""
 
-from distutils.dir_util import copy_tree
 import os
 import subprocess
 import shutil
 import json
 
+import pytest
 import yaml
 
-from . import tmp_dir_fixture  # NOQA
+from dtool.watch import inotify_available
+
+from . import TEST_INPUT_DATA, create_dataset, tmp_dir_fixture  # NOQA
 from . import chdir_fixture  # NOQA
 from . import remember_cwd
 
-HERE = os.path.dirname(__file__)
-TEST_INPUT_DATA = os.path.join(HERE, "data", "mimetype", "input", "archive")
-
 
 def test_version():
 
@@ -149,11 +148,7 @@ def test_new_dataset_in_project(chdir_fixture):  # NOQA
 def test_manifest_update(tmp_dir_fixture):  # NOQA
 
     from dtoolcore import DataSet
-    dataset = DataSet("test_dataset", "data")
-    dataset.persist_to_path(tmp_dir_fixture)
-
-    data_dir = os.path.join(tmp_dir_fixture, "data")
-    copy_tree(TEST_INPUT_DATA, data_dir)
+    create_dataset(tmp_dir_fixture)
 
     cmd = ["dtool", "manifest", "update", tmp_dir_fixture]
     subprocess.call(cmd)
@@ -175,6 +170,104 @@ def test_manifest_update(tmp_dir_fixture):  # NOQA
     assert overlays["mimetype"][identifier] == "image/png"
 
 
+def test_manifest_update_overlays(tmp_dir_fixture):  # NOQA
+    from click.testing import CliRunner
+    from dtool.cli import update
+    from dtoolcore import DataSet
+
+    create_dataset(tmp_dir_fixture)
+
+    runner = CliRunner()
+    result = runner.invoke(
+        update, ["--overlay", "nosuchoverlay", tmp_dir_fixture])
+    assert result.exit_code != 0
+    assert "Unknown overlay: nosuchoverlay" in result.output
+
+    result = runner.invoke(
+        update,
+        ["--overlay", "size_in_bytes", "--overlay", "image_dimensions",
+         tmp_dir_fixture])
+    assert result.exit_code == 0
+    overlays = DataSet.from_path(tmp_dir_fixture).access_overlays()
+    identifier = "09648d19e11f0b20e5473594fc278afbede3c9a4"
+    assert overlays["image_dimensions"][identifier] == [5, 5]
+    assert len(overlays["size_in_bytes"]) == 6
+
+
+def test_manifest_update_extra_hash(tmp_dir_fixture):  # NOQA
+    from click.testing import CliRunner
+    from dtool.cli import update
+    from dtoolcore import DataSet
+
+    create_dataset(tmp_dir_fixture)
+
+    runner = CliRunner()
+    result = runner.invoke(
+        update, ["--extra-hash", "nosuchhash", tmp_dir_fixture])
+    assert result.exit_code == 2
+    assert "invalid choice: nosuchhash" in result.output
+
+    result = runner.invoke(
+        update, ["--extra-hash", "md5sum", tmp_dir_fixture])
+    assert result.exit_code == 0
+    overlays = DataSet.from_path(tmp_dir_fixture).access_overlays()
+    assert len(overlays["md5sum"]) == 6
+
+
+def test_manifest_update_with_workers(tmp_dir_fixture):  # NOQA
+
+    from dtoolcore import DataSet
+    create_dataset(tmp_dir_fixture)
+
+    cmd = ["dtool", "manifest", "update", "--workers", "2", tmp_dir_fixture]
+    subprocess.check_call(cmd)
+
+    ds = DataSet.from_path(tmp_dir_fixture)
+    assert len(ds.manifest["file_list"]) == 6
+    identifier = "09648d19e11f0b20e5473594fc278afbede3c9a4"
+    assert identifier in ds.identifiers
+
+    overlays = ds.access_overlays()
+    assert overlays["mimetype"][identifier] == "image/png"
+
+
+def test_manifest_update_max_files(tmp_dir_fixture):  # NOQA
+    from click.testing import CliRunner
+    from dtool.cli import update
+    from dtoolcore import DataSet
+
+    create_dataset(tmp_dir_fixture)
+
+    runner = CliRunner()
+
+    result = runner.invoke(
+        update, ["--max-files", "5", tmp_dir_fixture])
+    assert result.exit_code != 0
+    assert "more than 5 files" in result.output
+    assert len(DataSet.from_path(tmp_dir_fixture).identifiers) == 0
+
+    result = runner.invoke(
+        update, ["--warn-files", "5", tmp_dir_fixture])
+    assert result.exit_code == 0
+    assert "Found 6 files" in result.output
+    assert "Warning" in result.output
+    assert len(DataSet.from_path(tmp_dir_fixture).identifiers) == 6
+
+
+def test_manifest_stats(tmp_dir_fixture):  # NOQA
+    from click.testing import CliRunner
+    from dtool.cli import stats
+
+    create_dataset(tmp_dir_fixture)
+
+    runner = CliRunner()
+    result = runner.invoke(stats, [tmp_dir_fixture])
+    assert result.exit_code == 0
+    assert "Number of files: 6" in result.output
+    assert "Estimated hashing time" in result.output
+    assert "Warning" not in result.output
+
+
 def test_markup(tmp_dir_fixture):  # NOQA
     from click.testing import CliRunner
     from dtool.cli import markup
@@ -321,3 +414,254 @@ def test_markup_inherits_parent_metadata(tmp_dir_fixture):  # NOQA
     dataset = DataSet.from_path(existing_data_dir)
 
     assert dataset.descriptive_metadata["project_name"] == "test_inheritance"
+
+
+def test_manifest_verify(tmp_dir_fixture):  # NOQA
+    from click.testing import CliRunner
+    from dtool.cli import verify
+    from dtoolcore import DataSet
+
+    create_dataset(tmp_dir_fixture, update=DataSet.update_manifest)
+
+    runner = CliRunner()
+
+    result = runner.invoke(verify, ["--workers", "2", tmp_dir_fixture])
+    assert result.exit_code == 0
+    assert "Dataset matches manifest" in result.output
+
+    os.unlink(os.path.join(tmp_dir_fixture, "data", "tiny.png"))
+    result = runner.invoke(
+        verify, ["--mode", "quick", "--format", "json", tmp_dir_fixture])
+    assert result.exit_code == 1
+    assert json.loads(result.output) == dict(
+        missing=["tiny.png"], changed=[], extra=[])
+
+
+def test_pack(tmp_dir_fixture):  # NOQA
+    from click.testing import CliRunner
+    from dtool.cli import pack
+    from dtoolcore import DataSet
+
+    create_dataset(tmp_dir_fixture, update=DataSet.update_manifest)
+
+    runner = CliRunner()
+    result = runner.invoke(pack, ["--threshold", "1", tmp_dir_fixture])
+    assert result.exit_code == 0
+    assert "Packed 5 files into 1 shards" in result.output
+
+    file_list = DataSet.from_path(tmp_dir_fixture).manifest["file_list"]
+    assert len(file_list) == 6
+    assert len([entry for entry in file_list if "shard" in entry]) == 5
+
+
+def test_project_dedup(tmp_dir_fixture):  # NOQA
+    from click.testing import CliRunner
+    from dtool.cli import dedup
+    from dtoolcore import DataSet
+
+    for name in ["ds1", "ds2"]:
+        dataset_dir = os.path.join(tmp_dir_fixture, name)
+        create_dataset(dataset_dir, name=name, update=DataSet.update_manifest)
+
+    runner = CliRunner()
+    result = runner.invoke(
+        dedup, ["--format", "jsonl", "--limit", "1", tmp_dir_fixture])
+    assert result.exit_code == 0
+    group = json.loads(result.output)
+    assert group["reclaimable"] == 1024
+    assert [os.path.basename(p) for p in group["paths"]] == [
+        "random_bytes", "random_bytes"]
+
+    result = runner.invoke(dedup, [tmp_dir_fixture])
+    assert result.exit_code == 0
+    assert "Reclaimable:" in result.output
+
+
+def test_catalog(tmp_dir_fixture):  # NOQA
+    from click.testing import CliRunner
+    from dtool.cli import build, query, refresh
+    from dtoolcore import DataSet
+
+    dataset_dir = os.path.join(tmp_dir_fixture, "ds")
+    create_dataset(dataset_dir, name="ds", update=DataSet.update_manifest)
+
+    runner = CliRunner()
+    result = runner.invoke(query, [tmp_dir_fixture])
+    assert result.exit_code != 0
+    assert "No catalog" in result.output
+
+    result = runner.invoke(build, [tmp_dir_fixture])
+    assert result.exit_code == 0
+    assert "Catalogued 1 datasets: 1 added" in result.output
+
+    result = runner.invoke(refresh, [tmp_dir_fixture])
+    assert result.exit_code == 0
+    assert "0 added, 0 updated, 0 removed" in result.output
+
+    result = runner.invoke(query, [
+        "--suffix", ".png", "--format", "jsonl", tmp_dir_fixture])
+    assert result.exit_code == 0
+    items = [json.loads(line) for line in result.output.splitlines()]
+    assert [item["path"] for item in items] == ["tiny.png"]
+
+    result = runner.invoke(
+        query, ["--metadata", "dataset_name", tmp_dir_fixture])
+    assert result.exit_code != 0
+
+
+@pytest.mark.skipif(
+    not inotify_available(),
+    reason="inotify is not available")
+def test_manifest_watch(tmp_dir_fixture):  # NOQA
+    from click.testing import CliRunner
+    from dtool.cli import watch
+    from dtoolcore import DataSet
+
+    create_dataset(tmp_dir_fixture)
+
+    runner = CliRunner()
+    result = runner.invoke(watch, ["--duration", "0.1", tmp_dir_fixture])
+    assert result.exit_code == 0
+    assert "Updated manifest" in result.output
+    assert len(DataSet.from_path(tmp_dir_fixture).manifest["file_list"]) == 6
+
+
+def test_manifest_shard_and_merge(tmp_dir_fixture):  # NOQA
+    from click.testing import CliRunner
+    from dtool.cli import merge, shard
+    from dtoolcore import DataSet
+
+    create_dataset(tmp_dir_fixture)
+
+    runner = CliRunner()
+    result = runner.invoke(
+        shard, ["--index", "0", "--of", "2", tmp_dir_fixture])
+    assert result.exit_code == 0
+
+    result = runner.invoke(merge, ["--of", "2", tmp_dir_fixture])
+    assert result.exit_code != 0
+    assert "Missing shards: 1" in result.output
+
+    result = runner.invoke(
+        shard, ["--of", "2", tmp_dir_fixture],
+        env={"SLURM_ARRAY_TASK_ID": "1"})
+    assert result.exit_code == 0
+
+    result = runner.invoke(merge, ["--of", "2", tmp_dir_fixture])
+    assert result.exit_code == 0
+    assert "manifest of 6 files" in result.output
+    assert len(DataSet.from_path(tmp_dir_fixture).manifest["file_list"]) == 6
+
+
+def test_copy(tmp_dir_fixture):  # NOQA
+    from click.testing import CliRunner
+    from dtool.cli import copy
+    from dtoolcore import DataSet
+
+    src = os.path.join(tmp_dir_fixture, "src")
+    dataset = create_dataset(src, update=DataSet.update_manifest)
+
+    dest = os.path.join(tmp_dir_fixture, "dest")
+    runner = CliRunner()
+    result = runner.invoke(copy, [src, dest])
+    assert result.exit_code == 0
+    assert "Copied and verified 6 files" in result.output
+    assert DataSet.from_path(dest).uuid == dataset.uuid
+
+    result = runner.invoke(copy, [src, dest])
+    assert result.exit_code != 0
+    assert "Already exists" in result.output
+
+
+def test_snapshot(tmp_dir_fixture):  # NOQA
+    from click.testing import CliRunner
+    from dtool.cli import snapshot
+    from dtoolcore import DataSet
+
+    src = os.path.join(tmp_dir_fixture, "src")
+    dataset = create_dataset(src, update=DataSet.update_manifest)
+
+    dest = os.path.join(tmp_dir_fixture, "snapshot")
+    runner = CliRunner()
+    result = runner.invoke(snapshot, [src, dest, "--writable"])
+    assert result.exit_code == 0
+    snapshot_uuid = DataSet.from_path(dest).uuid
+    assert snapshot_uuid != dataset.uuid
+    assert snapshot_uuid in result.output
+
+    result = runner.invoke(snapshot, [src, dest])
+    assert result.exit_code != 0
+    assert "Already exists" in result.output
+
+
+def _python(code):
+    """Return output of running code in a fresh Python interpreter."""
+    import sys
+    env = dict((k, v) for k, v in os.environ.items()
+               if not k.startswith("COV_CORE"))
+    output = subprocess.check_output([sys.executable, "-c", code], env=env)
+    return output.decode("utf8")
+
+
+def test_cli_import_is_lazy():
+    # Starting dtool only imports the modules needed to define the
+    # commands, rather than timing the import, which depends on the machine.
+    code = "import sys, dtool.cli; print(' '.join(sys.modules))"
+    modules = _python(code).split()
+    for name in ["dtoolcore", "jinja2", "yaml", "puremagic", "binaryornot",
+                 "multiprocessing", "sqlite3", "hashlib", "tarfile"]:
+        assert name not in modules
+    assert sorted(m for m in modules if m.startswith("dtool")) == [
+        "dtool", "dtool.cli"]
+
+
+def test_cli_defaults_match_modules():
+    from dtool.cli import update
+    from dtool.stats import DEFAULT_WARN_FILES
+
+    warn_files = [param for param in update.params
+                  if param.name == "warn_files"][0]
+    assert warn_files.default == DEFAULT_WARN_FILES
+
+
+def test_info_recursive(tmp_dir_fixture):  # NOQA
+    from click.testing import CliRunner
+    from dtool.cli import info
+    from dtoolcore import DataSet
+
+    dataset_dir = os.path.join(tmp_dir_fixture, "ds")
+    os.mkdir(dataset_dir)
+    DataSet("ds").persist_to_path(dataset_dir)
+
+    runner = CliRunner()
+    result = runner.invoke(
+        info, ["--recursive", "--format", "jsonl", tmp_dir_fixture])
+    assert result.exit_code == 0
+    lines = [json.loads(line) for line in result.output.splitlines()]
+    assert [line["type"] for line in lines] == ["unmanaged", "dataset"]
+    assert lines[1]["name"] == "ds"
+
+    result = runner.invoke(info, ["--recursive", tmp_dir_fixture])
+    assert result.exit_code == 0
+    assert "dataset: 1" in result.output
+
+
+def test_batch_markup(tmp_dir_fixture):  # NOQA
+    from click.testing import CliRunner
+    from dtool.cli import batch_markup
+    from dtoolcore import DataSet
+
+    run_dir = os.path.join(tmp_dir_fixture, "run1")
+    os.mkdir(run_dir)
+    metadata_file = os.path.join(tmp_dir_fixture, "metadata.yml")
+    with open(metadata_file, "w") as fh:
+        fh.write("defaults:\n  project_name: sequencing\n")
+
+    runner = CliRunner()
+    result = runner.invoke(
+        batch_markup,
+        ["--format", "jsonl", metadata_file, run_dir, run_dir + "_missing"])
+    assert result.exit_code == 1
+    lines = [json.loads(line) for line in result.output.splitlines()]
+    assert [line["status"] for line in lines] == ["ok", "error"]
+    assert DataSet.from_path(run_dir).name == "run1"
@@ -0,0 +1,38 @@
+"""Tests for the dtool hashing module."""
+
+import hashlib
+
+import pytest
+
+
+def test_multi_hasher():
+    from dtool.hashing import MultiHasher
+
+    hasher = MultiHasher(["shasum", "md5sum"])
+    hasher.update(b"hello ")
+    hasher.update(b"world")
+    assert hasher.hexdigests() == dict(
+        shasum=hashlib.sha1(b"hello world").hexdigest(),
+        md5sum=hashlib.md5(b"hello world").hexdigest())
+
+
+def test_register_hash_function():
+    from dtool.hashing import (
+        get_hash_function,
+        hash_function_names,
+        register_hash_function,
+    )
+
+    with pytest.raises(ValueError):
+        get_hash_function("sha512sum")
+    register_hash_function("sha512sum", hashlib.sha512)
+    assert "sha512sum" in hash_function_names()
+    assert get_hash_function("sha512sum") is hashlib.sha512
+
+
+def test_benchmark():
+    from dtool.hashing import benchmark
+
+    throughputs = benchmark(["shasum", "md5sum"], size=2**16)
+    assert sorted(throughputs) == ["md5sum", "shasum"]
+    assert all(value > 0 for value in throughputs.values())
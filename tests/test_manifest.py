@@ -0,0 +1,417 @@
+"""Tests for the dtool manifest module."""
+
+import os
+import shutil
+
+from . import TEST_INPUT_DATA, create_dataset, tmp_dir_fixture  # NOQA
+
+
+def _sorted_manifest(manifest):
+    manifest = dict(manifest)
+    manifest["file_list"] = sorted(
+        manifest["file_list"], key=lambda entry: entry["path"])
+    return manifest
+
+
+def test_generate_file_list_and_overlays(tmp_dir_fixture):  # NOQA
+    from dtool.manifest import generate_file_list_and_overlays
+
+    dataset = create_dataset(tmp_dir_fixture)
+    manifest = dataset._structural_metadata
+
+    serial = generate_file_list_and_overlays(manifest, workers=1)
+    parallel = generate_file_list_and_overlays(manifest, workers=3)
+
+    file_list, overlays = serial
+    assert len(file_list) == 6
+    assert parallel == serial
+
+    mimetypes = overlays["mimetype"]
+    assert len(mimetypes) == 6
+    hashes = dict((entry["path"], entry["hash"]) for entry in file_list)
+    assert mimetypes[hashes["tiny.png"]] == "image/png"
+    assert mimetypes[hashes["actually_a_png.txt"]] == "image/png"
+    assert mimetypes[hashes["real_text_file.txt"]] == "text/plain"
+    assert mimetypes[hashes["empty_file"]] == "inode/x-empty"
+
+
+def test_update_manifest(tmp_dir_fixture):  # NOQA
+    from dtoolcore import DataSet
+    from dtool.manifest import update_manifest
+
+    dataset = create_dataset(tmp_dir_fixture)
+    update_manifest(dataset, workers=2)
+    parallel_manifest = DataSet.from_path(tmp_dir_fixture).manifest
+
+    dataset.update_manifest()
+    serial_manifest = DataSet.from_path(tmp_dir_fixture).manifest
+
+    assert parallel_manifest == _sorted_manifest(serial_manifest)
+
+
+def test_update_manifest_pipelined(tmp_dir_fixture):  # NOQA
+    from dtoolcore import DataSet
+    from dtool.manifest import update_manifest
+
+    dataset = create_dataset(tmp_dir_fixture)
+    update_manifest(dataset)
+    manifest = DataSet.from_path(tmp_dir_fixture).manifest
+    overlays = DataSet.from_path(tmp_dir_fixture).access_overlays()
+
+    update_manifest(dataset, workers=2, readers=3, read_size=4096)
+    assert DataSet.from_path(tmp_dir_fixture).manifest == manifest
+    assert DataSet.from_path(tmp_dir_fixture).access_overlays() == overlays
+
+
+def test_update_manifest_not_persisted():
+    from dtoolcore import DataSet
+    from dtool.manifest import update_manifest
+
+    dataset = DataSet("not_persisted")
+    update_manifest(dataset, workers=2)
+    assert dataset.manifest == {}
+
+
+def _backdate_files(path):
+    for dirpath, dirnames, filenames in os.walk(path):
+        for fn in filenames:
+            os.utime(os.path.join(dirpath, fn), (1000000000, 1000000000))
+
+
+def test_update_manifest_incremental(tmp_dir_fixture, mocker):  # NOQA
+    from dtoolcore import DataSet
+    import dtool.manifest
+    from dtool.manifest import update_manifest
+
+    dataset = create_dataset(tmp_dir_fixture)
+    data_dir = os.path.join(tmp_dir_fixture, "data")
+    _backdate_files(data_dir)
+    update_manifest(dataset)
+
+    # Add one file, change one file and delete one file.
+    with open(os.path.join(data_dir, "new_file.txt"), "w") as fh:
+        fh.write("new")
+    with open(os.path.join(data_dir, "real_text_file.txt"), "a") as fh:
+        fh.write("changed")
+    os.unlink(os.path.join(data_dir, "random_bytes"))
+
+    spy = mocker.spy(dtool.manifest, "_file_metadata")
+    dataset = DataSet.from_path(tmp_dir_fixture)
+    update_manifest(dataset, incremental=True)
+
+    hashed = sorted(call[0][0][2] for call in spy.call_args_list)
+    assert hashed == ["new_file.txt", "real_text_file.txt"]
+
+    incremental_dataset = DataSet.from_path(tmp_dir_fixture)
+    incremental_manifest = incremental_dataset.manifest
+    paths = [entry["path"] for entry in incremental_manifest["file_list"]]
+    assert "random_bytes" not in paths
+    assert len(paths) == 6
+    mimetypes = incremental_dataset.access_overlays()["mimetype"]
+    assert sorted(mimetypes.keys()) == sorted(incremental_dataset.identifiers)
+
+    dataset.update_manifest()
+    full_manifest = DataSet.from_path(tmp_dir_fixture).manifest
+    assert incremental_manifest == _sorted_manifest(full_manifest)
+
+
+def test_update_manifest_incremental_racy_files(tmp_dir_fixture, mocker):  # NOQA
+    from dtoolcore import DataSet
+    import dtool.manifest
+    from dtool.manifest import update_manifest
+
+    dataset = create_dataset(tmp_dir_fixture)
+
+    # Files modified after the manifest was written could have changed
+    # without their size and mtime changing.
+    future = os.stat(dataset._abs_manifest_path).st_mtime + 3600
+    data_dir = os.path.join(tmp_dir_fixture, "data")
+    for fn in os.listdir(data_dir):
+        os.utime(os.path.join(data_dir, fn), (future, future))
+    update_manifest(dataset)
+
+    spy = mocker.spy(dtool.manifest, "_file_metadata")
+    update_manifest(DataSet.from_path(tmp_dir_fixture), incremental=True)
+    assert spy.call_count == 6
+
+
+def test_update_manifest_incremental_replaced_files(tmp_dir_fixture, mocker):  # NOQA
+    import shutil
+    from dtoolcore import DataSet
+    import dtool.manifest
+    from dtool.manifest import update_manifest
+
+    dataset = create_dataset(tmp_dir_fixture)
+    data_dir = os.path.join(tmp_dir_fixture, "data")
+    _backdate_files(data_dir)
+    update_manifest(dataset)
+    before = dict((entry["path"], entry) for entry in
+                  DataSet.from_path(tmp_dir_fixture).manifest["file_list"])
+    assert "inode" not in before["tiny.png"]
+
+    # Replace one file, as rsync -t would, and overwrite another in place,
+    # as cp -p would, keeping their sizes and mtimes.
+    for fn in ["tiny.png", "real_text_file.txt"]:
+        fpath = os.path.join(data_dir, fn)
+        stat_result = os.stat(fpath)
+        content = b"x" * stat_result.st_size
+        if fn == "tiny.png":
+            os.rename(fpath, fpath + ".old")
+        with open(fpath, "wb") as fh:
+            fh.write(content)
+        os.utime(fpath, (stat_result.st_atime, stat_result.st_mtime))
+    shutil.move(os.path.join(data_dir, "tiny.png.old"), tmp_dir_fixture)
+
+    spy = mocker.spy(dtool.manifest, "_file_metadata")
+    update_manifest(DataSet.from_path(tmp_dir_fixture), incremental=True)
+    hashed = sorted(call[0][0][2] for call in spy.call_args_list)
+    assert hashed == ["real_text_file.txt", "tiny.png"]
+    after = dict((entry["path"], entry) for entry in
+                 DataSet.from_path(tmp_dir_fixture).manifest["file_list"])
+    assert after["tiny.png"]["hash"] != before["tiny.png"]["hash"]
+
+    spy.reset_mock()
+    update_manifest(DataSet.from_path(tmp_dir_fixture), incremental=True)
+    assert spy.call_count == 0
+
+
+def test_persist_dataset(tmp_dir_fixture):  # NOQA
+    from dtoolcore import DataSet
+    from dtool.manifest import persist_dataset
+
+    shutil.copytree(TEST_INPUT_DATA, os.path.join(tmp_dir_fixture, "data"))
+
+    dataset = DataSet("test_dataset", "data")
+    persist_dataset(dataset, tmp_dir_fixture, workers=2)
+
+    dataset = DataSet.from_path(tmp_dir_fixture)
+    assert dataset.name == "test_dataset"
+    assert len(dataset.identifiers) == 6
+
+    overlays = dataset.access_overlays()
+    identifier = "09648d19e11f0b20e5473594fc278afbede3c9a4"
+    assert overlays["mimetype"][identifier] == "image/png"
+
+    reference_path = os.path.join(tmp_dir_fixture, "reference")
+    shutil.copytree(TEST_INPUT_DATA, reference_path)
+    reference = DataSet("reference")
+    reference.persist_to_path(reference_path)
+    reference_manifest = _sorted_manifest(reference.manifest)
+    assert dataset.manifest["file_list"] == reference_manifest["file_list"]
+
+
+def test_update_manifest_with_dtoolignore(tmp_dir_fixture):  # NOQA
+    from dtoolcore import DataSet
+    from dtool.manifest import update_manifest
+
+    dataset = create_dataset(tmp_dir_fixture)
+    scratch_dir = os.path.join(tmp_dir_fixture, "data", "scratch")
+    os.mkdir(scratch_dir)
+    with open(os.path.join(scratch_dir, "big.bin"), "w") as fh:
+        fh.write("scratch")
+    with open(os.path.join(tmp_dir_fixture, "data", ".DS_Store"), "w") as fh:
+        fh.write("junk")
+    with open(os.path.join(tmp_dir_fixture, ".dtoolignore"), "w") as fh:
+        fh.write(".DS_Store\nscratch/\n")
+
+    update_manifest(dataset)
+
+    file_list = DataSet.from_path(tmp_dir_fixture).manifest["file_list"]
+    paths = sorted(entry["path"] for entry in file_list)
+    assert paths == sorted(os.listdir(TEST_INPUT_DATA))
+
+
+def test_update_manifest_resume(tmp_dir_fixture, mocker):  # NOQA
+    import pytest
+    from dtoolcore import DataSet
+    import dtool.manifest
+    from dtool.manifest import update_manifest, JOURNAL_NAME
+
+    dataset = create_dataset(tmp_dir_fixture)
+    _backdate_files(os.path.join(tmp_dir_fixture, "data"))
+    journal_path = os.path.join(tmp_dir_fixture, ".dtool", JOURNAL_NAME)
+
+    # Interrupt the update after three files have been hashed.
+    file_metadata = dtool.manifest._file_metadata
+    calls = []
+
+    def interrupted_file_metadata(task, overlay_cache=None):
+        if len(calls) == 3:
+            raise KeyboardInterrupt()
+        calls.append(task[2])
+        return file_metadata(task, overlay_cache)
+
+    mocker.patch(
+        "dtool.manifest._file_metadata",
+        side_effect=interrupted_file_metadata)
+    with pytest.raises(KeyboardInterrupt):
+        update_manifest(dataset)
+
+    # The manifest is untouched and the journal has the hashed files.
+    assert DataSet.from_path(tmp_dir_fixture).manifest["file_list"] == []
+    with open(journal_path) as fh:
+        assert len(fh.readlines()) == 3
+
+    # Resuming only hashes the remaining files.
+    calls[:] = []
+    mocker.patch(
+        "dtool.manifest._file_metadata",
+        side_effect=file_metadata)
+    dataset = DataSet.from_path(tmp_dir_fixture)
+    update_manifest(dataset, resume=True)
+    assert dtool.manifest._file_metadata.call_count == 3
+    assert not os.path.isfile(journal_path)
+
+    resumed_manifest = DataSet.from_path(tmp_dir_fixture).manifest
+    dataset.update_manifest()
+    full_manifest = DataSet.from_path(tmp_dir_fixture).manifest
+    assert resumed_manifest == _sorted_manifest(full_manifest)
+
+
+def test_update_manifest_small_buffer(tmp_dir_fixture):  # NOQA
+    from dtoolcore import DataSet
+    from dtool.manifest import update_manifest
+
+    dataset = create_dataset(tmp_dir_fixture)
+    update_manifest(dataset, workers=2)
+    with open(dataset._abs_manifest_path) as fh:
+        in_memory = fh.read()
+    in_memory_overlays = DataSet.from_path(tmp_dir_fixture).access_overlays()
+
+    # A buffer of two items makes the writer merge several sorted runs.
+    update_manifest(dataset, workers=2, buffer_size=2)
+    with open(dataset._abs_manifest_path) as fh:
+        assert fh.read() == in_memory
+
+    dataset = DataSet.from_path(tmp_dir_fixture)
+    paths = [entry["path"] for entry in dataset.manifest["file_list"]]
+    assert paths == sorted(paths)
+    assert dataset.access_overlays() == in_memory_overlays
+
+    # Only the manifest, overlays and admin metadata are left behind.
+    dtool_dir = os.path.join(tmp_dir_fixture, ".dtool")
+    assert sorted(os.listdir(dtool_dir)) == [
+        "dtool", "manifest.json", "manifest_stat.json", "overlays"]
+
+
+def test_manifest_writer_empty(tmp_dir_fixture):  # NOQA
+    import json
+    from dtool.manifest import ManifestWriter
+
+    manifest_path = os.path.join(tmp_dir_fixture, "manifest.json")
+    overlay_path = os.path.join(tmp_dir_fixture, "mimetype.json")
+    header = {"hash_function": "shasum"}
+    with ManifestWriter(
+            manifest_path,
+            {"mimetype": overlay_path},
+            header,
+            tmp_dir_fixture) as writer:
+        writer.write()
+
+    with open(manifest_path) as fh:
+        assert json.load(fh) == {"hash_function": "shasum", "file_list": []}
+    with open(overlay_path) as fh:
+        assert json.load(fh) == {}
+    assert sorted(os.listdir(tmp_dir_fixture)) == [
+        "manifest.json", "mimetype.json"]
+
+
+def test_update_manifest_extra_hashes(tmp_dir_fixture, mocker):  # NOQA
+    import hashlib
+    import pytest
+    from dtoolcore import DataSet
+    import dtool.manifest
+    from dtool.manifest import update_manifest
+
+    dataset = create_dataset(tmp_dir_fixture)
+    _backdate_files(os.path.join(tmp_dir_fixture, "data"))
+
+    with pytest.raises(ValueError):
+        update_manifest(dataset, extra_hashes=["nosuchsum"])
+
+    update_manifest(dataset, extra_hashes=["md5sum"])
+    dataset = DataSet.from_path(tmp_dir_fixture)
+    md5sums = dataset.access_overlays()["md5sum"]
+    assert len(md5sums) == 6
+    for entry in dataset.manifest["file_list"]:
+        fpath = os.path.join(tmp_dir_fixture, "data", entry["path"])
+        with open(fpath, "rb") as fh:
+            expected = hashlib.md5(fh.read()).hexdigest()
+        assert md5sums[entry["hash"]] == expected
+
+    # The md5sum overlay is kept up to date by later updates, and reused
+    # for unchanged files.
+    with open(os.path.join(tmp_dir_fixture, "data", "new.txt"), "w") as fh:
+        fh.write("new")
+    spy = mocker.spy(dtool.manifest, "_file_metadata")
+    update_manifest(dataset, incremental=True)
+    assert [call[0][0][2] for call in spy.call_args_list] == ["new.txt"]
+    md5sums = DataSet.from_path(tmp_dir_fixture).access_overlays()["md5sum"]
+    assert len(md5sums) == 7
+    assert hashlib.md5(b"new").hexdigest() in md5sums.values()
+
+
+def test_update_manifest_overlay_functions(tmp_dir_fixture):  # NOQA
+    import pytest
+    from dtoolcore import DataSet
+    from dtool.manifest import update_manifest
+    from dtool.overlays import register_overlay_function
+
+    computed = []
+
+    def counted_size(fpath, sample):
+        computed.append(os.path.basename(fpath))
+        return sample.size
+
+    register_overlay_function("counted_size", counted_size)
+
+    dataset = create_dataset(tmp_dir_fixture)
+    _backdate_files(os.path.join(tmp_dir_fixture, "data"))
+    with pytest.raises(ValueError):
+        update_manifest(dataset, overlays=["nosuchoverlay"])
+
+    update_manifest(dataset, overlays=["counted_size", "image_dimensions"])
+    assert len(computed) == 6
+    dataset = DataSet.from_path(tmp_dir_fixture)
+    overlays = dataset.access_overlays()
+    hashes = dict((entry["path"], entry["hash"])
+                  for entry in dataset.manifest["file_list"])
+    assert overlays["image_dimensions"][hashes["tiny.png"]] == [5, 5]
+    assert overlays["image_dimensions"][hashes["real_text_file.txt"]] is None
+    for entry in dataset.manifest["file_list"]:
+        assert overlays["counted_size"][entry["hash"]] == entry["size"]
+
+    # The overlays are kept up to date by incremental updates, whose values
+    # are only computed for new content.
+    with open(os.path.join(tmp_dir_fixture, "data", "new.txt"), "w") as fh:
+        fh.write("new")
+    shutil.copy(os.path.join(tmp_dir_fixture, "data", "new.txt"),
+                os.path.join(tmp_dir_fixture, "data", "copy_of_new.txt"))
+    computed = []
+    update_manifest(dataset, incremental=True)
+    assert len(computed) == 1
+    overlays = DataSet.from_path(tmp_dir_fixture).access_overlays()
+    assert len(overlays["counted_size"]) == 7
+    assert 3 in overlays["counted_size"].values()
+
+    # Full updates recompute the values, once per distinct content.
+    computed = []
+    update_manifest(dataset)
+    assert len(computed) == 7
+
+
+def test_manifest_journal_ignores_partial_line(tmp_dir_fixture):  # NOQA
+    from dtool.manifest import ManifestJournal
+
+    journal_path = os.path.join(tmp_dir_fixture, "journal.jsonl")
+    journal = ManifestJournal(journal_path)
+    journal.open()
+    entry = dict(hash="abc", size=3, mtime=1.0, path="a.txt")
+    journal.append(entry, {"mimetype": "text/plain"})
+    journal.close()
+    with open(journal_path, "a") as fh:
+        fh.write('{"entry": {"ha')
+
+    journal = ManifestJournal(journal_path)
+    journal.load()
+    assert len(journal) == 1
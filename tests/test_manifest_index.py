@@ -0,0 +1,184 @@
+"""Tests for the dtool manifest_index module."""
+
+import errno
+import os
+
+import pytest
+
+from . import create_dataset, tmp_dir_fixture  # NOQA
+
+
+def test_update_manifest_writes_index(tmp_dir_fixture):  # NOQA
+    from dtoolcore import DataSet
+    from dtool.manifest import update_manifest
+    from dtool.manifest_index import INDEX_NAME, ManifestIndex
+
+    dataset = create_dataset(tmp_dir_fixture)
+    update_manifest(dataset, index=True)
+
+    file_list = DataSet.from_path(tmp_dir_fixture).manifest["file_list"]
+    index_path = os.path.join(tmp_dir_fixture, ".dtool", INDEX_NAME)
+    with ManifestIndex(index_path) as index:
+        assert not index.is_stale(dataset._abs_manifest_path)
+        assert len(index) == 6
+        assert list(index) == file_list
+        for entry in file_list:
+            assert index.lookup(entry["path"]) == entry
+        assert index.lookup("missing.txt") is None
+        assert index.lookup("") is None
+        assert index.lookup("zzz") is None
+
+    # The existing index is rebuilt by later updates.
+    with open(os.path.join(tmp_dir_fixture, "data", "new.txt"), "w") as fh:
+        fh.write("new")
+    update_manifest(dataset)
+    with ManifestIndex(index_path) as index:
+        assert not index.is_stale(dataset._abs_manifest_path)
+        assert index.lookup("new.txt")["size"] == 3
+
+
+def test_open_index_rebuilds_stale_index(tmp_dir_fixture):  # NOQA
+    from dtoolcore import DataSet
+    from dtool.manifest import update_manifest
+    from dtool.manifest_index import open_index
+
+    dataset = create_dataset(tmp_dir_fixture)
+
+    # No index yet.
+    with open_index(tmp_dir_fixture) as index:
+        assert len(index) == 0
+
+    update_manifest(dataset, index=True)
+
+    # Manifest changed by dtoolcore, which does not know about the index.
+    with open(os.path.join(tmp_dir_fixture, "data", "new.txt"), "w") as fh:
+        fh.write("new")
+    dataset.update_manifest()
+
+    with open_index(tmp_dir_fixture) as index:
+        assert len(index) == 7
+        file_list = DataSet.from_path(tmp_dir_fixture).manifest["file_list"]
+        for entry in file_list:
+            assert index.lookup(entry["path"]) == entry
+
+
+def test_manifest_index_invalid_file(tmp_dir_fixture):  # NOQA
+    from dtool.manifest_index import ManifestIndex
+
+    fpath = os.path.join(tmp_dir_fixture, "not_an_index")
+    with open(fpath, "wb") as fh:
+        fh.write(b"x" * 100)
+    with pytest.raises(ValueError):
+        ManifestIndex(fpath)
+
+
+@pytest.mark.skipif(
+    not hasattr(os, "fsdecode"),
+    reason="file names are decoded with surrogate escapes on Python 3 only")
+def test_manifest_index_undecodable_path(tmp_dir_fixture):  # NOQA
+    from dtoolcore import DataSet
+    from dtool.manifest import update_manifest
+    from dtool.manifest_index import open_index
+
+    dataset = create_dataset(tmp_dir_fixture)
+    data_dir = os.path.join(tmp_dir_fixture, "data").encode("utf-8")
+    # Undecodable, private use and non-BMP names sort differently as str
+    # and as encoded bytes.
+    names = [b"latin1_\xe9.txt", b"a\xff", b"a\xfe", b"a",
+             u"a\ue000".encode("utf-8"), u"a\U0001f600".encode("utf-8"),
+             u"a\u00e9".encode("utf-8"), b"ab"]
+    for name in names:
+        with open(os.path.join(data_dir, name), "wb") as fh:
+            fh.write(name)
+    # A small buffer so that the entries are sorted in several runs.
+    update_manifest(dataset, index=True, buffer_size=3)
+
+    with open_index(tmp_dir_fixture) as index:
+        paths = [entry["path"] for entry in index]
+        for name in names:
+            rel_path = os.fsdecode(name)
+            assert index.lookup(rel_path)["size"] == len(name)
+            assert rel_path in paths
+        file_list = DataSet.from_path(tmp_dir_fixture).manifest["file_list"]
+        for entry in file_list:
+            assert index.lookup(entry["path"]) is not None
+
+
+def test_index_writer_rejects_unsorted_paths(tmp_dir_fixture):  # NOQA
+    from dtool.manifest_index import IndexWriter
+
+    writer = IndexWriter(tmp_dir_fixture)
+    entry = dict(hash="00" * 20, size=0, mtime=0.0)
+    try:
+        writer.add(dict(entry, path=u"a\U0001f600"))
+        with pytest.raises(ValueError):
+            writer.add(dict(entry, path=u"a\ue000"))
+    finally:
+        writer.close()
+
+
+def test_manifest_write_failure_removes_tmp_files(tmp_dir_fixture, mocker):  # NOQA
+    from dtool.manifest import update_manifest
+
+    dataset = create_dataset(tmp_dir_fixture)
+    mocker.patch(
+        "dtool.manifest_index.IndexWriter.add",
+        side_effect=ValueError("no space"))
+    with pytest.raises(ValueError):
+        update_manifest(dataset, index=True)
+    dtool_dir = os.path.join(tmp_dir_fixture, ".dtool")
+    for dir_path, _, file_names in os.walk(dtool_dir):
+        assert not [fn for fn in file_names if fn.endswith(".tmp")]
+
+
+def test_open_index_read_only_dataset(tmp_dir_fixture, mocker):  # NOQA
+    from dtoolcore import DataSet
+    from dtool.manifest import update_manifest
+    from dtool.manifest_index import INDEX_NAME, open_index
+
+    dataset = create_dataset(tmp_dir_fixture)
+    update_manifest(dataset, index=True)
+    with open(os.path.join(tmp_dir_fixture, "data", "new.txt"), "w") as fh:
+        fh.write("new")
+    dataset.update_manifest()
+
+    # The stale index cannot be replaced in a read-only dataset.
+    index_path = os.path.join(tmp_dir_fixture, ".dtool", INDEX_NAME)
+    rename = os.rename
+
+    def read_only_rename(src, dst):
+        if dst == index_path:
+            raise OSError(errno.EROFS, os.strerror(errno.EROFS), dst)
+        return rename(src, dst)
+
+    mocker.patch("os.rename", side_effect=read_only_rename)
+    with open_index(tmp_dir_fixture) as index:
+        assert len(index) == 7
+        file_list = DataSet.from_path(tmp_dir_fixture).manifest["file_list"]
+        for entry in file_list:
+            assert index.lookup(entry["path"]) == entry
+    assert not os.path.exists(index_path + ".tmp")
+
+
+def test_open_index_manifest_path(tmp_dir_fixture):  # NOQA
+    import json
+    import shutil
+    from dtool.manifest import update_manifest
+    from dtool.manifest_index import open_index
+
+    dataset = create_dataset(tmp_dir_fixture)
+    update_manifest(dataset)
+
+    # The manifest is found using the admin metadata.
+    dtool_dir = os.path.join(tmp_dir_fixture, ".dtool")
+    shutil.move(os.path.join(dtool_dir, "manifest.json"),
+                os.path.join(dtool_dir, "other.json"))
+    admin_path = os.path.join(dtool_dir, "dtool")
+    with open(admin_path) as fh:
+        admin_metadata = json.load(fh)
+    admin_metadata["manifest_path"] = os.path.join(".dtool", "other.json")
+    with open(admin_path, "w") as fh:
+        json.dump(admin_metadata, fh)
+
+    with open_index(tmp_dir_fixture) as index:
+        assert len(index) == 6
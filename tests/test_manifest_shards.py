@@ -0,0 +1,108 @@
+"""Tests for the dtool manifest_shards module."""
+
+import os
+import multiprocessing
+
+import pytest
+
+from . import create_dataset, tmp_dir_fixture  # NOQA
+
+
+def _write_shard(args):
+    from dtoolcore import DataSet
+    from dtool.manifest_shards import write_shard
+    path, index, num_shards = args
+    return write_shard(
+        DataSet.from_path(path), index, num_shards, incremental=False)
+
+
+def test_shard_of():
+    from dtool.manifest_shards import shard_of
+
+    rel_paths = ["file_{}.txt".format(i) for i in range(1000)]
+    shards = [shard_of(p, 4) for p in rel_paths]
+    assert shards == [shard_of(p, 4) for p in rel_paths]
+    assert set(shards) == set(range(4))
+
+
+def test_write_and_merge_shards(tmp_dir_fixture):  # NOQA
+    from dtoolcore import DataSet
+    from dtool.manifest import update_manifest
+    from dtool.manifest_shards import merge_shards
+
+    dataset = create_dataset(tmp_dir_fixture)
+    update_manifest(dataset)
+    expected = DataSet.from_path(tmp_dir_fixture)
+
+    pool = multiprocessing.Pool(3)
+    try:
+        counts = pool.map(
+            _write_shard, [(tmp_dir_fixture, i, 3) for i in range(3)])
+    finally:
+        pool.terminate()
+        pool.join()
+    assert sum(counts) == 6
+
+    assert merge_shards(DataSet.from_path(tmp_dir_fixture), 3) == 6
+
+    merged = DataSet.from_path(tmp_dir_fixture)
+    assert merged.manifest == expected.manifest
+    assert merged.access_overlays() == expected.access_overlays()
+    assert not os.path.isdir(
+        os.path.join(tmp_dir_fixture, ".dtool", "manifest_shards"))
+
+
+@pytest.mark.skipif(
+    not hasattr(os, "fsdecode"),
+    reason="file names are decoded with surrogate escapes on Python 3 only")
+def test_write_and_merge_shards_undecodable_path(tmp_dir_fixture):  # NOQA
+    from dtoolcore import DataSet
+    from dtool.manifest_shards import merge_shards, shard_of, write_shard
+
+    dataset = create_dataset(tmp_dir_fixture)
+    data_dir = os.path.join(tmp_dir_fixture, "data").encode("utf-8")
+    with open(os.path.join(data_dir, b"latin1_\xe9.txt"), "w") as fh:
+        fh.write("latin1")
+    rel_path = os.fsdecode(b"latin1_\xe9.txt")
+    assert shard_of(rel_path, 2) == shard_of(b"latin1_\xe9.txt", 2)
+
+    assert write_shard(dataset, 0, 2) + write_shard(dataset, 1, 2) == 7
+    assert merge_shards(dataset, 2) == 7
+    file_list = DataSet.from_path(tmp_dir_fixture).manifest["file_list"]
+    assert rel_path in [entry["path"] for entry in file_list]
+
+
+def test_merge_shards_checks_coverage(tmp_dir_fixture):  # NOQA
+    from dtool.manifest_shards import merge_shards, shard_path, write_shard
+
+    dataset = create_dataset(tmp_dir_fixture)
+    manifest_before = open(dataset._abs_manifest_path).read()
+
+    write_shard(dataset, 0, 2)
+    with pytest.raises(ValueError) as excinfo:
+        merge_shards(dataset, 2)
+    assert "Missing shards: 1" in str(excinfo.value)
+
+    write_shard(dataset, 1, 2)
+    with open(os.path.join(tmp_dir_fixture, "data", "late.txt"), "w") as fh:
+        fh.write("late")
+    with pytest.raises(ValueError) as excinfo:
+        merge_shards(dataset, 2)
+    assert "1 files not hashed, e.g. late.txt" in str(excinfo.value)
+    os.unlink(os.path.join(tmp_dir_fixture, "data", "late.txt"))
+
+    # Copy an item of shard 1 into shard 0.
+    with open(shard_path(dataset, 1, 2)) as fh:
+        record = fh.readlines()[1]
+    with open(shard_path(dataset, 0, 2), "a") as fh:
+        fh.write(record)
+    with pytest.raises(ValueError) as excinfo:
+        merge_shards(dataset, 2)
+    message = str(excinfo.value)
+    assert "1 files hashed more than once" in message
+    assert "1 files hashed by the wrong shard" in message
+
+    assert open(dataset._abs_manifest_path).read() == manifest_before
+
+    with pytest.raises(ValueError):
+        write_shard(dataset, 2, 2)
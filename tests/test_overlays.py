@@ -0,0 +1,197 @@
+"""Tests for the dtool overlays module."""
+
+import os
+
+from . import tmp_dir_fixture  # NOQA
+
+HERE = os.path.dirname(__file__)
+TEST_INPUT_DATA = os.path.join(HERE, "data", "mimetype", "input", "archive")
+
+
+def test_file_sample_data_has_start_and_end_of_file():
+    from dtool.overlays import FileSample, HEAD_SIZE, TAIL_SIZE
+
+    content = os.urandom(HEAD_SIZE + TAIL_SIZE + 100000)
+
+    sample = FileSample()
+    for i in range(0, len(content), 4096):
+        sample.update(content[i:i + 4096])
+
+    assert sample.size == len(content)
+    assert sample.data[:HEAD_SIZE] == content[:HEAD_SIZE]
+    assert sample.data[-TAIL_SIZE:] == content[-TAIL_SIZE:]
+
+
+def test_file_sample_of_small_file_has_all_data():
+    from dtool.overlays import FileSample
+
+    sample = FileSample()
+    sample.update(b"hello ")
+    sample.update(b"world")
+
+    assert sample.data == b"hello world"
+    assert sample.size == 11
+
+
+def test_file_sample_from_path(tmp_dir_fixture):  # NOQA
+    from dtool.overlays import FileSample, HEAD_SIZE, TAIL_SIZE
+
+    content = os.urandom(HEAD_SIZE + TAIL_SIZE + 100000)
+    fpath = os.path.join(tmp_dir_fixture, "random_bytes")
+    with open(fpath, "wb") as fh:
+        fh.write(content)
+
+    streamed = FileSample()
+    streamed.update(content)
+    sample = FileSample.from_path(fpath)
+
+    assert sample.size == len(content)
+    assert sample.data == streamed.data
+
+
+def test_mimetype_from_sample():
+    from dtool.overlays import FileSample, mimetype_from_sample
+
+    expected = {
+        "tiny.png": "image/png",
+        "actually_a_png.txt": "image/png",
+        "real_text_file.txt": "text/plain",
+        "empty_file": "inode/x-empty",
+        "random_bytes": "application/octet-stream",
+    }
+    for fname, mimetype in expected.items():
+        fpath = os.path.join(TEST_INPUT_DATA, fname)
+        sample = FileSample.from_path(fpath)
+        assert mimetype_from_sample(fpath, sample) == mimetype
+
+
+def test_image_dimensions_from_sample(tmp_dir_fixture):  # NOQA
+    import struct
+    from dtool.overlays import (
+        HEAD_SIZE,
+        FileSample,
+        image_dimensions_from_sample,
+    )
+
+    sof = b"\xff\xc0" + struct.pack(">HBHH", 17, 8, 30, 20) + b"\x00" * 12
+    large_app = b"\xff\xe1" + struct.pack(">H", 60000) + b"\x00" * 59998
+    contents = {
+        "tiny.gif": b"GIF89a" + struct.pack("<HH", 3, 2) + b"\x00" * 20,
+        "tiny.bmp": (b"BM" + b"\x00" * 12 + struct.pack("<I", 40) +
+                     struct.pack("<ii", 7, -4) + b"\x00" * 20),
+        "small.jpg": b"\xff\xd8" + sof + b"\xff\xd9",
+        "large.jpg": b"\xff\xd8" + large_app + sof + b"\xff\xd9",
+        "no_frame.jpg": b"\xff\xd8\xff\xd9",
+        "text.txt": b"hello world",
+    }
+    assert len(contents["large.jpg"]) > HEAD_SIZE
+    expected = {
+        "tiny.gif": [3, 2],
+        "tiny.bmp": [7, 4],
+        "small.jpg": [20, 30],
+        "large.jpg": [20, 30],
+        "no_frame.jpg": None,
+        "text.txt": None,
+    }
+    for fname, content in contents.items():
+        fpath = os.path.join(tmp_dir_fixture, fname)
+        with open(fpath, "wb") as fh:
+            fh.write(content)
+        sample = FileSample.from_path(fpath)
+        assert image_dimensions_from_sample(fpath, sample) == expected[fname]
+        sample = FileSample.from_bytes(content)
+        assert image_dimensions_from_sample(fpath, sample) == expected[fname]
+
+    fpath = os.path.join(TEST_INPUT_DATA, "tiny.png")
+    sample = FileSample.from_path(fpath)
+    assert image_dimensions_from_sample(fpath, sample) == [5, 5]
+
+
+def test_register_overlay_function():
+    import pytest
+    from dtool.overlays import (
+        FileSample,
+        compute_overlays,
+        get_overlay_function,
+        overlay_function_names,
+        register_overlay_function,
+    )
+
+    assert "mimetype" in overlay_function_names()
+    with pytest.raises(ValueError):
+        get_overlay_function("first_byte")
+
+    def first_byte(fpath, sample):
+        return sample.head[:1].decode("ascii")
+
+    register_overlay_function("first_byte", first_byte)
+    assert "first_byte" in overlay_function_names()
+    sample = FileSample.from_bytes(b"hello")
+    assert compute_overlays(["first_byte", "size_in_bytes"], "a", sample) == {
+        "first_byte": "h", "size_in_bytes": 5}
+
+
+def test_overlay_function_entry_points(mocker):
+    import dtool.overlays
+    from dtool.overlays import ENTRY_POINT_GROUP, get_overlay_function
+
+    entry_point = mocker.Mock()
+    entry_point.name = "plugin_overlay"
+    entry_point.load.return_value = len
+    entry_points = mocker.Mock()
+    entry_points.select.return_value = [entry_point]
+    mocker.patch(
+        "importlib.metadata.entry_points", return_value=entry_points)
+    mocker.patch.object(dtool.overlays, "_entry_points_loaded", False)
+
+    assert get_overlay_function("plugin_overlay") is len
+    entry_points.select.assert_called_once_with(group=ENTRY_POINT_GROUP)
+
+
+def test_overlay_cache():
+    import pytest
+    from dtool.overlays import FileSample, OverlayCache
+
+    known = {"mimetype": {"abc": "text/plain"}}
+    cache = OverlayCache(known)
+    sample = FileSample.from_bytes(b"hello")
+    assert cache.compute(["mimetype", "size_in_bytes"], "abc", "a", sample) \
+        == {"mimetype": "text/plain", "size_in_bytes": 5}
+    assert cache.stats() == dict(hits=1, misses=1, size=1)
+
+    # Values are only computed for hashes not seen before.
+    def no_sample():
+        raise AssertionError("Sample should not be needed")
+
+    assert cache.compute(["size_in_bytes"], "abc", "a", no_sample) == {
+        "size_in_bytes": 5}
+    assert cache.lookup("size_in_bytes", "abc") == 5
+    assert known == {"mimetype": {"abc": "text/plain"}}
+
+    # Only max_size computed values are kept, least recently used first.
+    cache = OverlayCache(max_size=2)
+    cache.add("a", {"size_in_bytes": 1})
+    cache.add("b", {"size_in_bytes": 2})
+    cache.lookup("size_in_bytes", "a")
+    cache.add("c", {"size_in_bytes": 3})
+    assert cache.lookup("size_in_bytes", "a") == 1
+    with pytest.raises(KeyError):
+        cache.lookup("size_in_bytes", "b")
+
+    cache.clear()
+    assert cache.stats() == dict(hits=0, misses=0, size=0)
+
+
+def test_magic_sizes(mocker):
+    import puremagic
+    from dtool.overlays import HEAD_SIZE, TAIL_SIZE, _magic_sizes
+
+    head_size, tail_size = _magic_sizes()
+    assert HEAD_SIZE >= head_size
+    assert TAIL_SIZE == tail_size
+    for magic in puremagic.magic_header_array:
+        assert len(magic[0]) + magic[1] <= head_size
+
+    # Falls back to the sizes of a known version if the tables change.
+    mocker.patch.object(puremagic, "magic_header_array", [None])
+    assert _magic_sizes() == (36870, 36)
@@ -0,0 +1,149 @@
+"""Tests for the dtool packed module."""
+
+import os
+
+from . import TEST_INPUT_DATA, create_dataset, tmp_dir_fixture  # NOQA
+
+
+def _pack(dataset, **kwargs):
+    from dtool.packed import pack_files
+    manifest = dataset._structural_metadata
+    return pack_files(
+        manifest.abs_manifest_root, manifest["hash_function"], **kwargs)
+
+
+def test_pack_files(tmp_dir_fixture):  # NOQA
+    from dtool.manifest import update_manifest
+    from dtool.packed import PACKED_DIR, PackedFiles, remove_originals
+
+    dataset = create_dataset(tmp_dir_fixture, update=update_manifest)
+    data_dir = os.path.join(tmp_dir_fixture, "data")
+
+    num_files, shards = _pack(dataset, threshold=1000, shard_size=4096)
+    assert num_files == 5
+    assert [os.path.basename(p) for p in shards] == [
+        "shard-00000.tar", "shard-00001.tar"]
+
+    # The packed files are kept until they are removed explicitly, and are
+    # not packed again.
+    assert len(os.listdir(data_dir)) == 7
+    assert _pack(dataset, threshold=1000) == (0, [])
+    assert remove_originals(data_dir) == 5
+    assert sorted(os.listdir(data_dir)) == [PACKED_DIR, "random_bytes"]
+
+    packed = PackedFiles(data_dir)
+    assert len(packed) == 5
+    assert "random_bytes" not in packed
+    with open(os.path.join(TEST_INPUT_DATA, "tiny.png"), "rb") as fh:
+        assert packed.read("tiny.png") == fh.read()
+    assert packed.open("empty_file").read() == b""
+
+    # Packing again starts a new shard after the existing ones.
+    with open(os.path.join(data_dir, "new.txt"), "w") as fh:
+        fh.write("new")
+    num_files, shards = _pack(dataset, threshold=1000)
+    assert num_files == 1
+    assert [os.path.basename(p) for p in shards] == ["shard-00002.tar"]
+    assert PackedFiles(data_dir).read("new.txt") == b"new"
+
+
+def test_update_manifest_of_packed_dataset(tmp_dir_fixture):  # NOQA
+    from dtoolcore import DataSet
+    from dtool.manifest import update_manifest
+    from dtool.packed import remove_originals
+    from dtool.verify import verify_dataset
+
+    dataset = create_dataset(tmp_dir_fixture, update=update_manifest)
+    before = dataset.manifest
+    overlays_before = dataset.access_overlays()
+
+    _pack(dataset)
+    update_manifest(dataset, incremental=True)
+    remove_originals(dataset._structural_metadata.abs_manifest_root)
+    dataset = DataSet.from_path(tmp_dir_fixture)
+
+    after = dataset.manifest
+    assert len(after["file_list"]) == 6
+    for old, new in zip(before["file_list"], after["file_list"]):
+        assert new["path"] == old["path"]
+        assert new["hash"] == old["hash"]
+        assert new["size"] == old["size"]
+        assert new["shard"] == os.path.join(".packed", "shard-00000.tar")
+    overlays = dataset.access_overlays()
+    for name in overlays_before:
+        assert overlays[name] == overlays_before[name]
+
+    for mode in ["full", "quick", "sampled"]:
+        assert verify_dataset(dataset, mode=mode).ok
+
+    # Unpacked copies on disk take precedence over packed ones.
+    with open(os.path.join(tmp_dir_fixture, "data", "tiny.png"), "w") as fh:
+        fh.write("not a png")
+    update_manifest(dataset, incremental=True)
+    entries = dict((entry["path"], entry) for entry in
+                   DataSet.from_path(tmp_dir_fixture).manifest["file_list"])
+    assert entries["tiny.png"]["size"] == 9
+    assert "shard" not in entries["tiny.png"]
+
+
+def test_verify_packed_dataset(tmp_dir_fixture):  # NOQA
+    from dtoolcore import DataSet
+    from dtool.manifest import update_manifest
+    from dtool.packed import PACKED_DIR, remove_originals
+    from dtool.verify import verify_dataset
+
+    dataset = create_dataset(tmp_dir_fixture, update=update_manifest)
+    _, shards = _pack(dataset)
+    update_manifest(dataset, incremental=True)
+    remove_originals(dataset._structural_metadata.abs_manifest_root)
+    dataset = DataSet.from_path(tmp_dir_fixture)
+
+    # Corrupt a member without changing the size of the shard.
+    with open(shards[0], "r+b") as fh:
+        fh.seek(dataset._structural_metadata["file_list"][0]["offset"])
+        fh.write(b"X")
+
+    assert verify_dataset(dataset, mode="quick").ok
+    result = verify_dataset(dataset, mode="full")
+    assert result.changed == ["actually_a_png.txt"]
+
+    os.unlink(shards[0])
+    os.unlink(shards[0] + ".index.json")
+    result = verify_dataset(dataset, mode="quick")
+    assert len(result.missing) == 6
+    assert PACKED_DIR not in result.extra
+
+
+def test_pack_files_interrupted(tmp_dir_fixture, mocker):  # NOQA
+    import pytest
+    from dtoolcore import DataSet
+    from dtool.manifest import update_manifest
+    from dtool.packed import PACKED_DIR, PackedFiles
+
+    dataset = create_dataset(tmp_dir_fixture, update=update_manifest)
+    before = dataset.manifest
+    data_dir = os.path.join(tmp_dir_fixture, "data")
+    packed_dir = os.path.join(data_dir, PACKED_DIR)
+
+    # A shard that failed to be written is removed.
+    mocker.patch("dtool.packed.member_metadata", side_effect=IOError)
+    with pytest.raises(IOError):
+        _pack(dataset)
+    assert os.listdir(packed_dir) == []
+    mocker.stopall()
+
+    # Files packed before the manifest was updated are still on disk, and
+    # are taken to be packed.
+    _pack(dataset)
+    update_manifest(dataset, incremental=True)
+    assert len(os.listdir(data_dir)) == 7
+    after = DataSet.from_path(tmp_dir_fixture).manifest
+    assert [e["hash"] for e in after["file_list"]] == [
+        e["hash"] for e in before["file_list"]]
+    assert all("shard" in e for e in after["file_list"])
+
+    # Shards without an index are skipped with a warning.
+    with open(os.path.join(packed_dir, "shard-00001.tar"), "wb") as fh:
+        fh.write(b"x" * 512)
+    with pytest.warns(UserWarning):
+        assert len(PackedFiles(data_dir).shards) == 1
@@ -0,0 +1,73 @@
+"""Tests for the dtool pipeline module."""
+
+import hashlib
+import os
+
+import pytest
+
+from . import tmp_dir_fixture  # NOQA
+
+
+class _Sha1(object):
+
+    def __init__(self, fpath):
+        self.fpath = fpath
+        self.hasher = hashlib.sha1()
+        self.num_chunks = 0
+
+    def update(self, buf):
+        self.hasher.update(buf)
+        self.num_chunks += 1
+
+    def result(self):
+        return self.fpath, self.hasher.hexdigest(), self.num_chunks
+
+
+def _write_files(root, sizes):
+    fpaths = []
+    for i, size in enumerate(sizes):
+        fpath = os.path.join(root, "file{}".format(i))
+        with open(fpath, "wb") as fh:
+            fh.write(os.urandom(size))
+        fpaths.append(fpath)
+    return fpaths
+
+
+def test_aligned_read_size():
+    import mmap
+    from dtool.pipeline import aligned_read_size
+
+    assert aligned_read_size(1) == mmap.PAGESIZE
+    assert aligned_read_size(mmap.PAGESIZE) == mmap.PAGESIZE
+    assert aligned_read_size(mmap.PAGESIZE + 1) == 2 * mmap.PAGESIZE
+
+
+def test_read_pipelined(tmp_dir_fixture):  # NOQA
+    from dtool.pipeline import read_pipelined
+
+    sizes = [0, 1, 4096, 4097, 100000, 300000]
+    fpaths = _write_files(tmp_dir_fixture, sizes)
+
+    results = list(read_pipelined(
+        [_Sha1(fpath) for fpath in fpaths],
+        readers=3,
+        hashers=2,
+        read_size=4096,
+        queue_depth=2))
+
+    assert len(results) == len(fpaths)
+    for fpath, digest, num_chunks in results:
+        with open(fpath, "rb") as fh:
+            assert digest == hashlib.sha1(fh.read()).hexdigest()
+        assert num_chunks == -(-os.path.getsize(fpath) // 4096)
+
+
+def test_read_pipelined_missing_file(tmp_dir_fixture):  # NOQA
+    from dtool.pipeline import read_pipelined
+
+    fpaths = _write_files(tmp_dir_fixture, [100000] * 4)
+    fpaths.append(os.path.join(tmp_dir_fixture, "missing"))
+
+    with pytest.raises(OSError):
+        list(read_pipelined(
+            [_Sha1(fpath) for fpath in fpaths], read_size=4096))
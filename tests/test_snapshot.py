@@ -0,0 +1,144 @@
+"""Tests for the dtool snapshot module."""
+
+import errno
+import os
+import stat
+
+from . import create_dataset, tmp_dir_fixture  # NOQA
+
+
+def _make_writable(path):
+    """Allow a read-only snapshot to be removed."""
+    for dir_path, _, _ in os.walk(path):
+        os.chmod(dir_path, 0o755)
+
+
+def _fake_ficlone(dst_fd, request, src_fd):
+    """Clone a file by copying it, for file systems without reflinks."""
+    while True:
+        buf = os.read(src_fd, 2**16)
+        if not buf:
+            return 0
+        os.write(dst_fd, buf)
+
+
+def test_snapshot_hardlink(tmp_dir_fixture, mocker):  # NOQA
+    import pytest
+    from dtoolcore import DataSet
+    from dtool.manifest import update_manifest
+    from dtool.snapshot import snapshot_dataset
+    from dtool.verify import verify_dataset
+
+    def unsupported(*args):
+        raise IOError(errno.EOPNOTSUPP, os.strerror(errno.EOPNOTSUPP))
+
+    ioctl = mocker.patch("fcntl.ioctl", side_effect=unsupported)
+
+    src_path = os.path.join(tmp_dir_fixture, "src")
+    dataset = create_dataset(src_path, update=update_manifest)
+    dest_path = os.path.join(tmp_dir_fixture, "snapshot")
+    with pytest.warns(UserWarning, match="hard linking"):
+        snapshot, counts = snapshot_dataset(dataset, dest_path)
+    try:
+        # Reflinks are only tried once.
+        assert ioctl.call_count == 1
+        assert counts["reflink"] == 0
+        assert counts["hardlink"] == 6
+        assert counts["copy"] >= 2
+
+        assert snapshot.uuid != dataset.uuid
+        assert snapshot._admin_metadata["snapshot_of"] == dataset.uuid
+        assert snapshot.name == dataset.name
+        assert snapshot.manifest == dataset.manifest
+        assert verify_dataset(snapshot).ok
+
+        rel_path = os.path.join("data", "random_bytes")
+        src_stat = os.stat(os.path.join(src_path, rel_path))
+        dest_stat = os.stat(os.path.join(dest_path, rel_path))
+        assert src_stat.st_ino == dest_stat.st_ino
+
+        # Hard linked files keep the permissions of the originals, the
+        # copied metadata and the directories are read-only.
+        assert dest_stat.st_mode & stat.S_IWUSR
+        manifest_path = os.path.join(dest_path, ".dtool", "manifest.json")
+        assert not os.stat(manifest_path).st_mode & stat.S_IWUSR
+        assert not os.stat(dest_path).st_mode & stat.S_IWUSR
+        assert DataSet.from_path(src_path).uuid == dataset.uuid
+    finally:
+        _make_writable(dest_path)
+
+
+def test_snapshot_reflink(tmp_dir_fixture, mocker):  # NOQA
+    import pytest
+    from dtool.manifest import update_manifest
+    from dtool.snapshot import snapshot_dataset
+    from dtool.verify import verify_dataset
+
+    mocker.patch("fcntl.ioctl", side_effect=_fake_ficlone)
+
+    src_path = os.path.join(tmp_dir_fixture, "src")
+    dataset = create_dataset(src_path, update=update_manifest)
+    dest_path = os.path.join(tmp_dir_fixture, "snapshot")
+    snapshot, counts = snapshot_dataset(
+        dataset, dest_path, method="reflink", readonly=False)
+
+    assert counts["reflink"] == 6
+    assert counts["hardlink"] == 0
+    assert verify_dataset(snapshot, mode="quick").ok
+
+    rel_path = os.path.join("data", "random_bytes")
+    src_stat = os.stat(os.path.join(src_path, rel_path))
+    dest_stat = os.stat(os.path.join(dest_path, rel_path))
+    assert src_stat.st_ino != dest_stat.st_ino
+    assert src_stat.st_mtime == dest_stat.st_mtime
+    assert dest_stat.st_mode & stat.S_IWUSR
+
+    with pytest.raises(OSError):
+        snapshot_dataset(dataset, dest_path)
+    with pytest.raises(ValueError):
+        snapshot_dataset(dataset, dest_path + "2", method="copy")
+
+
+def test_snapshot_reflink_unsupported(tmp_dir_fixture, mocker):  # NOQA
+    import pytest
+    from dtool.manifest import update_manifest
+    from dtool.snapshot import snapshot_dataset
+
+    def unsupported(*args):
+        raise IOError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+    mocker.patch("fcntl.ioctl", side_effect=unsupported)
+
+    dataset = create_dataset(
+        os.path.join(tmp_dir_fixture, "src"), update=update_manifest)
+    dest_path = os.path.join(tmp_dir_fixture, "snapshot")
+    with pytest.raises(OSError):
+        snapshot_dataset(dataset, dest_path, method="reflink")
+    assert not os.path.exists(dest_path)
+
+
+def test_snapshot_failure(tmp_dir_fixture, mocker):  # NOQA
+    import pytest
+    import shutil
+    from dtool.manifest import update_manifest
+    from dtool.snapshot import snapshot_dataset
+
+    mocker.patch("fcntl.ioctl", side_effect=_fake_ficlone)
+
+    src_path = os.path.join(tmp_dir_fixture, "src")
+    dataset = create_dataset(src_path, update=update_manifest)
+
+    # Fail on the last directory, after the others were made read-only.
+    copystat = shutil.copystat
+    dest_path = os.path.join(tmp_dir_fixture, "snapshot")
+
+    def fail_on_root(src, dst, **kwargs):
+        if dst == dest_path:
+            raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+        copystat(src, dst, **kwargs)
+
+    mocker.patch("shutil.copystat", side_effect=fail_on_root)
+    with pytest.raises(OSError):
+        snapshot_dataset(dataset, dest_path)
+    assert not os.path.exists(dest_path)
+    assert os.path.isfile(os.path.join(src_path, "data", "random_bytes"))
@@ -0,0 +1,62 @@
+"""Tests for the dtool stats module."""
+
+import os
+import datetime
+
+from . import copy_tree, tmp_dir_fixture  # NOQA
+
+HERE = os.path.dirname(__file__)
+TEST_INPUT_DATA = os.path.join(HERE, "data", "mimetype", "input", "archive")
+
+
+def test_dataset_stats():
+    from dtool.stats import DatasetStats
+
+    stats = DatasetStats()
+    for size in [0, 10, 1023, 1024, 2**34]:
+        stats.add(size)
+
+    assert stats.num_files == 5
+    assert stats.total_size == 10 + 1023 + 1024 + 2**34
+    assert stats.histogram[0] == 1
+    assert stats.histogram[1] == 2
+    assert stats.histogram[2] == 1
+    assert stats.histogram[-1] == 1
+
+    other = DatasetStats()
+    other.add(10)
+    stats.merge(other)
+    assert stats.num_files == 6
+    assert stats.histogram[1] == 3
+
+    assert stats.estimated_hashing_time(workers=2) < \
+        stats.estimated_hashing_time(workers=1)
+    assert isinstance(stats.estimated_hashing_time(), datetime.timedelta)
+
+    report = stats.report()
+    assert "Number of files: 6" in report
+    assert "< 1.0 KiB" in report
+
+
+def test_scan_dataset(tmp_dir_fixture):  # NOQA
+    from dtoolcore import DataSet
+    from dtool.stats import scan_dataset
+
+    dataset = DataSet("test_dataset")
+    dataset.persist_to_path(tmp_dir_fixture)
+    copy_tree(TEST_INPUT_DATA, os.path.join(tmp_dir_fixture, "dir1"))
+    copy_tree(TEST_INPUT_DATA, os.path.join(tmp_dir_fixture, "dir2", "sub"))
+    with open(os.path.join(tmp_dir_fixture, "top.txt"), "w") as fh:
+        fh.write("top")
+    with open(os.path.join(tmp_dir_fixture, ".dtoolignore"), "w") as fh:
+        fh.write("*.jpg\n")
+
+    dataset = DataSet.from_path(tmp_dir_fixture)
+    stats = scan_dataset(dataset, workers=2)
+
+    input_size = sum(
+        os.path.getsize(os.path.join(TEST_INPUT_DATA, fn))
+        for fn in os.listdir(TEST_INPUT_DATA)
+        if not fn.endswith(".jpg"))
+    assert stats.num_files == 11
+    assert stats.total_size == 2 * input_size + 3
@@ -0,0 +1,100 @@
+"""Tests for the dtool transfer module."""
+
+import errno
+import os
+
+from . import TEST_INPUT_DATA, create_dataset, tmp_dir_fixture  # NOQA
+
+
+def test_copy_file_fallbacks(tmp_dir_fixture, mocker):  # NOQA
+    from dtool.transfer import copy_file
+
+    src = os.path.join(TEST_INPUT_DATA, "random_bytes")
+    with open(src, "rb") as fh:
+        content = fh.read()
+
+    def unsupported(*args):
+        raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+    methods = []
+    for patched in [[], ["copy_file_range"],
+                    ["copy_file_range", "sendfile"]]:
+        for name in patched:
+            mocker.patch("os." + name, side_effect=unsupported, create=True)
+        dst = os.path.join(tmp_dir_fixture, "copy_{}".format(len(patched)))
+        methods.append(copy_file(src, dst))
+        with open(dst, "rb") as fh:
+            assert fh.read() == content
+        assert os.stat(dst).st_mtime == os.stat(src).st_mtime
+    assert methods[1:] == ["sendfile", "read"]
+
+
+def test_copy_dataset(tmp_dir_fixture):  # NOQA
+    import pytest
+    from dtoolcore import DataSet
+    from dtool.packed import pack_files, remove_originals
+    from dtool.manifest import update_manifest
+    from dtool.transfer import copy_dataset
+    from dtool.verify import verify_dataset
+
+    src_path = os.path.join(tmp_dir_fixture, "src")
+    dataset = create_dataset(src_path, update=update_manifest)
+    manifest = dataset._structural_metadata
+    pack_files(manifest.abs_manifest_root, manifest["hash_function"],
+               threshold=100)
+    update_manifest(dataset, incremental=True)
+    remove_originals(manifest.abs_manifest_root)
+    dataset = DataSet.from_path(src_path)
+
+    dest_path = os.path.join(tmp_dir_fixture, "dest")
+    result = copy_dataset(dataset, dest_path, workers=3)
+    assert result.ok
+
+    copy = DataSet.from_path(dest_path)
+    assert copy.uuid == dataset.uuid
+    assert copy.manifest == dataset.manifest
+    assert copy.access_overlays() == dataset.access_overlays()
+    assert verify_dataset(copy, mode="quick").ok
+
+    with pytest.raises(OSError):
+        copy_dataset(dataset, dest_path)
+
+    # Corrupt a file at the source without updating the manifest.
+    with open(os.path.join(src_path, "data", "tiny.png"), "ab") as fh:
+        fh.write(b"corrupt")
+    result = copy_dataset(dataset, os.path.join(tmp_dir_fixture, "dest2"))
+    assert result.changed == ["tiny.png"]
+
+
+def test_copy_dataset_no_verify(tmp_dir_fixture):  # NOQA
+    from dtool.manifest import update_manifest
+    from dtool.transfer import copy_dataset
+
+    src_path = os.path.join(tmp_dir_fixture, "src")
+    dataset = create_dataset(src_path, update=update_manifest)
+
+    # Without verification a corrupted file goes unnoticed.
+    with open(os.path.join(src_path, "data", "tiny.png"), "ab") as fh:
+        fh.write(b"corrupt")
+    dest_path = os.path.join(tmp_dir_fixture, "dest")
+    result = copy_dataset(dataset, dest_path, verify=False)
+    assert result.ok
+    assert os.path.isfile(os.path.join(dest_path, "data", "tiny.png"))
+
+
+def test_copy_dataset_failure(tmp_dir_fixture, mocker):  # NOQA
+    import pytest
+    from dtool.manifest import update_manifest
+    from dtool.transfer import copy_dataset
+
+    src_path = os.path.join(tmp_dir_fixture, "src")
+    dataset = create_dataset(src_path, update=update_manifest)
+
+    def no_space(src, dst):
+        raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+
+    mocker.patch("dtool.transfer.copy_file", side_effect=no_space)
+    dest_path = os.path.join(tmp_dir_fixture, "dest")
+    with pytest.raises(OSError):
+        copy_dataset(dataset, dest_path, workers=2)
+    assert not os.path.exists(dest_path)
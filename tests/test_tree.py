@@ -0,0 +1,68 @@
+"""Tests for the dtool tree module."""
+
+import os
+
+from . import tmp_dir_fixture  # NOQA
+
+
+def _create_tree(root):
+    from dtoolcore import DataSet
+    from dtool.project import Project
+
+    project_dir = os.path.join(root, "project")
+    os.mkdir(project_dir)
+    Project("project").persist_to_path(project_dir)
+
+    for name in ["ds1", "ds2"]:
+        dataset_dir = os.path.join(project_dir, name)
+        os.mkdir(dataset_dir)
+        DataSet(name, "data").persist_to_path(dataset_dir)
+        os.makedirs(os.path.join(dataset_dir, "data", "inside_dataset"))
+
+    os.makedirs(os.path.join(project_dir, "scratch", "deeper"))
+    return project_dir
+
+
+def test_classify_directory(tmp_dir_fixture):  # NOQA
+    from dtool.tree import classify_directory
+
+    project_dir = _create_tree(tmp_dir_fixture)
+
+    info = classify_directory(os.path.join(project_dir, "ds1"))
+    assert info["type"] == "dataset"
+    assert info["name"] == "ds1"
+    assert info["uuid"] is not None
+
+    assert classify_directory(project_dir)["type"] == "collection"
+
+    info = classify_directory(os.path.join(project_dir, "scratch"))
+    assert info == dict(path=os.path.join(project_dir, "scratch"),
+                        type="unmanaged",
+                        name=None,
+                        uuid=None)
+
+
+def test_classify_tree(tmp_dir_fixture):  # NOQA
+    from dtool.tree import classify_tree, summary_table
+
+    _create_tree(tmp_dir_fixture)
+    infos = classify_tree(tmp_dir_fixture, workers=4)
+
+    rel_paths = [os.path.relpath(info["path"], tmp_dir_fixture)
+                 for info in infos]
+    assert rel_paths == [
+        ".",
+        "project",
+        os.path.join("project", "ds1"),
+        os.path.join("project", "ds2"),
+        os.path.join("project", "scratch"),
+        os.path.join("project", "scratch", "deeper"),
+    ]
+    types = [info["type"] for info in infos]
+    assert types == ["unmanaged", "collection", "dataset", "dataset",
+                     "unmanaged", "unmanaged"]
+
+    table = summary_table(infos)
+    assert "dataset: 2" in table
+    assert "collection: 1" in table
+    assert "unmanaged: 3" in table
@@ -1,7 +1,9 @@
 """Tests for dtool utils."""
 
 import os
+import sys
 
+import pytest
 import yaml
 
 from . import tmp_dir_fixture  # NOQA
@@ -52,3 +54,63 @@ def test_auto_metadata_generation():
         {"date": str(datetime.date.today()),
          "owner_username": username,
          "owner_email": email}
+
+
+def test_human_readable_size():
+    from dtool.utils import human_readable_size
+
+    assert human_readable_size(0) == "0 B"
+    assert human_readable_size(1023) == "1023 B"
+    assert human_readable_size(1024) == "1.0 KiB"
+    assert human_readable_size(3 * 2**30) == "3.0 GiB"
+
+
+def test_template_cache(tmp_dir_fixture):  # NOQA
+    from dtool.utils import TemplateCache
+
+    cache = TemplateCache()
+    variables = cache.get_variables("dtool_dataset_README.yml")
+    assert "dataset_name" in variables
+    assert cache.stats() == dict(hits=0, misses=1, size=1)
+
+    template = cache.get_template("dtool_dataset_README.yml")
+    assert "my_dataset" in template.render(dataset_name="my_dataset")
+    assert cache.stats() == dict(hits=1, misses=1, size=1)
+
+    cache.clear()
+    assert cache.stats() == dict(hits=0, misses=0, size=0)
+
+
+def test_template_cache_reloads_changed_template(tmp_dir_fixture, mocker):  # NOQA
+    import jinja2
+    from dtool.utils import TemplateCache
+
+    fpath = os.path.join(tmp_dir_fixture, "test.j2")
+    with open(fpath, "w") as fh:
+        fh.write("{{ a }}")
+    mocker.patch(
+        "dtool.utils._JINJA2_ENV",
+        jinja2.Environment(loader=jinja2.FileSystemLoader(tmp_dir_fixture)))
+
+    cache = TemplateCache()
+    assert cache.get_variables("test.j2") == set(["a"])
+    assert cache.get_variables("test.j2") == set(["a"])
+    assert cache.stats()["hits"] == 1
+
+    with open(fpath, "w") as fh:
+        fh.write("{{ a }} {{ b }}")
+    os.utime(fpath, (1000000000, 1000000000))
+    assert cache.get_template("test.j2").render(a=1, b=2) == "1 2"
+    assert cache.get_variables("test.j2") == set(["a", "b"])
+    assert cache.stats() == dict(hits=2, misses=2, size=1)
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7),
+                    reason="module __getattr__ needs Python 3.7")
+def test_jinja2_env_compatibility():
+    import dtool.utils
+
+    assert dtool.utils.JINJA2_ENV is dtool.utils.get_jinja2_env()
+    assert dtool.utils.JINJA2_ENV.get_template("base.yml.j2") is not None
+    with pytest.raises(AttributeError):
+        dtool.utils.NO_SUCH_ATTRIBUTE
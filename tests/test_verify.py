@@ -0,0 +1,95 @@
+"""Tests for the dtool verify module."""
+
+import os
+
+import pytest
+
+from . import create_dataset, tmp_dir_fixture  # NOQA
+
+
+def _modify(path):
+    """Delete, add, resize and corrupt one file each."""
+    data_dir = os.path.join(path, "data")
+    os.unlink(os.path.join(data_dir, "random_bytes"))
+    with open(os.path.join(data_dir, "extra.txt"), "w") as fh:
+        fh.write("extra")
+    with open(os.path.join(data_dir, "real_text_file.txt"), "a") as fh:
+        fh.write("appended")
+
+    # Same size and mtime, different content.
+    fpath = os.path.join(data_dir, "tiny.png")
+    stat_result = os.stat(fpath)
+    with open(fpath, "rb") as fh:
+        content = fh.read()
+    with open(fpath, "wb") as fh:
+        fh.write(content[:-1] + b"\0")
+    os.utime(fpath, (stat_result.st_atime, stat_result.st_mtime))
+
+
+@pytest.mark.parametrize("mode", ["full", "quick", "sampled"])
+def test_verify_unchanged_dataset(tmp_dir_fixture, mode):  # NOQA
+    from dtoolcore import DataSet
+    from dtool.verify import verify_dataset
+
+    dataset = create_dataset(tmp_dir_fixture, update=DataSet.update_manifest)
+    result = verify_dataset(dataset, mode=mode, workers=2)
+    assert result.ok
+    assert result.as_dict() == dict(missing=[], changed=[], extra=[])
+
+
+def test_verify_full_and_quick(tmp_dir_fixture):  # NOQA
+    from dtoolcore import DataSet
+    from dtool.verify import verify_dataset
+
+    dataset = create_dataset(tmp_dir_fixture, update=DataSet.update_manifest)
+    _modify(tmp_dir_fixture)
+
+    result = verify_dataset(dataset, mode="full", workers=2)
+    assert not result.ok
+    assert result.as_dict() == dict(
+        missing=["random_bytes"],
+        changed=["real_text_file.txt", "tiny.png"],
+        extra=["extra.txt"])
+
+    # Quick mode cannot see the change to tiny.png.
+    result = verify_dataset(dataset, mode="quick")
+    assert result.as_dict()["changed"] == ["real_text_file.txt"]
+
+
+def test_verify_sampled(tmp_dir_fixture, mocker):  # NOQA
+    import dtool.verify
+    from dtoolcore import DataSet
+    from dtool.verify import verify_dataset
+
+    dataset = create_dataset(tmp_dir_fixture, update=DataSet.update_manifest)
+
+    spy = mocker.spy(dtool.verify, "_file_hash")
+    verify_dataset(dataset, mode="sampled", percent=50, seed=3)
+    first = sorted(call[0][0][2] for call in spy.call_args_list)
+    assert len(first) == 3
+
+    spy.reset_mock()
+    verify_dataset(dataset, mode="sampled", percent=50, seed=3)
+    second = sorted(call[0][0][2] for call in spy.call_args_list)
+    assert first == second
+
+
+def test_verify_fail_fast(tmp_dir_fixture):  # NOQA
+    from dtoolcore import DataSet
+    from dtool.verify import verify_dataset
+
+    dataset = create_dataset(tmp_dir_fixture, update=DataSet.update_manifest)
+    _modify(tmp_dir_fixture)
+
+    result = verify_dataset(dataset, fail_fast=True)
+    problems = result.missing + result.changed + result.extra
+    assert len(problems) == 1
+
+
+def test_verify_unknown_mode(tmp_dir_fixture):  # NOQA
+    from dtoolcore import DataSet
+    from dtool.verify import verify_dataset
+
+    dataset = create_dataset(tmp_dir_fixture, update=DataSet.update_manifest)
+    with pytest.raises(ValueError):
+        verify_dataset(dataset, mode="thorough")
@@ -0,0 +1,97 @@
+"""Tests for the dtool walk module."""
+
+import os
+
+from . import tmp_dir_fixture  # NOQA
+
+
+def _touch(*parts):
+    fpath = os.path.join(*parts)
+    dirname = os.path.dirname(fpath)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(fpath, "w") as fh:
+        fh.write(fpath)
+
+
+def test_ignore_patterns():
+    from dtool.walk import IgnorePatterns
+
+    ignore = IgnorePatterns([
+        "# Comment\n",
+        "\n",
+        ".DS_Store\n",
+        "*.tmp\n",
+        "scratch/\n",
+        "/top_only.txt\n",
+        "logs/**/*.log\n",
+        "!keep.tmp\n",
+    ])
+    assert len(ignore) == 6
+
+    assert ignore.is_ignored(".DS_Store")
+    assert ignore.is_ignored("a/b/.DS_Store")
+    assert ignore.is_ignored("a/b/c.tmp")
+    assert not ignore.is_ignored("a/b/c.tmpx")
+    assert not ignore.is_ignored("keep.tmp")
+
+    assert ignore.is_ignored("a/scratch", is_dir=True)
+    assert not ignore.is_ignored("a/scratch", is_dir=False)
+
+    assert ignore.is_ignored("top_only.txt")
+    assert not ignore.is_ignored("a/top_only.txt")
+
+    assert ignore.is_ignored("logs/run.log")
+    assert ignore.is_ignored("logs/2017/01/run.log")
+    assert not ignore.is_ignored("other/logs/run.log")
+
+
+def test_ignore_patterns_from_missing_file(tmp_dir_fixture):  # NOQA
+    from dtool.walk import IgnorePatterns
+
+    ignore = IgnorePatterns.from_path(
+        os.path.join(tmp_dir_fixture, ".dtoolignore"))
+    assert len(ignore) == 0
+    assert not ignore.is_ignored("anything")
+
+
+def test_walk_files_same_as_os_walk(tmp_dir_fixture):  # NOQA
+    from dtool.walk import walk_files
+
+    _touch(tmp_dir_fixture, "a.txt")
+    _touch(tmp_dir_fixture, "README.yml")
+    _touch(tmp_dir_fixture, ".dtool", "manifest.json")
+    _touch(tmp_dir_fixture, "dir1", "b.txt")
+    _touch(tmp_dir_fixture, "dir1", "dir2", "c.txt")
+    _touch(tmp_dir_fixture, "dir3", "d.txt")
+
+    expected = []
+    for dirpath, dirnames, filenames in os.walk(tmp_dir_fixture):
+        for fn in filenames:
+            fpath = os.path.join(dirpath, fn)
+            rel_path = os.path.relpath(fpath, tmp_dir_fixture)
+            if not rel_path.startswith((".dtool", "README.yml")):
+                expected.append(rel_path)
+
+    actual = list(walk_files(
+        tmp_dir_fixture, ignore_prefixes=[".dtool", "README.yml"]))
+    assert actual == expected
+    assert len(actual) == 4
+
+
+def test_walk_files_prunes_ignored_directories(tmp_dir_fixture, mocker):  # NOQA
+    import dtool.walk
+    from dtool.walk import IgnorePatterns, walk_files
+
+    _touch(tmp_dir_fixture, "keep.txt")
+    _touch(tmp_dir_fixture, "junk.tmp")
+    _touch(tmp_dir_fixture, "scratch", "deep", "lots.txt")
+    _touch(tmp_dir_fixture, "data", "keep.txt")
+
+    spy = mocker.spy(dtool.walk, "scandir")
+    ignore = IgnorePatterns(["*.tmp", "scratch/"])
+    actual = sorted(walk_files(tmp_dir_fixture, ignore))
+
+    assert actual == ["data{}keep.txt".format(os.sep), "keep.txt"]
+    scanned = [call[0][0] for call in spy.call_args_list]
+    assert not any("scratch" in path for path in scanned)
@@ -0,0 +1,98 @@
+"""Tests for the dtool watch module."""
+
+import os
+import time
+
+import pytest
+
+from dtool.watch import inotify_available
+
+from . import create_dataset, tmp_dir_fixture  # NOQA
+
+
+pytestmark = pytest.mark.skipif(
+    not inotify_available(),
+    reason="inotify is not available")
+
+
+def _poll_until(watcher, condition, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        watcher.poll(0.05)
+        if condition():
+            return
+    raise AssertionError("Timed out waiting for the watcher")
+
+
+def _paths(path):
+    from dtoolcore import DataSet
+    file_list = DataSet.from_path(path).manifest["file_list"]
+    return sorted(entry["path"] for entry in file_list)
+
+
+def test_manifest_watcher(tmp_dir_fixture):  # NOQA
+    from dtoolcore import DataSet
+    from dtool.watch import ManifestWatcher
+
+    dataset = create_dataset(tmp_dir_fixture, update=DataSet.update_manifest)
+    data_dir = os.path.join(tmp_dir_fixture, "data")
+
+    # Changes made while not watching are caught up with on start.
+    os.unlink(os.path.join(data_dir, "empty_file"))
+
+    watcher = ManifestWatcher(dataset, debounce=0.1, flush_interval=0.2)
+    watcher.start()
+    try:
+        assert "empty_file" not in _paths(tmp_dir_fixture)
+        num_flushes = watcher.num_flushes
+
+        with open(os.path.join(data_dir, "new.txt"), "w") as fh:
+            fh.write("new")
+        os.makedirs(os.path.join(data_dir, "sub", "dir"))
+        with open(os.path.join(data_dir, "sub", "dir", "deep.txt"), "w") as fh:
+            fh.write("deep")
+        os.unlink(os.path.join(data_dir, "tiny.png"))
+        os.rename(os.path.join(data_dir, "random_bytes"),
+                  os.path.join(data_dir, "sub", "random_bytes"))
+
+        expected = [
+            "actually_a_png.txt",
+            "actually_a_text_file.jpg",
+            "new.txt",
+            "real_text_file.txt",
+            os.path.join("sub", "dir", "deep.txt"),
+            os.path.join("sub", "random_bytes"),
+        ]
+        _poll_until(watcher, lambda: _paths(tmp_dir_fixture) == expected)
+        assert watcher.num_flushes > num_flushes
+
+        # Nothing is written when nothing has changed.
+        num_flushes = watcher.num_flushes
+        time.sleep(0.3)
+        watcher.poll(0.05)
+        assert watcher.num_flushes == num_flushes
+    finally:
+        watcher.close()
+
+    dataset = DataSet.from_path(tmp_dir_fixture)
+    overlays = dataset.access_overlays()
+    hashes = dict((entry["path"], entry["hash"])
+                  for entry in dataset.manifest["file_list"])
+    assert overlays["mimetype"][hashes["new.txt"]] == "text/plain"
+
+
+def test_manifest_watcher_close_hashes_pending_files(tmp_dir_fixture):  # NOQA
+    from dtoolcore import DataSet
+    from dtool.watch import ManifestWatcher
+
+    dataset = create_dataset(tmp_dir_fixture, update=DataSet.update_manifest)
+    watcher = ManifestWatcher(dataset, debounce=60, flush_interval=60)
+    watcher.start()
+    try:
+        with open(os.path.join(tmp_dir_fixture, "data", "new.txt"), "w") as fh:
+            fh.write("new")
+        watcher.poll(0.2)
+        assert "new.txt" not in _paths(tmp_dir_fixture)
+    finally:
+        watcher.close()
+    assert "new.txt" in _paths(tmp_dir_fixture)